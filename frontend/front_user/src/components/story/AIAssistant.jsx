@@ -276,6 +276,7 @@ export default function AIAssistant({ story, currentSegment }) {
         },
         body: JSON.stringify({
           message: userMessage,
+          story_id: story?.story_id ?? story?._id,
           story_context: fullStoryText
         })
       });
@@ -1,15 +1,19 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 import requests
 from datetime import datetime
 import time
 from collections import defaultdict
 import threading
+import json
 import logging
 import os
 import re
 
 from monitoring import monitoring
+from response_cache import response_cache_from_env
+from precomputed_answers import precomputed_answers_from_env, CANNED_QUESTIONS
+from story_retrieval import story_catalogue_from_env, story_retriever_from_env
 
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": "*"}})
@@ -37,6 +41,16 @@ OLLAMA_TIMEOUT = int(os.getenv("OLLAMA_TIMEOUT", "300"))
 MAX_REQUESTS_PER_MINUTE = int(os.getenv("MAX_REQUESTS_PER_MINUTE", "30"))
 MAX_REQUESTS_PER_DAY = int(os.getenv("MAX_REQUESTS_PER_DAY", "1000"))
 
+# Answers to repeated story questions (CHAT_CACHE_* variables, see response_cache.py)
+response_cache = response_cache_from_env(OLLAMA_URL)
+
+# Answers pregenerated offline for the catalogue stories (see precomputed_answers.py)
+precomputed_answers = precomputed_answers_from_env()
+
+# Story lookup by id and passage retrieval for the chat prompts (see story_retrieval.py)
+story_catalogue = story_catalogue_from_env()
+story_retriever = story_retriever_from_env(OLLAMA_URL)
+
 # Rate limiting storage
 _rate_limit_lock = threading.RLock()
 rate_limit_storage = defaultdict(lambda: {'minute': [], 'day': []})
@@ -118,6 +132,83 @@ def check_ollama_status():
     
     return status
 
+def request_story_context(data):
+    """Story text of a request: looked up by story_id when given, else the story_context sent"""
+    story_id = data.get('story_id')
+    if story_id is not None and story_catalogue is not None:
+        text = story_catalogue.text(story_id)
+        if text:
+            return text
+    return data.get('story_context', '')
+
+# Labels the model sometimes prefixes its lines with ("Answer: ...")
+CHAT_REPLY_LABELS = ('answer', 'explanation', 'response')
+WORD_EXPLANATION_LABELS = ('explanation', 'response')
+
+def clean_reply(text, labels):
+    """Remove the labels starting the reply or any of its lines"""
+    pattern = r'(^|[\n])(' + '|'.join(labels) + r'):\s*'
+    return re.sub(pattern, '\\1', text, flags=re.IGNORECASE)
+
+class StreamingCleaner:
+    """
+    Incremental strip() + clean_reply() of a reply received token by token.
+
+    Text is released as soon as it can no longer change: leading whitespace
+    is dropped, trailing whitespace is held until more text follows, and the
+    start of a line is held only while it could still be a label.
+    """
+
+    def __init__(self, labels):
+        self.labels = [label + ':' for label in labels]
+        self.pattern = re.compile(r'(' + '|'.join(labels) + r'):\s*', re.IGNORECASE)
+        self.started = False     # Leading whitespace already dropped
+        self.whitespace = ''     # Trailing whitespace not released yet
+        self.line_start = True   # self.pending starts a line
+        self.pending = ''        # Text not released yet
+
+    def feed(self, text):
+        """Cleaned text that can be sent for this token (may be empty)"""
+        if not self.started:
+            text = text.lstrip()
+            self.started = bool(text)
+        body = text.rstrip()
+        if not body:
+            self.whitespace += text
+            return ''
+        self.pending += self.whitespace + body
+        self.whitespace = text[len(body):]
+        return self._release()
+
+    def flush(self):
+        """Remaining cleaned text at the end of the reply"""
+        text, self.pending = self.pending, ''
+        if self.line_start:
+            match = self.pattern.match(text)
+            if match:
+                text = text[match.end():]
+        return text
+
+    def _release(self):
+        out = []
+        while self.pending:
+            if self.line_start:
+                match = self.pattern.match(self.pending)
+                if match and match.end() < len(self.pending):
+                    self.pending = self.pending[match.end():]
+                elif match or any(label.startswith(self.pending.lower()) for label in self.labels):
+                    break  # Could still be a label
+                self.line_start = False
+            newline = self.pending.find('\n')
+            if newline < 0:
+                out.append(self.pending)
+                self.pending = ''
+            else:
+                out.append(self.pending[:newline + 1])
+                self.pending = self.pending[newline + 1:]
+                self.line_start = True
+        return ''.join(out)
+
 # ✅ تحسين: دالة جديدة لكشف نوع السؤال
 def detect_question_type(user_message):
     """Detect the type of question to provide better formatting"""
@@ -344,71 +435,95 @@ ANSWER:"""
 
     return prompt
 
-def call_ollama(user_message, story_context):
-    """✅ تحسين: Call Ollama API with enhanced prompts"""
+def build_chat_payload(user_message, story_context, question_type):
+    """Ollama generate request (without "stream") for a chat question"""
+    # Only the passages relevant to the question, except for the question
+    # types about the whole story (see precomputed_answers.py)
+    if story_retriever is not None and question_type not in CANNED_QUESTIONS:
+        story_context = story_retriever.story_context(user_message, story_context)
+    
+    prompt = build_enhanced_prompt(user_message, story_context, question_type)
+    
+    # ✅ تحسين: Adjust parameters based on question complexity
+    is_complex = question_type in ['comparison', 'summary', 'lesson', 'imagination']
+    
+    temperature = 0.6 if is_complex else 0.5
+    max_tokens = 500 if is_complex else 350
+    
+    return {
+        "model": MODEL_NAME,
+        "prompt": prompt,
+        "options": {
+            "temperature": temperature,
+            "num_predict": max_tokens,
+            "top_p": 0.9,
+            "repeat_penalty": 1.2,
+            "num_thread": 4
+        }
+    }
+
+CHAT_FALLBACK_REPLY = "Sorry, I couldn't answer that! Try asking differently! 😊"
+
+def start_chat(user_message, story_context, streamed=False):
+    """Question type and Ollama payload of a chat question (tracks the request)"""
     
     question_type = detect_question_type(user_message)
     
     monitoring.track_event('chat_request', {
         'message_length': len(user_message),
         'model': MODEL_NAME,
-        'question_type': question_type  # ✅ تحسين: track question type
+        'question_type': question_type,  # ✅ تحسين: track question type
+        'streamed': streamed
     })
     
+    return question_type, build_chat_payload(user_message, story_context, question_type)
+
+def chat_result(user_message, question_type, generated, response_time):
+    """Cleaned reply of a chat generation, tracked as an inference"""
+    # ✅ تحسين: Better cleanup
+    reply = clean_reply(generated.strip(), CHAT_REPLY_LABELS)
+    
+    # Empty generation: the fallback reply, never cached
+    fallback = not reply
+    if fallback:
+        reply = CHAT_FALLBACK_REPLY
+    
+    monitoring.track_inference(
+        model=MODEL_NAME,
+        prompt_tokens=len(user_message.split()),
+        response_tokens=len(reply.split()),
+        duration=response_time * 1000,
+        success=True,
+        question_type=question_type  # ✅ تحسين: track type
+    )
+    
+    return {
+        'reply': reply,
+        'response_time': response_time,
+        'status': 'success',
+        'question_type': question_type,  # ✅ تحسين: return type
+        'fallback': fallback
+    }
+
+def call_ollama(user_message, story_context):
+    """✅ تحسين: Call Ollama API with enhanced prompts"""
+    
+    question_type, payload = start_chat(user_message, story_context)
+    
     try:
         start_time = time.time()
-        prompt = build_enhanced_prompt(user_message, story_context, question_type)
-        
-        # ✅ تحسين: Adjust parameters based on question complexity
-        is_complex = question_type in ['comparison', 'summary', 'lesson', 'imagination']
-        
-        temperature = 0.6 if is_complex else 0.5
-        max_tokens = 500 if is_complex else 350
         
         # Call Ollama
         response = requests.post(
             OLLAMA_URL,
-            json={
-                "model": MODEL_NAME,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": temperature,
-                    "num_predict": max_tokens,
-                    "top_p": 0.9,
-                    "repeat_penalty": 1.2,
-                    "num_thread": 4
-                }
-            },
+            json={**payload, "stream": False},
             timeout=OLLAMA_TIMEOUT
         )
         
         response_time = round(time.time() - start_time, 2)
         
         if response.status_code == 200:
-            reply = response.json().get('response', '').strip()
-            
-            if not reply:
-                reply = "Sorry, I couldn't answer that! Try asking differently! 😊"
-            
-            # ✅ تحسين: Better cleanup
-            reply = re.sub(r'(^|[\n])(answer|explanation|response):\s*', '\\1', reply, flags=re.IGNORECASE)
-            
-            monitoring.track_inference(
-                model=MODEL_NAME,
-                prompt_tokens=len(user_message.split()),
-                response_tokens=len(reply.split()),
-                duration=response_time * 1000,
-                success=True,
-                question_type=question_type  # ✅ تحسين: track type
-            )
-            
-            return {
-                'reply': reply,
-                'response_time': response_time,
-                'status': 'success',
-                'question_type': question_type  # ✅ تحسين: return type
-            }
+            return chat_result(user_message, question_type, response.json().get('response', ''), response_time)
         else:
             error_msg = f"Ollama error {response.status_code}"
             monitoring.track_error('OllamaError', error_msg, {'status_code': response.status_code})
@@ -426,6 +541,44 @@ def call_ollama(user_message, story_context):
         monitoring.track_error('OllamaException', str(e))
         return {'error': str(e), 'status': 'error'}
 
+def lookup_cached_reply(user_message, story_context, embed=True):
+    """Response cache lookup of a chat question (None when the cache is disabled, see ResponseCache.lookup)"""
+    if response_cache is None:
+        return None
+    return response_cache.lookup(story_context, detect_question_type(user_message), user_message, embed)
+
+def cached_chat_result(lookup):
+    """Chat result of a response cache hit, without calling Ollama"""
+    monitoring.track_event('chat_cache_hit', {
+        'question_type': lookup.question_type,
+        'semantic': lookup.semantic
+    })
+    return {
+        'reply': lookup.reply,
+        'response_time': 0,
+        'status': 'success',
+        'question_type': lookup.question_type,
+        'cached': True
+    }
+
+def precomputed_chat_result(user_message, story_context):
+    """Chat result of a pregenerated answer to the question (None when there is none)"""
+    if precomputed_answers is None:
+        return None
+    question_type = detect_question_type(user_message)
+    reply = precomputed_answers.chat_reply(story_context, question_type, user_message)
+    if reply is None:
+        return None
+    monitoring.track_event('chat_precomputed_hit', {'question_type': question_type})
+    return {
+        'reply': reply,
+        'response_time': 0,
+        'status': 'success',
+        'question_type': question_type,
+        'cached': True,
+        'precomputed': True
+    }
+
 # ✅ تحسين: دالة محسنة لشرح الكلمات
 def build_word_explanation_prompt(word, story_context):
     """✅ تحسين: Enhanced word explanation prompt"""
@@ -462,45 +615,61 @@ EXPLANATION:"""
     
     return prompt
 
-def call_ollama_word_explanation(word, story_context):
-    """✅ تحسين: Enhanced word explanation call"""
+def build_word_payload(word, story_context):
+    """Ollama generate request (without "stream") for a word explanation"""
+    return {
+        "model": MODEL_NAME,
+        "prompt": build_word_explanation_prompt(word, story_context),
+        "options": {
+            "temperature": 0.6,
+            "num_predict": 250,
+            "top_p": 0.9
+        }
+    }
+
+def word_fallback_explanation(word):
+    return f"The word '{word}' means something special! 📚 Try asking in the story context!"
+
+def start_word_explanation(word, story_context, streamed=False):
+    """Ollama payload of a word explanation (tracks the request)"""
     
     monitoring.track_event('word_explanation_requested', {
         'word': word,
-        'has_context': bool(story_context)
+        'has_context': bool(story_context),
+        'streamed': streamed
     })
     
+    return build_word_payload(word, story_context)
+
+def word_result(word, generated):
+    """Cleaned explanation of a word explanation generation"""
+    explanation = generated.strip()
+    
+    if not explanation:
+        explanation = word_fallback_explanation(word)
+    
+    # Cleanup
+    explanation = clean_reply(explanation, WORD_EXPLANATION_LABELS)
+    
+    return {
+        'explanation': explanation,
+        'status': 'success'
+    }
+
+def call_ollama_word_explanation(word, story_context):
+    """✅ تحسين: Enhanced word explanation call"""
+    
+    payload = start_word_explanation(word, story_context)
+    
     try:
-        prompt = build_word_explanation_prompt(word, story_context)
-        
         response = requests.post(
             OLLAMA_URL,
-            json={
-                "model": MODEL_NAME,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.6,
-                    "num_predict": 250,
-                    "top_p": 0.9
-                }
-            },
+            json={**payload, "stream": False},
             timeout=OLLAMA_TIMEOUT
         )
         
         if response.status_code == 200:
-            explanation = response.json().get('response', '').strip()
-            
-            if not explanation:
-                explanation = f"The word '{word}' means something special! 📚 Try asking in the story context!"
-            
-            # Cleanup
-            explanation = re.sub(r'(^|[\n])(explanation|response):\s*', '\\1', explanation, flags=re.IGNORECASE)
-            
-            return {
-                'explanation': explanation,
-                'status': 'success'
-            }
+            return word_result(word, response.json().get('response', ''))
         else:
             return {'error': 'Failed to explain word', 'status': 'error'}
     
@@ -509,6 +678,178 @@ def call_ollama_word_explanation(word, story_context):
     except Exception as e:
         return {'error': str(e), 'status': 'error'}
 
+def precomputed_word_result(word, story_context):
+    """Word explanation result of a pregenerated explanation (None when there is none)"""
+    if precomputed_answers is None:
+        return None
+    explanation = precomputed_answers.word_explanation(story_context, word)
+    if explanation is None:
+        return None
+    monitoring.track_event('word_explanation_precomputed_hit', {'word': word})
+    return {
+        'word': word,
+        'explanation': explanation,
+        'response_time': 0,
+        'status': 'success',
+        'precomputed': True
+    }
+
+# ================= STREAMING =================
+
+class OllamaStreamError(Exception):
+    """Error status or error message of a streamed Ollama generation"""
+
+def stream_ollama(payload):
+    """Yield the tokens of a streamed Ollama generation as they arrive"""
+    with requests.post(OLLAMA_URL, json={**payload, "stream": True}, stream=True,
+                       timeout=OLLAMA_TIMEOUT) as response:
+        if response.status_code != 200:
+            raise OllamaStreamError(f"Ollama error {response.status_code}")
+        # Closing the generator (client gone) closes the connection,
+        # which makes Ollama stop the generation
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if chunk.get('error'):
+                raise OllamaStreamError(chunk['error'])
+            if chunk.get('response'):
+                yield chunk['response']
+            if chunk.get('done'):
+                break
+
+def sse_event(data, event=None):
+    """Server-Sent Event carrying a JSON payload"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+class ReplyStream:
+    """
+    SSE events of a streamed generation, fed with the raw Ollama tokens:
+    one default event {"token": ...} per piece of cleaned text, then a
+    "done" event with finish(reply, response_time, first_token_time,
+    fallback), fallback being True when the reply is the fallback text
+    sent for an empty generation.
+    Shared by the Flask routes and the asyncio server (asgi.py).
+    """
+
+    def __init__(self, labels, fallback, finish):
+        self.cleaner = StreamingCleaner(labels)
+        self.fallback = fallback
+        self.finish = finish
+        self.start_time = time.time()
+        self.first_token_time = None
+        self.parts = []
+
+    def token(self, token):
+        text = self.cleaner.feed(token)
+        return [self._token_event(text)] if text else []
+
+    def end(self):
+        events = []
+        text = self.cleaner.flush()
+        if text:
+            events.append(self._token_event(text))
+        fallback = not self.parts
+        if fallback:
+            events.append(self._token_event(self.fallback))
+        response_time = round(time.time() - self.start_time, 2)
+        events.append(sse_event(self.finish(''.join(self.parts), response_time, self.first_token_time, fallback),
+                                'done'))
+        return events
+
+    def _token_event(self, text):
+        if self.first_token_time is None:
+            self.first_token_time = round(time.time() - self.start_time, 2)
+        self.parts.append(text)
+        return sse_event({'token': text})
+
+def stream_reply(payload, stream):
+    """SSE events of a ReplyStream fed by a streamed Ollama generation (or an "error" event)"""
+    try:
+        for token in stream_ollama(payload):
+            yield from stream.token(token)
+        yield from stream.end()
+    
+    except requests.exceptions.ConnectionError as e:
+        monitoring.track_error('OllamaConnectionError', str(e))
+        yield sse_event({'error': f'Cannot connect to Ollama at {OLLAMA_URL}', 'status': 'error'}, 'error')
+    
+    except requests.exceptions.Timeout:
+        monitoring.track_error('OllamaTimeout', f'Timeout after {OLLAMA_TIMEOUT}s')
+        yield sse_event({'error': 'Request timeout (model processing)', 'status': 'timeout'}, 'error')
+    
+    except OllamaStreamError as e:
+        monitoring.track_error('OllamaError', str(e))
+        yield sse_event({'error': str(e), 'status': 'error'}, 'error')
+    
+    except Exception as e:
+        monitoring.track_error('OllamaException', str(e))
+        yield sse_event({'error': str(e), 'status': 'error'}, 'error')
+
+def chat_reply_stream(user_message, story_context, lookup=None):
+    """(Ollama payload, ReplyStream) of a streamed chat answer, stored in the cache `lookup` missed"""
+    question_type, payload = start_chat(user_message, story_context, streamed=True)
+    
+    def finish(reply, response_time, first_token_time, fallback):
+        if lookup is not None and not fallback:
+            lookup.store(reply)
+        monitoring.track_inference(
+            model=MODEL_NAME,
+            prompt_tokens=len(user_message.split()),
+            response_tokens=len(reply.split()),
+            duration=response_time * 1000,
+            success=True,
+            question_type=question_type,
+            first_token_ms=first_token_time * 1000
+        )
+        return {
+            'reply': reply,
+            'response_time': response_time,
+            'time_to_first_token': first_token_time,
+            'question_type': question_type,
+            'fallback': fallback,
+            'timestamp': datetime.now().isoformat(),
+            'status': 'success'
+        }
+    
+    return payload, ReplyStream(CHAT_REPLY_LABELS, CHAT_FALLBACK_REPLY, finish)
+
+def word_explanation_stream(word, story_context):
+    """(Ollama payload, ReplyStream) of a streamed word explanation"""
+    payload = start_word_explanation(word, story_context, streamed=True)
+    
+    def finish(explanation, response_time, first_token_time, fallback):
+        monitoring.track_inference(
+            model=MODEL_NAME,
+            prompt_tokens=len(word.split()),
+            response_tokens=len(explanation.split()),
+            duration=response_time * 1000,
+            success=True,
+            question_type='word_explanation',
+            first_token_ms=first_token_time * 1000
+        )
+        return {
+            'word': word,
+            'explanation': explanation,
+            'response_time': response_time,
+            'time_to_first_token': first_token_time,
+            'status': 'success'
+        }
+    
+    return payload, ReplyStream(WORD_EXPLANATION_LABELS, word_fallback_explanation(word), finish)
+
+def cached_reply_events(result, field='reply'):
+    """SSE events of a cached or pregenerated result: the whole text as one token, then the "done" event"""
+    yield sse_event({'token': result[field]})
+    yield sse_event({**result, 'time_to_first_token': 0, 'timestamp': datetime.now().isoformat()}, 'done')
+
+def sse_response(events):
+    return Response(stream_with_context(events), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # No proxy buffering (nginx)
+    })
+
 # ================= ENDPOINTS =================
 
 @app.route('/api/health', methods=['GET'])
@@ -556,7 +897,10 @@ def get_stats():
         'requests_today': daily,
         'remaining_today': remaining,
         'max_per_day': MAX_REQUESTS_PER_DAY,
-        'model': MODEL_NAME
+        'model': MODEL_NAME,
+        'response_cache': response_cache.stats() if response_cache else None,
+        'precomputed_answers': precomputed_answers.stats() if precomputed_answers else None,
+        'story_retrieval': story_retriever.stats() if story_retriever else None
     }), 200
 
 @app.route('/api/chat', methods=['POST'])
@@ -572,25 +916,37 @@ def chat():
         # Get request data
         data = request.json or {}
         user_message = data.get('message', '').strip()
-        story_context = data.get('story_context', '')
+        story_context = request_story_context(data)
         
         if not user_message:
             return jsonify({'error': 'Message required'}), 400
         
-        # Check Ollama
-        if not check_ollama_status():
-            return jsonify({'error': 'Ollama not reachable', 'status': 'error'}), 503
-        
-        # Call Ollama
-        result = call_ollama(user_message, story_context)
-        
-        if result.get('status') == 'error':
-            return jsonify(result), 500
+        # Pregenerated answer, or same question already answered for this story: no Ollama call
+        result = precomputed_chat_result(user_message, story_context)
+        if result is None:
+            lookup = lookup_cached_reply(user_message, story_context)
+            if lookup is not None and lookup.hit:
+                result = cached_chat_result(lookup)
+        if result is None:
+            # Check Ollama
+            if not check_ollama_status():
+                return jsonify({'error': 'Ollama not reachable', 'status': 'error'}), 503
+            
+            # Call Ollama
+            result = call_ollama(user_message, story_context)
+            
+            if result.get('status') == 'error':
+                return jsonify(result), 500
+            if lookup is not None and result.get('status') == 'success' and not result.get('fallback'):
+                lookup.store(result['reply'])
         
         return jsonify({
             'reply': result['reply'],
             'response_time': result.get('response_time', 0),
             'question_type': result.get('question_type'),  # ✅ تحسين: return type
+            'cached': result.get('cached', False),
+            'precomputed': result.get('precomputed', False),
+            'fallback': result.get('fallback', False),
             'timestamp': datetime.now().isoformat(),
             'status': 'success'
         }), 200
@@ -600,6 +956,41 @@ def chat():
         monitoring.track_error('ChatEndpointError', str(e))
         return jsonify({'error': str(e), 'status': 'error'}), 500
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Same as /api/chat, streamed as Server-Sent Events as the model generates"""
+    try:
+        client_ip = get_client_ip()
+        allowed, err = check_rate_limit(client_ip)
+        if not allowed:
+            monitoring.track_error('RateLimitExceeded', err, {'client_ip': client_ip})
+            return jsonify({'error': err, 'status': 'rate_limit_exceeded'}), 429
+        
+        data = request.json or {}
+        user_message = data.get('message', '').strip()
+        story_context = request_story_context(data)
+        
+        if not user_message:
+            return jsonify({'error': 'Message required'}), 400
+        
+        result = precomputed_chat_result(user_message, story_context)
+        if result is not None:
+            return sse_response(cached_reply_events(result))
+        
+        lookup = lookup_cached_reply(user_message, story_context)
+        if lookup is not None and lookup.hit:
+            return sse_response(cached_reply_events(cached_chat_result(lookup)))
+        
+        if not check_ollama_status():
+            return jsonify({'error': 'Ollama not reachable', 'status': 'error'}), 503
+        
+        return sse_response(stream_reply(*chat_reply_stream(user_message, story_context, lookup)))
+    
+    except Exception as e:
+        logger.error(f"Error in /api/chat/stream: {e}")
+        monitoring.track_error('ChatEndpointError', str(e))
+        return jsonify({'error': str(e), 'status': 'error'}), 500
+
 @app.route('/api/explain-word', methods=['POST'])
 def explain_word():
     try:
@@ -612,20 +1003,24 @@ def explain_word():
         # Get data
         data = request.json or {}
         word = data.get('word', '').strip()
-        story_context = data.get('story_context', '')
+        story_context = request_story_context(data)
         
         if not word:
             return jsonify({'error': 'Word required'}), 400
         
-        if not check_ollama_status():
-            return jsonify({'error': 'Ollama not reachable'}), 503
-        
-        result = call_ollama_word_explanation(word, story_context)
+        # Pregenerated explanation of a complex word of the story: no Ollama call
+        result = precomputed_word_result(word, story_context)
+        if result is None:
+            if not check_ollama_status():
+                return jsonify({'error': 'Ollama not reachable'}), 503
+            
+            result = call_ollama_word_explanation(word, story_context)
         
         if result.get('status') == 'success':
             return jsonify({
                 'word': word,
                 'explanation': result['explanation'],
+                'precomputed': result.get('precomputed', False),
                 'status': 'success'
             }), 200
         else:
@@ -635,6 +1030,35 @@ def explain_word():
         logger.error(f"Error in /api/explain-word: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/explain-word/stream', methods=['POST'])
+def explain_word_stream():
+    """Same as /api/explain-word, streamed as Server-Sent Events"""
+    try:
+        client_ip = get_client_ip()
+        allowed, err = check_rate_limit(client_ip)
+        if not allowed:
+            return jsonify({'error': err}), 429
+        
+        data = request.json or {}
+        word = data.get('word', '').strip()
+        story_context = request_story_context(data)
+        
+        if not word:
+            return jsonify({'error': 'Word required'}), 400
+        
+        result = precomputed_word_result(word, story_context)
+        if result is not None:
+            return sse_response(cached_reply_events(result, 'explanation'))
+        
+        if not check_ollama_status():
+            return jsonify({'error': 'Ollama not reachable'}), 503
+        
+        return sse_response(stream_reply(*word_explanation_stream(word, story_context)))
+    
+    except Exception as e:
+        logger.error(f"Error in /api/explain-word/stream: {e}")
+        return jsonify({'error': str(e)}), 500
+
 # ================= ERROR HANDLERS =================
 
 @app.errorhandler(404)
@@ -0,0 +1,504 @@
+"""
+asgi.py
+Asyncio serving mode of the Story Backend (ASGI)
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5002
+
+The inference endpoints (/api/chat, /api/explain-word and their /stream
+variants) are served natively with asyncio: Ollama is called through one
+shared HTTP connection pool, at most OLLAMA_MAX_IN_FLIGHT generations run
+at a time and the other requests wait in a FIFO queue of CHAT_MAX_QUEUE
+places. When the queue is full, requests are rejected right away with a
+503 and a Retry-After header instead of piling onto the Ollama VM.
+Every other route is served by the Flask app (app.py).
+
+Run a single process: the in-flight limit protects one Ollama VM and is
+enforced per process.
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+import time
+from collections import deque
+from datetime import datetime
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import app as flask_app
+from app import (
+    OLLAMA_URL, OLLAMA_TIMEOUT, OllamaStreamError, check_rate_limit, start_chat, chat_result,
+    start_word_explanation, word_result, chat_reply_stream, word_explanation_stream, sse_event, logger,
+    lookup_cached_reply, cached_chat_result, cached_reply_events, precomputed_chat_result,
+    precomputed_word_result, request_story_context
+)
+from monitoring import monitoring
+from response_cache import OLLAMA_MAX_EMBEDDINGS, unit_vector
+
+# ================= CONFIG =================
+OLLAMA_MAX_IN_FLIGHT = int(os.getenv("OLLAMA_MAX_IN_FLIGHT", "2"))
+CHAT_MAX_QUEUE = int(os.getenv("CHAT_MAX_QUEUE", "50"))
+QUEUE_RETRY_AFTER = int(os.getenv("CHAT_QUEUE_RETRY_AFTER", "10"))  # Seconds
+QUEUE_FEEDBACK_INTERVAL = 1.0  # Seconds between queue position events
+
+# ================= INFERENCE QUEUE =================
+
+class QueueFull(Exception):
+    pass
+
+class ClientDisconnected(Exception):
+    pass
+
+class InferenceQueue:
+    """
+    At most `max_in_flight` Ollama generations at a time. The other
+    requests wait in FIFO order, at most `max_queued` of them; further
+    requests are rejected.
+
+        slot = inference_queue.enter()       # QueueFull when full
+        try:
+            await until_disconnected(request, asyncio.shield(slot))  # Our turn
+            ...
+        finally:
+            inference_queue.leave(slot)
+    """
+
+    def __init__(self, max_in_flight, max_queued):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.in_flight = 0
+        self.waiting = deque()
+        self.served = 0
+        self.rejected = 0
+
+    def enter(self):
+        """Future resolved when the request may call Ollama (already resolved if a slot is free)"""
+        slot = asyncio.get_running_loop().create_future()
+        if self.in_flight < self.max_in_flight and not self.waiting:
+            self.in_flight += 1
+            slot.set_result(None)
+        elif len(self.waiting) < self.max_queued:
+            self.waiting.append(slot)
+        else:
+            self.rejected += 1
+            raise QueueFull()
+        return slot
+
+    def position(self, slot):
+        """1-based position of a waiting request, 0 once its turn came"""
+        return 0 if slot.done() else self.waiting.index(slot) + 1
+
+    def leave(self, slot):
+        """Free the slot of a finished request, or drop a request still waiting (client gone)"""
+        if not slot.done():
+            self.waiting.remove(slot)
+            slot.cancel()
+            return
+        self.served += 1
+        if self.waiting:
+            self.waiting.popleft().set_result(None)  # The slot goes to the next request
+        else:
+            self.in_flight -= 1
+
+    def stats(self):
+        return {
+            'in_flight': self.in_flight,
+            'queued': len(self.waiting),
+            'max_in_flight': self.max_in_flight,
+            'max_queue': self.max_queued,
+            'served': self.served,
+            'rejected': self.rejected
+        }
+
+inference_queue = InferenceQueue(OLLAMA_MAX_IN_FLIGHT, CHAT_MAX_QUEUE)
+
+# Embedding calls of the semantic response cache, made before the queue:
+# short, but bounded as well
+embedding_slots = asyncio.Semaphore(OLLAMA_MAX_EMBEDDINGS)
+
+def queue_full_response():
+    monitoring.track_error('InferenceQueueFull', f'{inference_queue.max_queued} requests already waiting')
+    return JSONResponse(
+        {'error': 'Too many questions right now, please try again in a few seconds! ⏳',
+         'status': 'busy', 'queued': len(inference_queue.waiting)},
+        status_code=503, headers={'Retry-After': str(QUEUE_RETRY_AFTER)}
+    )
+
+# ================= OLLAMA =================
+
+ollama_client = None  # Shared connection pool, opened with the server
+
+async def ollama_reachable():
+    """Async version of app.check_ollama_status (same 30-second cache)"""
+    cache = flask_app._ollama_cache
+    current_time = time.time()
+
+    if current_time - cache['timestamp'] < flask_app.CACHE_TTL:
+        return cache['status']
+
+    try:
+        base_url = OLLAMA_URL.replace('/api/generate', '')
+        response = await ollama_client.get(f"{base_url}/api/tags", timeout=5)
+        status = response.status_code == 200
+    except Exception as e:
+        logger.error(f"Ollama unreachable: {e}")
+        status = False
+
+    cache['status'] = status
+    cache['timestamp'] = current_time
+
+    return status
+
+async def embed(embedding, text):
+    """Async app.response_cache.embed(text), on the shared connection pool"""
+    try:
+        async with embedding_slots:
+            response = await ollama_client.post(embedding.url, json=embedding.request(text),
+                                                timeout=embedding.timeout)
+        vector = response.json().get('embedding') if response.status_code == 200 else None
+    except Exception as e:
+        logger.error(f"Embedding error: {e}")
+        return None
+    return unit_vector(vector)
+
+def ollama_error(e):
+    """Error result of a failed Ollama call (tracked)"""
+    if isinstance(e, httpx.ConnectError):
+        monitoring.track_error('OllamaConnectionError', str(e))
+        return {'error': f'Cannot connect to Ollama at {OLLAMA_URL}', 'status': 'error'}
+    if isinstance(e, httpx.TimeoutException):
+        monitoring.track_error('OllamaTimeout', f'Timeout after {OLLAMA_TIMEOUT}s')
+        return {'error': 'Request timeout (model processing)', 'status': 'timeout'}
+    if isinstance(e, OllamaStreamError):
+        monitoring.track_error('OllamaError', str(e))
+        return {'error': str(e), 'status': 'error'}
+    monitoring.track_error('OllamaException', str(e))
+    return {'error': str(e), 'status': 'error'}
+
+async def generate(payload, result):
+    """result(generated text, response time) of a blocking (non-streamed) generation"""
+    try:
+        start_time = time.time()
+        response = await ollama_client.post(OLLAMA_URL, json={**payload, "stream": False})
+        response_time = round(time.time() - start_time, 2)
+
+        if response.status_code == 200:
+            return result(response.json().get('response', ''), response_time)
+        error_msg = f"Ollama error {response.status_code}"
+        monitoring.track_error('OllamaError', error_msg, {'status_code': response.status_code})
+        return {'error': error_msg, 'status': 'error'}
+
+    except Exception as e:
+        return ollama_error(e)
+
+async def stream_generation(payload, stream):
+    """SSE events of a ReplyStream fed by a streamed generation (see app.stream_reply)"""
+    try:
+        async with ollama_client.stream('POST', OLLAMA_URL, json={**payload, "stream": True}) as response:
+            if response.status_code != 200:
+                raise OllamaStreamError(f"Ollama error {response.status_code}")
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get('error'):
+                    raise OllamaStreamError(chunk['error'])
+                if chunk.get('response'):
+                    for event in stream.token(chunk['response']):
+                        yield event
+                if chunk.get('done'):
+                    break
+        for event in stream.end():
+            yield event
+
+    except Exception as e:
+        yield sse_event(ollama_error(e), 'error')
+
+async def queued_stream(slot, start):
+    """
+    SSE events of a queued streamed request: "queued" events with the
+    queue position while waiting, then the generation of start()
+    """
+    position = None
+    while not slot.done():
+        if inference_queue.position(slot) != position:
+            position = inference_queue.position(slot)
+            yield sse_event({'position': position, 'queued': len(inference_queue.waiting)}, 'queued')
+        await asyncio.wait({slot}, timeout=QUEUE_FEEDBACK_INTERVAL)
+    # start() may call Ollama for embeddings (story passages retrieval)
+    async for event in stream_generation(*await asyncio.to_thread(start)):
+        yield event
+
+# ================= HELPERS =================
+
+def get_client_ip(request):
+    """Same as app.get_client_ip, for a Starlette request"""
+    forwarded = request.headers.get('X-Forwarded-For', '').strip()
+    if forwarded:
+        return forwarded.split(',')[0].strip()
+    return request.client.host if request.client else 'unknown'
+
+async def json_body(request):
+    try:
+        return await request.json() or {}
+    except ValueError:
+        return {}
+
+async def client_disconnect(request):
+    """Wait until the client of a request (whose body was read) goes away"""
+    while (await request.receive())['type'] != 'http.disconnect':
+        pass
+
+async def until_disconnected(request, awaitable):
+    """
+    Result of awaitable, unless the client goes away first: awaitable is
+    then cancelled (a waiting request gives its place up, a generation
+    closes its Ollama connection) and ClientDisconnected is raised
+    """
+    task = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(client_disconnect(request))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+    if not task.done():
+        task.cancel()
+        raise ClientDisconnected()
+    return task.result()
+
+def client_gone_response():
+    # Nobody reads it: 499 (client closed request) for the request tracking
+    return Response(status_code=499)
+
+class QueuedStreamResponse(StreamingResponse):
+    """
+    SSE response of a queued request. It holds the request's queue slot
+    until the stream ends or the client goes away, even before the first
+    event is produced.
+    """
+
+    def __init__(self, slot, start):
+        super().__init__(queued_stream(slot, start), media_type='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # No proxy buffering (nginx)
+        })
+        self.slot = slot
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            inference_queue.leave(self.slot)
+
+def tracked(endpoint):
+    """Track the request like the Flask after_request middleware"""
+    async def wrapper(request):
+        start_time = time.time()
+        response = await endpoint(request)
+        monitoring.track_request(
+            endpoint=request.url.path,
+            status_code=response.status_code,
+            duration=(time.time() - start_time) * 1000,
+            method=request.method
+        )
+        return response
+    return wrapper
+
+# ================= ENDPOINTS =================
+
+@tracked
+async def chat(request):
+    try:
+        # Rate limit check
+        client_ip = get_client_ip(request)
+        allowed, err = check_rate_limit(client_ip)
+        if not allowed:
+            monitoring.track_error('RateLimitExceeded', err, {'client_ip': client_ip})
+            return JSONResponse({'error': err, 'status': 'rate_limit_exceeded'}, status_code=429)
+
+        data = await json_body(request)
+        user_message = data.get('message', '').strip()
+        story_context = await asyncio.to_thread(request_story_context, data)
+        stream = request.url.path.endswith('/stream')
+
+        if not user_message:
+            return JSONResponse({'error': 'Message required'}, status_code=400)
+
+        # Pregenerated answer, or same question already answered for this
+        # story: no Ollama call, no queue
+        result = await asyncio.to_thread(precomputed_chat_result, user_message, story_context)
+        lookup = None
+        if result is None:
+            lookup = await asyncio.to_thread(lookup_cached_reply, user_message, story_context, False)
+            if lookup is not None and lookup.pending:
+                cache = flask_app.response_cache
+                await asyncio.to_thread(cache.semantic_lookup, lookup, await embed(cache.embed, lookup.question))
+            if lookup is not None and lookup.hit:
+                result = cached_chat_result(lookup)
+        if result is not None:
+            if stream:
+                return StreamingResponse(cached_reply_events(result), media_type='text/event-stream')
+            return JSONResponse({**result, 'timestamp': datetime.now().isoformat()})
+
+        if not await ollama_reachable():
+            return JSONResponse({'error': 'Ollama not reachable', 'status': 'error'}, status_code=503)
+
+        try:
+            slot = inference_queue.enter()
+        except QueueFull:
+            return queue_full_response()
+
+        if stream:
+            return QueuedStreamResponse(slot, lambda: chat_reply_stream(user_message, story_context, lookup))
+
+        position = inference_queue.position(slot)
+        queued_at = time.time()
+        try:
+            await until_disconnected(request, asyncio.shield(slot))
+            queue_wait = round(time.time() - queued_at, 2)
+            question_type, payload = await asyncio.to_thread(start_chat, user_message, story_context)
+            result = await until_disconnected(request, generate(
+                payload, lambda generated, response_time: chat_result(user_message, question_type,
+                                                                       generated, response_time)
+            ))
+        except ClientDisconnected:
+            return client_gone_response()
+        finally:
+            inference_queue.leave(slot)
+
+        if result.get('status') != 'success':
+            return JSONResponse(result, status_code=500)
+        if lookup is not None and not result['fallback']:
+            await asyncio.to_thread(lookup.store, result['reply'])
+
+        return JSONResponse({
+            'reply': result['reply'],
+            'response_time': result.get('response_time', 0),
+            'question_type': result.get('question_type'),
+            'cached': False,
+            'precomputed': False,
+            'fallback': result['fallback'],
+            'queue_position': position,
+            'queue_wait': queue_wait,
+            'timestamp': datetime.now().isoformat(),
+            'status': 'success'
+        })
+
+    except Exception as e:
+        logger.error(f"Error in {request.url.path}: {e}")
+        monitoring.track_error('ChatEndpointError', str(e))
+        return JSONResponse({'error': str(e), 'status': 'error'}, status_code=500)
+
+@tracked
+async def explain_word(request):
+    try:
+        # Rate limit
+        allowed, err = check_rate_limit(get_client_ip(request))
+        if not allowed:
+            return JSONResponse({'error': err}, status_code=429)
+
+        data = await json_body(request)
+        word = data.get('word', '').strip()
+        story_context = await asyncio.to_thread(request_story_context, data)
+        stream = request.url.path.endswith('/stream')
+
+        if not word:
+            return JSONResponse({'error': 'Word required'}, status_code=400)
+
+        # Pregenerated explanation of a complex word of the story: no Ollama call, no queue
+        result = await asyncio.to_thread(precomputed_word_result, word, story_context)
+        if result is not None:
+            if stream:
+                return StreamingResponse(cached_reply_events(result, 'explanation'),
+                                         media_type='text/event-stream')
+            return JSONResponse({'word': word, 'explanation': result['explanation'],
+                                 'precomputed': True, 'status': 'success'})
+
+        if not await ollama_reachable():
+            return JSONResponse({'error': 'Ollama not reachable'}, status_code=503)
+
+        try:
+            slot = inference_queue.enter()
+        except QueueFull:
+            return queue_full_response()
+
+        if stream:
+            return QueuedStreamResponse(slot, lambda: word_explanation_stream(word, story_context))
+
+        try:
+            await until_disconnected(request, asyncio.shield(slot))
+            payload = start_word_explanation(word, story_context)
+            result = await until_disconnected(request, generate(
+                payload, lambda generated, response_time: word_result(word, generated)
+            ))
+        except ClientDisconnected:
+            return client_gone_response()
+        finally:
+            inference_queue.leave(slot)
+
+        if result.get('status') == 'success':
+            return JSONResponse({
+                'word': word,
+                'explanation': result['explanation'],
+                'precomputed': False,
+                'status': 'success'
+            })
+        return JSONResponse(result, status_code=500)
+
+    except Exception as e:
+        logger.error(f"Error in {request.url.path}: {e}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+async def queue_stats(request):
+    return JSONResponse(inference_queue.stats())
+
+# ================= APP =================
+
+@contextlib.asynccontextmanager
+async def lifespan(starlette_app):
+    global ollama_client
+    ollama_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(OLLAMA_TIMEOUT, connect=10),
+        # Generations in flight + embeddings + health checks
+        limits=httpx.Limits(max_connections=OLLAMA_MAX_IN_FLIGHT + OLLAMA_MAX_EMBEDDINGS + 2,
+                            max_keepalive_connections=OLLAMA_MAX_IN_FLIGHT + OLLAMA_MAX_EMBEDDINGS + 2)
+    )
+    logger.info(f"🚦 Async mode: {OLLAMA_MAX_IN_FLIGHT} generations in flight, queue of {CHAT_MAX_QUEUE}")
+    try:
+        yield
+    finally:
+        await ollama_client.aclose()
+        monitoring.flush()
+
+inference_app = Starlette(
+    routes=[
+        Route('/api/chat', chat, methods=['POST']),
+        Route('/api/chat/stream', chat, methods=['POST']),
+        Route('/api/explain-word', explain_word, methods=['POST']),
+        Route('/api/explain-word/stream', explain_word, methods=['POST']),
+        Route('/api/queue', queue_stats, methods=['GET']),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan
+)
+INFERENCE_PATHS = {route.path for route in inference_app.routes}
+
+# Flask (with its own CORS) serves the other routes from a thread pool
+wsgi_app = WSGIMiddleware(flask_app.app)
+
+async def app(scope, receive, send):
+    if scope['type'] != 'http' or scope['path'] in INFERENCE_PATHS:
+        await inference_app(scope, receive, send)
+    else:
+        await wsgi_app(scope, receive, send)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=5002)
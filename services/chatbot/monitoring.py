@@ -31,8 +31,9 @@ class MonitoringService:
     """Monitoring service for Story Backend"""
     
     @staticmethod
-    def track_inference(model, prompt_tokens, response_tokens, duration, success=True):
-        """Track AI model inference"""
+    def track_inference(model, prompt_tokens, response_tokens, duration, success=True,
+                        question_type=None, first_token_ms=None):
+        """Track AI model inference (first_token_ms: time to first token of streamed replies)"""
         if not telemetry_client:
             return
         
@@ -43,12 +44,18 @@ class MonitoringService:
                 'response_tokens': response_tokens,
                 'success': success
             }
+            if question_type:
+                properties['question_type'] = question_type
+            
+            measurements = {'duration_ms': duration}
+            if first_token_ms is not None:
+                measurements['first_token_ms'] = first_token_ms
             
             # Track as custom event
             telemetry_client.track_event(
                 'ModelInference',
                 properties=properties,
-                measurements={'duration_ms': duration}
+                measurements=measurements
             )
             
             # Track duration as metric
@@ -0,0 +1,265 @@
+"""
+precomputed_answers.py
+Answers pregenerated offline for the stories of the catalogue
+
+The prompts of the 'summary', 'lesson' and 'character' question types ask
+about the whole story rather than about the question's wording, and the
+catalogue (Story.json) is finite. The batch job below generates, for each
+story, the answer of each of these question types, the answers to the
+story's own questions and the explanation of each complex word of the
+story, and writes them to a SQLite file. The API serves them without
+calling Ollama when a question classifies into a pregenerated slot.
+
+    python precomputed_answers.py --stories ../../Story.json
+    python precomputed_answers.py --stories ../../Story.json --vocabulary-url http://vocabulary:8000 --workers 2
+
+Answers are keyed on the story text hash (the story_context sent by the
+clients), so regenerate the file when story texts change. The job can be
+interrupted and rerun: answers already in the file are kept unless
+--refresh is given.
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from response_cache import story_hash, normalize_question
+
+logger = logging.getLogger("story-api")
+
+DEFAULT_PATH = "precomputed/answers.sqlite3"
+
+# Question asked for each pregenerated question type
+CANNED_QUESTIONS = {
+    'summary': "What happened in the story?",
+    'lesson': "What is the moral of the story?",
+    'character': "Who are the characters in the story?"
+}
+
+# Wordings served the pregenerated answer of their question type: the
+# match is exact on the normalized question, as other questions of these
+# types ask about something specific ("Who is Tom?", "What happened to the
+# fox?") and go to the model
+CANNED_WORDINGS = {
+    'summary': ["What happened in the story?", "What happened?", "What is the story about?",
+                "Summarize the story", "Can you summarize the story?", "Give me a summary of the story"],
+    'lesson': ["What is the moral of the story?", "What is the lesson of the story?",
+               "What does the story teach us?", "What can we learn from the story?",
+               "What is the moral?", "What is the lesson?"],
+    'character': ["Who are the characters in the story?", "Who are the characters?",
+                  "Who are the main characters?", "Who is in the story?", "Describe the characters"]
+}
+_canned_wordings = {
+    question_type: {normalize_question(variant) for wording in wordings
+                    for variant in (wording, wording.replace("the story", "this story"))}
+    for question_type, wordings in CANNED_WORDINGS.items()
+}
+
+# ================= SLOTS =================
+
+def type_slot(question_type):
+    return f"type:{question_type}"
+
+def question_slot(question):
+    return f"question:{normalize_question(question)}"
+
+def word_slot(word):
+    return f"word:{normalize_question(word)}"
+
+def is_canned_wording(question_type, question):
+    """Whether a question is one of the generic wordings of a pregenerated question type"""
+    return normalize_question(question) in _canned_wordings.get(question_type, ())
+
+# ================= STORE =================
+
+class PrecomputedAnswers:
+    """Read access (and write access for the batch job) to the pregenerated answers file"""
+
+    def __init__(self, path, writable=False):
+        self.path = path
+        if writable:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("""CREATE TABLE IF NOT EXISTS answers (
+                story TEXT, slot TEXT, answer TEXT,
+                PRIMARY KEY (story, slot)) WITHOUT ROWID""")
+        else:
+            self._db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._counters_lock = threading.Lock()  # Counters, updated by concurrent requests
+
+    def get(self, story, slot):
+        with self._lock:
+            row = self._db.execute('SELECT answer FROM answers WHERE story = ? AND slot = ?',
+                                   (story, slot)).fetchone()
+        return row[0] if row else None
+
+    def put(self, story, slot, answer):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO answers VALUES (?, ?, ?)', (story, slot, answer))
+
+    def slots(self, story):
+        """Slots of a story already in the file"""
+        with self._lock:
+            return {slot for (slot,) in self._db.execute('SELECT slot FROM answers WHERE story = ?', (story,))}
+
+    def chat_reply(self, story_context, question_type, question):
+        """
+        Pregenerated answer to a question about a story: the answer to this
+        very question if it is one of the story's questions, else the answer
+        of its question type if the question is a generic wording of a
+        pregenerated type (None otherwise)
+        """
+        story = story_hash(story_context)
+        reply = self.get(story, question_slot(question))
+        if reply is None and is_canned_wording(question_type, question):
+            reply = self.get(story, type_slot(question_type))
+        self._count(reply)
+        return reply
+
+    def word_explanation(self, story_context, word):
+        """Pregenerated explanation of a complex word of a story (None if there is none)"""
+        explanation = self.get(story_hash(story_context), word_slot(word))
+        self._count(explanation)
+        return explanation
+
+    def _count(self, answer):
+        with self._counters_lock:
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+    def stats(self):
+        with self._lock:
+            stories, size = self._db.execute('SELECT COUNT(DISTINCT story), COUNT(*) FROM answers').fetchone()
+        with self._counters_lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            'stories': stories,
+            'size': size,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0
+        }
+
+def precomputed_answers_from_env():
+    """Pregenerated answers of the PRECOMPUTED_ANSWERS_PATH file (None when there is no file)"""
+    path = os.getenv("PRECOMPUTED_ANSWERS_PATH", DEFAULT_PATH)
+    if not path or not os.path.exists(path):
+        return None
+    return PrecomputedAnswers(path)
+
+# ================= BATCH JOB =================
+
+# Without --vocabulary-url, complex words are the words of 8 letters or
+# more of the vocabulary service rule (not capitalized, not a stop word);
+# its word frequency and language model checks are skipped
+STOP_WORDS = {
+    'although', 'anything', 'everyone', 'everything', 'something', 'sometimes', 'somewhere',
+    'together', 'whatever', 'whenever', 'wherever', 'whatsoever', 'themselves', 'yourself',
+    'yourselves', 'ourselves', 'herself', 'himself', 'itself', 'myself', 'therefore', 'moreover',
+    'otherwise', 'thereafter', 'thereupon', 'whereupon', 'nevertheless', 'nowhere', 'anywhere'
+}
+
+def local_complex_words(text):
+    """Complex words of a text according to the length rule"""
+    words = re.findall(r"[A-Za-z]+", text)
+    return [word for word in words
+            if len(word) >= 8 and not re.match(r"^[A-Z][a-z]+$", word) and word.lower() not in STOP_WORDS]
+
+def complex_words(text, vocabulary_url=None, max_words=None):
+    """Distinct complex words of a story, in order of appearance"""
+    if vocabulary_url:
+        response = requests.post(f"{vocabulary_url.rstrip('/')}/detect_complex_words", json={'text': text},
+                                 timeout=600)
+        response.raise_for_status()
+        words = response.json().get('complex_words', [])
+    else:
+        words = local_complex_words(text)
+
+    distinct = {}
+    for word in words:
+        distinct.setdefault(normalize_question(word), word)
+    distinct.pop('', None)
+    return list(distinct.values())[:max_words]
+
+def story_jobs(story, done, vocabulary_url=None, max_words=None):
+    """[(slot, Ollama payload, reply labels)] of the answers of a story not generated yet"""
+    from app import (build_chat_payload, build_word_payload, detect_question_type,
+                     CHAT_REPLY_LABELS, WORD_EXPLANATION_LABELS)
+
+    text = story['text']
+    jobs = []
+    for question_type, question in CANNED_QUESTIONS.items():
+        jobs.append((type_slot(question_type), build_chat_payload(question, text, question_type),
+                     CHAT_REPLY_LABELS))
+    for question in story.get('questions') or []:
+        jobs.append((question_slot(question), build_chat_payload(question, text, detect_question_type(question)),
+                     CHAT_REPLY_LABELS))
+    for word in complex_words(text, vocabulary_url, max_words):
+        jobs.append((word_slot(word), build_word_payload(word, text), WORD_EXPLANATION_LABELS))
+    return [job for job in jobs if job[0] not in done]
+
+def generate(payload):
+    """Raw Ollama answer to a payload (blocking)"""
+    from app import OLLAMA_URL, OLLAMA_TIMEOUT
+    response = requests.post(OLLAMA_URL, json={**payload, "stream": False}, timeout=OLLAMA_TIMEOUT)
+    response.raise_for_status()
+    return response.json().get('response', '')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stories', default='../../Story.json', help='JSON list of the stories (text, questions)')
+    parser.add_argument('--output', default=os.getenv("PRECOMPUTED_ANSWERS_PATH", DEFAULT_PATH))
+    parser.add_argument('--vocabulary-url', default=os.getenv("VOCABULARY_URL"),
+                        help='Vocabulary service detecting the complex words (default: local length rule)')
+    parser.add_argument('--max-words', type=int, default=40, help='Complex words explained per story')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Concurrent Ollama generations (match OLLAMA_NUM_PARALLEL)')
+    parser.add_argument('--refresh', action='store_true', help='Regenerate the answers already in the file')
+    args = parser.parse_args()
+
+    from app import clean_reply
+
+    with open(args.stories, encoding='utf-8') as f:
+        stories = [story for story in json.load(f) if story.get('text')]
+    store = PrecomputedAnswers(args.output, writable=True)
+    start = time.perf_counter()
+    generated = failed = 0
+
+    with ThreadPoolExecutor(args.workers) as pool:
+        for i, story in enumerate(stories, 1):
+            story_key = story_hash(story['text'])
+            done = set() if args.refresh else store.slots(story_key)
+            jobs = story_jobs(story, done, args.vocabulary_url, args.max_words)
+            futures = {pool.submit(generate, payload): (slot, labels) for slot, payload, labels in jobs}
+            for future in as_completed(futures):
+                slot, labels = futures[future]
+                try:
+                    answer = clean_reply(future.result().strip(), labels)
+                except Exception as e:
+                    logger.error(f"Generation failed for {story.get('title')!r} {slot}: {e}")
+                    failed += 1
+                    continue
+                if answer:
+                    store.put(story_key, slot, answer)
+                    generated += 1
+            print(f"[{i}/{len(stories)}] {story.get('title')}: {len(jobs)} answers "
+                  f"({time.perf_counter() - start:.0f}s elapsed)")
+
+    print(f"{generated} answers generated, {failed} failed, {store.stats()['size']} in {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,371 @@
+"""
+response_cache.py
+Cache of chatbot answers for repeated story questions
+
+Answers are keyed on (story context hash, question type, normalized
+question): "What is the moral?" and "what is the moral" asked about the
+same story share one entry. With an embedding model configured, a miss
+also looks for a cached question of the same story and type whose
+embedding is similar enough, so that paraphrases ("what's the lesson of
+the story?") hit too.
+
+Backends: "memory" (per process LRU), "disk" (SQLite file shared by the
+processes of the machine, LRU) and "redis" (shared by every instance;
+configure Redis with maxmemory-policy allkeys-lru for LRU eviction).
+Entries expire after CHAT_CACHE_TTL seconds in every backend.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+logger = logging.getLogger("story-api")
+
+# ================= KEYS =================
+
+def story_hash(story_context):
+    return hashlib.sha256((story_context or '').encode('utf-8')).hexdigest()[:32]
+
+def normalize_question(question):
+    """Lowercase words of the question, without punctuation or extra spaces"""
+    question = question.lower().replace('’', "'")
+    return ' '.join(re.findall(r"[\w']+", question))
+
+# ================= BACKENDS =================
+
+class MemoryBackend:
+    """In-process LRU of at most max_size entries"""
+
+    name = 'memory'
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (bucket, question) -> entry
+        self._buckets = {}             # bucket -> set of questions
+        self._lock = threading.Lock()
+
+    def get(self, bucket, question):
+        with self._lock:
+            entry = self._entries.get((bucket, question))
+            if entry is None:
+                return None
+            if time.time() - entry['created'] > self.ttl:
+                self._delete((bucket, question))
+                return None
+            self._entries.move_to_end((bucket, question))
+            return entry
+
+    def set(self, bucket, question, entry):
+        with self._lock:
+            self._entries[(bucket, question)] = entry
+            self._entries.move_to_end((bucket, question))
+            self._buckets.setdefault(bucket, set()).add(question)
+            while len(self._entries) > self.max_size:
+                self._delete(next(iter(self._entries)))
+
+    def entries(self, bucket):
+        """{question: entry} of the unexpired entries of a bucket"""
+        with self._lock:
+            now = time.time()
+            return {question: self._entries[(bucket, question)] for question in self._buckets.get(bucket, ())
+                    if now - self._entries[(bucket, question)]['created'] <= self.ttl}
+
+    def size(self):
+        return len(self._entries)
+
+    def _delete(self, key):
+        del self._entries[key]
+        bucket, question = key
+        self._buckets[bucket].discard(question)
+        if not self._buckets[bucket]:
+            del self._buckets[bucket]
+
+class DiskBackend:
+    """SQLite LRU of at most max_size entries"""
+
+    name = 'disk'
+
+    def __init__(self, path, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute("""CREATE TABLE IF NOT EXISTS answers (
+            bucket TEXT, question TEXT, entry TEXT, created REAL, accessed REAL,
+            PRIMARY KEY (bucket, question))""")
+        self._db.execute('CREATE INDEX IF NOT EXISTS answers_accessed ON answers (accessed)')
+        self._lock = threading.Lock()
+
+    def get(self, bucket, question):
+        with self._lock:
+            now = time.time()
+            row = self._db.execute('SELECT entry FROM answers WHERE bucket = ? AND question = ? AND created >= ?',
+                                   (bucket, question, now - self.ttl)).fetchone()
+            if row is None:
+                return None
+            self._db.execute('UPDATE answers SET accessed = ? WHERE bucket = ? AND question = ?',
+                             (now, bucket, question))
+            return json.loads(row[0])
+
+    def set(self, bucket, question, entry):
+        with self._lock:
+            now = time.time()
+            self._db.execute('INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?)',
+                             (bucket, question, json.dumps(entry), entry['created'], now))
+            # Expired entries, then the least recently used ones beyond max_size
+            self._db.execute('DELETE FROM answers WHERE created < ?', (now - self.ttl,))
+            self._db.execute('DELETE FROM answers WHERE rowid IN (SELECT rowid FROM answers '
+                             'ORDER BY accessed DESC LIMIT -1 OFFSET ?)', (self.max_size,))
+
+    def entries(self, bucket):
+        with self._lock:
+            rows = self._db.execute('SELECT question, entry FROM answers WHERE bucket = ? AND created >= ?',
+                                    (bucket, time.time() - self.ttl)).fetchall()
+        return {question: json.loads(entry) for question, entry in rows}
+
+    def size(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM answers').fetchone()[0]
+
+class RedisBackend:
+    """
+    One Redis hash per bucket (question -> entry), expiring ttl seconds
+    after its last write; entries older than ttl are ignored
+    """
+
+    name = 'redis'
+
+    def __init__(self, url, ttl, prefix='chat-cache:'):
+        import redis  # Optional: pip install redis
+        self.ttl = ttl
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, bucket, question):
+        value = self._redis.hget(self.prefix + bucket, question)
+        return self._fresh(value)
+
+    def set(self, bucket, question, entry):
+        key = self.prefix + bucket
+        with self._redis.pipeline() as pipe:
+            pipe.hset(key, question, json.dumps(entry))
+            pipe.expire(key, int(self.ttl))
+            pipe.execute()
+
+    def entries(self, bucket):
+        values = self._redis.hgetall(self.prefix + bucket)
+        entries = {question.decode(): self._fresh(value) for question, value in values.items()}
+        return {question: entry for question, entry in entries.items() if entry is not None}
+
+    def size(self):
+        return sum(self._redis.hlen(key) for key in self._redis.scan_iter(self.prefix + '*'))
+
+    def _fresh(self, value):
+        if value is None:
+            return None
+        entry = json.loads(value)
+        return entry if time.time() - entry['created'] <= self.ttl else None
+
+# ================= EMBEDDINGS =================
+
+# Embedding calls made at a time to Ollama by a process, outside the
+# generations queue (asgi.py has its own asyncio limit of the same size)
+OLLAMA_MAX_EMBEDDINGS = int(os.getenv("OLLAMA_MAX_EMBEDDINGS", "2"))
+_embedding_slots = threading.BoundedSemaphore(OLLAMA_MAX_EMBEDDINGS)
+
+def unit_vector(vector):
+    """Unit-length copy of an embedding (None for an empty one)"""
+    if not vector:
+        return None
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+class OllamaEmbedding:
+    """Callable returning the unit-length Ollama embedding of a text (None on failure)"""
+
+    def __init__(self, url, model, timeout=10):
+        self.url = url
+        self.model = model
+        self.timeout = timeout
+        self._session = requests.Session()  # Keep-alive connections to Ollama
+
+    def request(self, text):
+        """JSON body of the embeddings request of a text"""
+        return {'model': self.model, 'prompt': text}
+
+    def __call__(self, text):
+        try:
+            with _embedding_slots:
+                response = self._session.post(self.url, json=self.request(text), timeout=self.timeout)
+            vector = response.json().get('embedding') if response.status_code == 200 else None
+        except Exception as e:
+            logger.error(f"Embedding error: {e}")
+            return None
+        return unit_vector(vector)
+
+def ollama_embedding(embeddings_url, model, timeout=10):
+    return OllamaEmbedding(embeddings_url, model, timeout)
+
+# ================= CACHE =================
+
+class CacheLookup:
+    """Result of a cache lookup; a miss can store the generated reply"""
+
+    def __init__(self, cache, bucket, question_type, question):
+        self.cache = cache
+        self.bucket = bucket
+        self.question_type = question_type
+        self.question = question
+        self.entry = None
+        self.embedding = None
+        self.semantic = False  # Hit on a similar question
+        self.pending = False   # Exact miss waiting for ResponseCache.semantic_lookup
+
+    @property
+    def hit(self):
+        return self.entry is not None
+
+    @property
+    def reply(self):
+        return self.entry['reply'] if self.entry else None
+
+    def store(self, reply):
+        """Cache the reply generated after a miss"""
+        if not self.hit:
+            self.cache._store(self, reply)
+
+class ResponseCache:
+
+    def __init__(self, backend, embed=None, similarity=0.92):
+        self.backend = backend
+        self.embed = embed
+        self.similarity = similarity
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._lock = threading.Lock()  # Counters, updated by concurrent requests
+
+    @property
+    def semantic(self):
+        return self.embed is not None
+
+    def lookup(self, story_context, question_type, question, embed=True):
+        """
+        CacheLookup of a question about a story. With embed=False, an exact
+        miss of a semantic cache is left pending: the caller embeds the
+        question itself and completes it with semantic_lookup
+        """
+        bucket = f"{story_hash(story_context)}:{question_type}"
+        lookup = CacheLookup(self, bucket, question_type, normalize_question(question))
+        try:
+            lookup.entry = self.backend.get(bucket, lookup.question)
+        except Exception as e:
+            self._error(e)
+
+        if lookup.entry is None and self.semantic:
+            if embed:
+                self.semantic_lookup(lookup, self.embed(lookup.question))
+            else:
+                lookup.pending = True
+        else:
+            self._count(lookup)
+        return lookup
+
+    def semantic_lookup(self, lookup, embedding):
+        """Complete an exact miss with the most similar cached question of the same story and question type"""
+        lookup.embedding = embedding
+        lookup.pending = False
+        try:
+            if embedding is not None:
+                best, best_similarity = None, self.similarity
+                for entry in self.backend.entries(lookup.bucket).values():
+                    if entry.get('embedding'):
+                        similarity = sum(a * b for a, b in zip(embedding, entry['embedding']))
+                        if similarity >= best_similarity:
+                            best, best_similarity = entry, similarity
+                if best is not None:
+                    lookup.entry, lookup.semantic = best, True
+        except Exception as e:
+            self._error(e)
+        self._count(lookup)
+        return lookup
+
+    def _count(self, lookup):
+        with self._lock:
+            if lookup.entry is None:
+                self.misses += 1
+            elif lookup.semantic:
+                self.semantic_hits += 1
+            else:
+                self.hits += 1
+
+    def _error(self, e):
+        with self._lock:
+            self.errors += 1
+        logger.error(f"Response cache error: {e}")
+
+    def _store(self, lookup, reply):
+        try:
+            self.backend.set(lookup.bucket, lookup.question, {
+                'reply': reply,
+                'question': lookup.question,
+                'embedding': lookup.embedding,
+                'created': time.time()
+            })
+        except Exception as e:
+            self._error(e)
+
+    def stats(self):
+        try:
+            size = self.backend.size()
+        except Exception:
+            size = None
+        with self._lock:
+            hits, semantic_hits, misses, errors = self.hits, self.semantic_hits, self.misses, self.errors
+        lookups = hits + semantic_hits + misses
+        return {
+            'backend': self.backend.name,
+            'semantic': self.semantic,
+            'size': size,
+            'hits': hits,
+            'semantic_hits': semantic_hits,
+            'misses': misses,
+            'hit_rate': round((hits + semantic_hits) / lookups, 4) if lookups else 0.0,
+            'errors': errors
+        }
+
+def response_cache_from_env(ollama_url):
+    """ResponseCache configured by the CHAT_CACHE_* variables (None when disabled)"""
+    kind = os.getenv("CHAT_CACHE_BACKEND", "memory").lower()
+    max_size = int(os.getenv("CHAT_CACHE_SIZE", "2000"))
+    ttl = float(os.getenv("CHAT_CACHE_TTL", "86400"))
+
+    if kind in ('none', 'off', ''):
+        return None
+    if kind == 'memory':
+        backend = MemoryBackend(max_size, ttl)
+    elif kind == 'disk':
+        backend = DiskBackend(os.getenv("CHAT_CACHE_PATH", "cache/answers.sqlite3"), max_size, ttl)
+    elif kind == 'redis':
+        backend = RedisBackend(os.getenv("REDIS_URL", "redis://localhost:6379/0"), ttl)
+    else:
+        raise ValueError(f"Unknown CHAT_CACHE_BACKEND {kind!r}")
+
+    # e.g. nomic-embed-text: paraphrases of a cached question hit too
+    embedding_model = os.getenv("CHAT_CACHE_EMBEDDING_MODEL")
+    embed = None
+    if embedding_model:
+        embed = ollama_embedding(ollama_url.replace('/api/generate', '/api/embeddings'), embedding_model)
+    return ResponseCache(backend, embed, float(os.getenv("CHAT_CACHE_SIMILARITY", "0.92")))
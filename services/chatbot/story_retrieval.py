@@ -0,0 +1,187 @@
+"""
+story_retrieval.py
+Story lookup by id and retrieval of the passages relevant to a question
+
+Instead of the whole story, chat prompts get the STORY_TOP_K passages of
+the story most similar to the question. Each story is split once into
+passages of about STORY_CHUNK_WORDS words (whole sentences), embedded
+with Ollama and kept in memory (the STORY_INDEX_SIZE most recently used
+stories); a question then costs one embedding call, and prompt
+processing on the Ollama VM only covers the retrieved passages.
+
+Retrieval is enabled by STORY_EMBEDDING_MODEL (e.g. nomic-embed-text).
+Without it, for stories of at most STORY_TOP_K passages, or when an
+embedding call fails, the whole story is used as before.
+
+With STORY_API_URL set (the user service, GET /api/stories/<id>),
+requests can give a story_id instead of sending the story text.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+from response_cache import story_hash, ollama_embedding
+
+logger = logging.getLogger("story-api")
+
+# Separator of the passages put in the prompt, in story order
+PASSAGE_SEPARATOR = "\n\n[...]\n\n"
+
+# ================= STORY LOOKUP =================
+
+class StoryCatalogue:
+    """Story texts fetched by id from the story API, kept ttl seconds"""
+
+    def __init__(self, api_url, ttl, timeout=5):
+        self.api_url = api_url.rstrip('/')
+        self.ttl = ttl
+        self.timeout = timeout
+        self._texts = {}  # story id -> (text, fetched at)
+        self._lock = threading.Lock()
+
+    def text(self, story_id):
+        """Text of a story (None when it cannot be fetched)"""
+        story_id = str(story_id)
+        with self._lock:
+            cached = self._texts.get(story_id)
+        if cached is not None and time.time() - cached[1] <= self.ttl:
+            return cached[0]
+
+        try:
+            response = requests.get(f"{self.api_url}/api/stories/{story_id}", timeout=self.timeout)
+            text = response.json().get('text') if response.status_code == 200 else None
+        except Exception as e:
+            logger.error(f"Story lookup error: {e}")
+            text = None
+        if not text:
+            return None
+
+        with self._lock:
+            self._texts[story_id] = (text, time.time())
+        return text
+
+def story_catalogue_from_env():
+    """StoryCatalogue of STORY_API_URL (None when unset)"""
+    api_url = os.getenv("STORY_API_URL")
+    if not api_url:
+        return None
+    return StoryCatalogue(api_url, float(os.getenv("STORY_CACHE_TTL", "3600")))
+
+# ================= PASSAGES =================
+
+def split_passages(text, chunk_words):
+    """Passages of about chunk_words words made of whole sentences (paragraphs are not merged)"""
+    passages = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        sentences = re.split(r"(?<=[.!?])\s+", paragraph.strip())
+        current, words = [], 0
+        for sentence in sentences:
+            if not sentence:
+                continue
+            if current and words + len(sentence.split()) > chunk_words:
+                passages.append(' '.join(current))
+                current, words = [], 0
+            current.append(sentence)
+            words += len(sentence.split())
+        if current:
+            passages.append(' '.join(current))
+    return passages
+
+class StoryRetriever:
+
+    def __init__(self, embed, chunk_words=100, top_k=3, max_stories=500):
+        self.embed = embed
+        self.chunk_words = chunk_words
+        self.top_k = top_k
+        self.max_stories = max_stories
+        self._indexes = OrderedDict()  # story hash -> (passages, embeddings)
+        self._building = {}            # story hash -> lock of the index being built
+        self._lock = threading.Lock()
+        self.retrievals = 0
+        self.full_stories = 0
+        self.errors = 0
+        self._counters_lock = threading.Lock()  # Counters, updated by concurrent requests
+
+    def story_context(self, question, story_context):
+        """The passages of the story most relevant to the question, or the whole story"""
+        index = self._index(story_context)
+        if index is None:
+            self._count('full_stories')
+            return story_context
+        passages, embeddings = index
+
+        question_embedding = self.embed(question)
+        if question_embedding is None:
+            self._count('errors')
+            return story_context
+        similarities = [sum(a * b for a, b in zip(question_embedding, embedding)) for embedding in embeddings]
+        best = sorted(range(len(passages)), key=similarities.__getitem__, reverse=True)[:self.top_k]
+        self._count('retrievals')
+        return PASSAGE_SEPARATOR.join(passages[i] for i in sorted(best))
+
+    def _index(self, story_context):
+        """(passages, embeddings) of a story, built on first use (None: use the whole story)"""
+        key = story_hash(story_context)
+        with self._lock:
+            if key in self._indexes:
+                self._indexes.move_to_end(key)
+                return self._indexes[key]
+            build_lock = self._building.setdefault(key, threading.Lock())
+
+        # One build per story, other requests for it wait for the result
+        with build_lock:
+            with self._lock:
+                if key in self._indexes:
+                    return self._indexes[key]
+            passages = split_passages(story_context, self.chunk_words)
+            if len(passages) <= self.top_k:
+                index = None
+            else:
+                embeddings = [self.embed(passage) for passage in passages]
+                if any(embedding is None for embedding in embeddings):
+                    # Not cached: retried on the next question
+                    self._count('errors')
+                    with self._lock:
+                        self._building.pop(key, None)
+                    return None
+                index = (passages, embeddings)
+            with self._lock:
+                self._indexes[key] = index
+                self._building.pop(key, None)
+                while len(self._indexes) > self.max_stories:
+                    self._indexes.popitem(last=False)
+            return index
+
+    def _count(self, counter):
+        with self._counters_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        with self._lock:
+            indexed_stories = sum(index is not None for index in self._indexes.values())
+        with self._counters_lock:
+            return {
+                'indexed_stories': indexed_stories,
+                'retrievals': self.retrievals,
+                'full_stories': self.full_stories,
+                'errors': self.errors
+            }
+
+def story_retriever_from_env(ollama_url):
+    """StoryRetriever configured by the STORY_* variables (None when STORY_EMBEDDING_MODEL is unset)"""
+    model = os.getenv("STORY_EMBEDDING_MODEL")
+    if not model:
+        return None
+    embed = ollama_embedding(ollama_url.replace('/api/generate', '/api/embeddings'), model)
+    return StoryRetriever(
+        embed,
+        chunk_words=int(os.getenv("STORY_CHUNK_WORDS", "100")),
+        top_k=int(os.getenv("STORY_TOP_K", "3")),
+        max_stories=int(os.getenv("STORY_INDEX_SIZE", "500"))
+    )
@@ -0,0 +1,126 @@
+"""
+Test of the asyncio serving mode (asgi.py) against a fake Ollama:
+clients that disconnect while queued give their place up, on the plain
+and the /stream routes.
+
+    python test_asgi_queue.py      (or: python -m pytest test_asgi_queue.py)
+
+Needs the packages of requirements.txt (starlette, uvicorn, httpx, a2wsgi).
+"""
+
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+GENERATION_SECONDS = 1.0
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class FakeOllama(BaseHTTPRequestHandler):
+    """/api/tags and non-streamed /api/generate, counting the generations"""
+    generations = 0
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.send_json({'models': []})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        FakeOllama.generations += 1
+        time.sleep(GENERATION_SECONDS)
+        self.send_json({'response': 'A generated answer 😊', 'done': True})
+
+
+def start_servers():
+    """(ASGI app port, fake Ollama port) of servers running in background threads"""
+    ollama_port, app_port = free_port(), free_port()
+    ollama = ThreadingHTTPServer(('127.0.0.1', ollama_port), FakeOllama)
+    threading.Thread(target=ollama.serve_forever, daemon=True).start()
+
+    os.environ.update(
+        OLLAMA_URL=f'http://127.0.0.1:{ollama_port}/api/generate',
+        OLLAMA_MAX_IN_FLIGHT='1',
+        CHAT_CACHE_BACKEND='none',
+        PRECOMPUTED_ANSWERS_PATH='',
+        MAX_REQUESTS_PER_MINUTE='1000'
+    )
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import uvicorn
+    import asgi
+
+    server = uvicorn.Server(uvicorn.Config(asgi.app, host='127.0.0.1', port=app_port, log_level='warning'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return app_port, asgi
+
+
+def post(port, path, data, wait=None):
+    """Response of a POST (raw socket), or None when the client hangs up after `wait` seconds"""
+    body = json.dumps(data).encode()
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.sendall(f"POST {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+    if wait is not None:
+        time.sleep(wait)
+        sock.close()
+        return None
+    response = b''
+    while chunk := sock.recv(65536):
+        response += chunk
+    sock.close()
+    return response.decode()
+
+
+def test_disconnected_clients_give_their_place_up():
+    port, asgi = start_servers()
+    requests = [('/api/chat', {'message': 'Why did the fox run?', 'story_context': 'A fox ran.'}),
+                ('/api/explain-word', {'word': 'ran', 'story_context': 'A fox ran.'}),
+                ('/api/chat/stream', {'message': 'Why did the fox run?', 'story_context': 'A fox ran.'})]
+
+    for path, data in requests:
+        generations = FakeOllama.generations
+        served = asgi.inference_queue.served
+
+        # One request holds the only slot, three clients hang up while queued
+        holder = []
+        thread = threading.Thread(target=lambda: holder.append(post(port, path, data)))
+        thread.start()
+        time.sleep(0.2)
+        quitters = [threading.Thread(target=post, args=(port, path, data, 0.2)) for _ in range(3)]
+        for quitter in quitters:
+            quitter.start()
+        for quitter in quitters:
+            quitter.join()
+        thread.join()
+        time.sleep(0.3)
+
+        assert ' 200 ' in holder[0].split('\r\n')[0], holder[0]
+        assert FakeOllama.generations - generations == 1, path
+        assert asgi.inference_queue.served - served == 1, path
+        stats = asgi.inference_queue.stats()
+        assert stats['queued'] == 0 and stats['in_flight'] == 0, stats
+        print(f"✅ {path}: 1 generation for 1 served client and 3 quitters")
+
+
+if __name__ == '__main__':
+    test_disconnected_clients_give_their_place_up()
@@ -0,0 +1,57 @@
+"""
+Test of the pregenerated answers (precomputed_answers.py): the answer of a
+question type is only served to the generic wordings of that type.
+
+    python test_precomputed_answers.py      (or: python -m pytest test_precomputed_answers.py)
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from precomputed_answers import PrecomputedAnswers, type_slot, question_slot, CANNED_QUESTIONS
+from response_cache import story_hash
+
+STORY = "Tom the fox lived in the forest with his friend Lily the owl. One day a storm came."
+
+
+def answers_file():
+    path = os.path.join(tempfile.mkdtemp(), 'answers.sqlite3')
+    store = PrecomputedAnswers(path, writable=True)
+    for question_type in CANNED_QUESTIONS:
+        store.put(story_hash(STORY), type_slot(question_type), f"The {question_type} answer")
+    store.put(story_hash(STORY), question_slot("Where did Tom live?"), "In the forest 🌲")
+    return PrecomputedAnswers(path)
+
+
+def test_generic_wordings_get_the_answer_of_their_type():
+    answers = answers_file()
+    for question_type, question in [('character', "Who are the characters in the story?"),
+                                    ('character', "who are the main characters"),
+                                    ('summary', "What happened in this story?"),
+                                    ('lesson', "What is the moral of the story ?")]:
+        assert answers.chat_reply(STORY, question_type, question) == f"The {question_type} answer", question
+
+
+def test_specific_questions_go_to_the_model():
+    answers = answers_file()
+    for question_type, question in [('character', "Who is Tom?"),
+                                    ('character', "Who was Lily the owl?"),
+                                    ('summary', "What happened to the fox after the storm?"),
+                                    ('lesson', "What did Tom learn from Lily?")]:
+        assert answers.chat_reply(STORY, question_type, question) is None, question
+    assert answers.stats()['misses'] == 4
+
+
+def test_story_questions_are_matched_exactly():
+    answers = answers_file()
+    assert answers.chat_reply(STORY, 'general', "Where did Tom live?") == "In the forest 🌲"
+    assert answers.chat_reply(STORY, 'general', "Where did Lily live?") is None
+
+
+if __name__ == '__main__':
+    test_generic_wordings_get_the_answer_of_their_type()
+    test_specific_questions_go_to_the_model()
+    test_story_questions_are_matched_exactly()
+    print("✅ Pregenerated answers served to generic wordings only")
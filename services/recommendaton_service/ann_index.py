@@ -0,0 +1,141 @@
+# ann_index.py
+import numpy as np
+
+_UINT32_MAX = np.iinfo(np.uint32).max
+
+
+class MinHashLSH:
+    """
+    MinHash LSH index for approximate neighbour search over interaction rows.
+
+    Every row is summarized by MinHash signatures of the set of stories it
+    interacted with, grouped in `n_tables` bands of `band_size` hashes. Two
+    rows land in the same bucket of a table with a probability equal to the
+    Jaccard similarity of their story sets (to the power `band_size`), so
+    rows sharing a bucket in at least one table are the candidate
+    neighbours. A query only compares a user with those candidates instead
+    of every co-reader. Empty rows are not indexed.
+    """
+
+    def __init__(self, n_tables=16, band_size=1, seed=0, block_size=65536, max_bucket_size=64):
+        self.n_tables = n_tables
+        self.band_size = band_size
+        self.block_size = block_size
+        self.max_bucket_size = max_bucket_size
+        self._rng = np.random.default_rng(seed)
+        self.column_hashes = np.zeros((0, n_tables * band_size), dtype=np.uint32)
+        self.keys = np.zeros((0, n_tables), dtype=np.uint64)
+        self.indexed = np.zeros(0, dtype=bool)
+        self.buckets = [{} for _ in range(n_tables)]
+
+    def fit(self, matrix):
+        """Index every row of a CSR matrix"""
+        matrix = matrix.tocsr()
+        self.resize_features(matrix.shape[1])
+        self.indexed = np.diff(matrix.indptr) > 0
+        self.keys = np.zeros((matrix.shape[0], self.n_tables), dtype=np.uint64)
+        for start in range(0, matrix.shape[0], self.block_size):
+            block = matrix[start:start + self.block_size]
+            self.keys[start:start + block.shape[0]] = self._band_keys(block)
+
+        self.buckets = [{} for _ in range(self.n_tables)]
+        rows = np.flatnonzero(self.indexed)
+        for table, buckets in enumerate(self.buckets):
+            keys = self.keys[rows, table]
+            order = np.argsort(keys, kind='stable')
+            unique_keys, starts = np.unique(keys[order], return_index=True)
+            for key, members in zip(unique_keys, np.split(rows[order], starts[1:])):
+                buckets[key] = members
+        return self
+
+    def resize_features(self, n_features):
+        """Draw hash values for new columns (existing ones are kept)"""
+        missing = n_features - len(self.column_hashes)
+        if missing > 0:
+            extra = self._rng.integers(0, _UINT32_MAX, (missing, self.column_hashes.shape[1]), dtype=np.uint32)
+            self.column_hashes = np.vstack([self.column_hashes, extra])
+
+    def update(self, row, vector):
+        """(Re)index one row from its CSR vector, appending it if it is new"""
+        if row >= len(self.keys):
+            grow = row + 1 - len(self.keys)
+            self.keys = np.vstack([self.keys, np.zeros((grow, self.n_tables), dtype=np.uint64)])
+            self.indexed = np.append(self.indexed, np.zeros(grow, dtype=bool))
+
+        if self.indexed[row]:
+            for table, buckets in enumerate(self.buckets):
+                key = self.keys[row, table]
+                members = buckets[key][buckets[key] != row]
+                if len(members):
+                    buckets[key] = members
+                else:
+                    del buckets[key]
+
+        vector = vector.tocsr()
+        self.indexed[row] = vector.nnz > 0
+        if not self.indexed[row]:
+            return
+        self.keys[row] = self._band_keys(vector)[0]
+        for table, buckets in enumerate(self.buckets):
+            key = self.keys[row, table]
+            buckets[key] = np.append(buckets.get(key, np.zeros(0, dtype=int)), row)
+
+    def query(self, row):
+        """Candidate neighbour rows of an indexed row (including the row itself)"""
+        if row >= len(self.indexed) or not self.indexed[row]:
+            return np.zeros(0, dtype=int)
+        members = [buckets[self.keys[row, table]] for table, buckets in enumerate(self.buckets)]
+        return np.unique(np.concatenate(members))
+
+    def candidate_pairs(self):
+        """
+        Yield, for each table, the (row, candidate) pairs sharing a bucket as
+        two aligned arrays without self pairs. Buckets larger than
+        `max_bucket_size` are split in chunks, which bounds the number of
+        candidates per row and table.
+        """
+        for buckets in self.buckets:
+            groups = [members[start:start + self.max_bucket_size]
+                      for members in buckets.values() if len(members) > 1
+                      for start in range(0, len(members), self.max_bucket_size)]
+            if not groups:
+                continue
+            members = np.concatenate(groups)
+            sizes = np.array([len(group) for group in groups])
+            starts = np.repeat(np.cumsum(sizes) - sizes, sizes)
+            group_sizes = np.repeat(sizes, sizes)
+
+            # Pair every member with every member of its group
+            first = np.repeat(members, group_sizes)
+            offsets = np.arange(len(first)) - np.repeat(np.cumsum(group_sizes) - group_sizes, group_sizes)
+            second = members[np.repeat(starts, group_sizes) + offsets]
+            distinct = first != second
+            yield first[distinct], second[distinct]
+
+    def _band_keys(self, matrix):
+        """(rows x tables) bucket keys; meaningless for empty rows"""
+        signatures = np.full((matrix.shape[0], self.column_hashes.shape[1]), _UINT32_MAX, dtype=np.uint32)
+        filled = np.flatnonzero(np.diff(matrix.indptr) > 0)
+        if len(filled):
+            hashed = self.column_hashes[matrix.indices]
+            signatures[filled] = np.minimum.reduceat(hashed, matrix.indptr[filled], axis=0)
+
+        signatures = signatures.reshape(matrix.shape[0], self.n_tables, self.band_size).astype(np.uint64)
+        keys = signatures[:, :, 0]
+        for position in range(1, self.band_size):
+            keys = keys * np.uint64(0x9E3779B97F4A7C15) + signatures[:, :, position]
+        return keys
+
+
+def neighbor_recall(exact_ids, approx_ids):
+    """
+    Mean fraction of the exact neighbours found by the approximate search,
+    over the users that have at least one exact neighbour. Both arguments
+    are (users x k) id arrays padded with -1.
+    """
+    recalls = []
+    for exact, approx in zip(exact_ids, approx_ids):
+        exact = exact[exact >= 0]
+        if len(exact):
+            recalls.append(len(np.intersect1d(exact, approx[approx >= 0])) / len(exact))
+    return float(np.mean(recalls)) if recalls else 1.0
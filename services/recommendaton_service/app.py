@@ -1,11 +1,18 @@
-from flask import Flask, request, jsonify
+import os
+import json
+import threading
+import time
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-import pandas as pd
-from recommendation_system import StoryRecommendationSystem
-from db import stories_collection, users_collection, histories_collection
+from model_loader import build_model
+from model_snapshot import load_latest_snapshot, publish_snapshot
 from routes.story_routes import story_bp
 from routes.user_routes import user_bp
 from routes.history_routes import history_bp
+from history_watcher import start_watchers
+from recommendation_cache import RecommendationCache
+from user_profiles import UserProfileLoader
+from db import users_collection
 
 app = Flask(__name__)
 CORS(app)
@@ -24,20 +31,125 @@ def home():
 # 🧠 Initialisation du système de recommandation
 # ======================================================
 
-def load_data_from_mongo():
-    """Charge les collections MongoDB en DataFrames pandas"""
-    stories = pd.DataFrame(list(stories_collection.find()))
-    users = pd.DataFrame(list(users_collection.find()))
-    history = pd.DataFrame(list(histories_collection.find()))
-    return stories, users, history
-
-try:
-    stories, users, history = load_data_from_mongo()
-    rec_system = StoryRecommendationSystem(stories, users, history)
-    print("✅ Système de recommandation initialisé avec succès.")
-except Exception as e:
-    print("❌ Erreur d’initialisation du système :", e)
-    rec_system = None
+# Avec RECO_SNAPSHOT_DIR, le modèle est chargé (mmap) depuis le dernier
+# snapshot publié par model_snapshot.py au lieu d'être reconstruit.
+SNAPSHOT_DIR = os.getenv("RECO_SNAPSHOT_DIR")
+
+
+def load_model():
+    """Charge le dernier snapshot (ou reconstruit le modèle) ; None en cas d'erreur"""
+    try:
+        system = load_latest_snapshot(SNAPSHOT_DIR) if SNAPSHOT_DIR else None
+        if system is not None:
+            print(f"✅ Système de recommandation chargé depuis le snapshot {system.snapshot_version}.")
+        else:
+            system = build_model()
+            if SNAPSHOT_DIR:
+                publish_snapshot(system, SNAPSHOT_DIR)
+            print("✅ Système de recommandation initialisé avec succès.")
+        return system
+    except Exception as e:
+        print("❌ Erreur d’initialisation du système :", e)
+        return None
+
+
+rec_system = load_model()
+
+recommendation_cache = RecommendationCache(
+    max_size=int(os.getenv("RECO_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("RECO_CACHE_TTL", "300"))
+)
+
+
+user_profiles = UserProfileLoader(
+    users_collection,
+    max_size=int(os.getenv("RECO_PROFILE_CACHE_SIZE", "1000")),
+    ttl=float(os.getenv("RECO_PROFILE_CACHE_TTL", "600"))
+)
+
+
+def reload_model():
+    """
+    Remplace le modèle servi par un nouveau modèle (snapshot ou reconstruction).
+    Le modèle courant est conservé si le chargement échoue.
+    """
+    global rec_system
+    system = load_model()
+    if system is None:
+        return False
+    rec_system = system
+    recommendation_cache.clear()
+    return True
+
+
+# Intervalle de rafraîchissement des scores tendance (secondes)
+TRENDING_REFRESH_SECONDS = float(os.getenv("RECO_TRENDING_REFRESH", "300"))
+
+# Nombre de mises à jour appliquées au modèle (tâches de fond, écritures
+# transmises par les workers) : le maître de serve.py s'en sert pour savoir quand forker de nouveaux workers
+_model_updates = 0
+_model_updates_lock = threading.Lock()
+
+
+def _count_model_update():
+    global _model_updates
+    with _model_updates_lock:
+        _model_updates += 1
+
+
+def model_updates():
+    return _model_updates
+
+
+def model_lock():
+    """Verrou du modèle servi (None sans modèle) : le tenir fige le modèle, ex. pendant un fork"""
+    return rec_system._lock if rec_system is not None else None
+
+
+# Avec serve.py, les écritures reçues par un worker ne modifient pas sa copie
+# du modèle : elles sont transmises au maître (voir serve.py), qui les
+# applique à son modèle et les sert par une nouvelle génération de workers.
+_forward_model_write = None
+
+
+def forward_model_writes(forward):
+    """Transmet désormais les écritures des routes via forward((type, données))"""
+    global _forward_model_write
+    _forward_model_write = forward
+
+
+def apply_model_write(kind, data):
+    """Applique au modèle servi une écriture ("interaction" ou "story")"""
+    system = rec_system
+    if system is None:
+        return
+    if kind == "interaction":
+        system.update_interaction(**data)
+    else:
+        system.add_story(data)
+    _count_model_update()
+
+
+def refresh_trending_forever():
+    """Rafraîchit périodiquement les scores tendance du modèle servi"""
+    while True:
+        time.sleep(TRENDING_REFRESH_SECONDS)
+        system = rec_system
+        if system is None:
+            continue
+        try:
+            system.refresh_trending()
+            _count_model_update()
+        except Exception as e:
+            print("❌ Erreur de rafraîchissement des tendances :", e)
+
+
+def start_background_tasks():
+    """Tâches de fond qui mettent à jour le modèle (change streams, tendances)"""
+    if rec_system is not None and os.getenv("RECO_WATCH_CHANGES", "false").lower() == "true":
+        start_watchers(lambda: rec_system, _count_model_update)
+    if TRENDING_REFRESH_SECONDS > 0:
+        threading.Thread(target=refresh_trending_forever, name="trending-refresh", daemon=True).start()
 
 # ======================================================
 # 🎯 Routes pour les recommandations
@@ -51,12 +163,86 @@ def recommend(user_id):
     try:
         n = int(request.args.get("n", 10))
         exclude_read = request.args.get("exclude_read", "true").lower() == "true"
-        recs = rec_system.recommend_stories(user_id, n_recommendations=n, exclude_read=exclude_read)
-        return jsonify(recs.to_dict(orient="records"))
+        # Diversification MMR : 1 = pertinence seule, 0 = diversité maximale
+        mmr_lambda = request.args.get("mmr_lambda", type=float)
+        if mmr_lambda is not None and not 0 <= mmr_lambda <= 1:
+            return jsonify({"error": "mmr_lambda doit être compris entre 0 et 1"}), 400
+
+        # ?fields=story_id,recommendation_score : identifiants et scores seulement
+        fields = [f.strip() for f in request.args.get("fields", "").split(",") if f.strip()] or None
+
+        # Utilisateur inscrit après la construction du modèle : profil lu dans Mongo
+        profile = None if rec_system.has_profile(user_id) else user_profiles.get(user_id)
+
+        # Cold start : classement précalculé du segment (ou tendance), sans scoring
+        if not rec_system.has_history(user_id):
+            body = rec_system.cold_start_stories_json(user_id, n, profile=profile, fields=fields)
+            return Response(body, mimetype="application/json")
+
+        # Réponse JSON déjà encodée, assemblée à partir des fragments des stories
+        key = (user_id, n, exclude_read, mmr_lambda, fields and tuple(fields))
+        version = rec_system.cache_version(user_id)
+        body = recommendation_cache.get(key, version)
+        if body is None:
+            body = rec_system.recommend_stories_json(user_id, n_recommendations=n, exclude_read=exclude_read,
+                                                     profile=profile or {}, mmr_lambda=mmr_lambda, fields=fields)
+            recommendation_cache.set(key, version, body)
+        return Response(body, mimetype="application/json")
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/stats", methods=["GET"])
+def stats():
+    """Statistiques du cache de recommandations"""
+    return jsonify({
+        "recommendation_cache": recommendation_cache.stats(),
+        "user_profile_cache": user_profiles.stats()
+    })
+
+
+# Nombre d'utilisateurs scorés ensemble par /api/recommend/batch
+BATCH_CHUNK_SIZE = int(os.getenv("RECO_BATCH_CHUNK_SIZE", "500"))
+# Recommandations par utilisateur au plus (n plus grand : ramené à ce maximum)
+BATCH_MAX_RECOMMENDATIONS = int(os.getenv("RECO_BATCH_MAX_N", "100"))
+
+
+@app.route("/api/recommend/batch", methods=["POST"])
+def recommend_batch():
+    """
+    Recommande des stories pour plusieurs utilisateurs.
+    Body : {"user_ids": [...], "n": 10, "exclude_read": true}
+    Réponse NDJSON : une ligne {"user_id", "recommendations"} par utilisateur
+    """
+    if rec_system is None:
+        return jsonify({"error": "Le système de recommandation n'est pas initialisé."}), 500
+    data = request.get_json(silent=True) or {}
+    user_ids = data.get("user_ids")
+    if not isinstance(user_ids, list):
+        return jsonify({"error": "user_ids (liste) est requis"}), 400
+    n = data.get("n", 10)
+    if isinstance(n, str) and n.strip().isdigit():
+        n = int(n)
+    if isinstance(n, bool) or not isinstance(n, int) or n < 1:
+        return jsonify({"error": f"n doit être un entier positif : {n!r}"}), 400
+    n = min(n, BATCH_MAX_RECOMMENDATIONS)
+    exclude_read = bool(data.get("exclude_read", True))
+
+    def generate():
+        for start in range(0, len(user_ids), BATCH_CHUNK_SIZE):
+            chunk = user_ids[start:start + BATCH_CHUNK_SIZE]
+            recs = rec_system.recommend_stories_batch(chunk, n_recommendations=n, exclude_read=exclude_read)
+            by_user = {uid: group.drop(columns="user_id") for uid, group in recs.groupby("user_id", sort=False)}
+            for uid in chunk:
+                if uid in by_user:
+                    line = {"user_id": uid, "recommendations": by_user[uid].to_dict(orient="records")}
+                else:
+                    line = {"user_id": uid, "error": f"Utilisateur {uid} introuvable"}
+                yield json.dumps(line, default=str) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
 @app.route("/similar/<story_id>", methods=["GET"])
 def similar_stories(story_id):
     try:
@@ -66,9 +252,52 @@ def similar_stories(story_id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+
+@app.route("/api/recommend/interactions", methods=["POST"])
+def record_interaction():
+    """Met à jour le modèle avec un nouvel évènement d'historique (sans reconstruction)"""
+    if rec_system is None:
+        return jsonify({"error": "Le système de recommandation n'est pas initialisé."}), 500
+    data = request.get_json(silent=True) or {}
+    if "user_id" not in data or "story_id" not in data:
+        return jsonify({"error": "user_id et story_id sont requis"}), 400
+    try:
+        if _forward_model_write is not None:
+            _forward_model_write(("interaction", data))
+            return jsonify({"message": "Interaction transmise, servie par la prochaine génération de workers"}), 202
+        rec_system.update_interaction(**data)
+        return jsonify({"message": "Interaction enregistrée"}), 201
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/recommend/stories", methods=["POST"])
+def add_story():
+    """Ajoute une story au modèle (sans reconstruction)"""
+    if rec_system is None:
+        return jsonify({"error": "Le système de recommandation n'est pas initialisé."}), 500
+    data = request.get_json(silent=True) or {}
+    if "story_id" not in data:
+        return jsonify({"error": "story_id est requis"}), 400
+    try:
+        if _forward_model_write is not None:
+            if data["story_id"] in rec_system.story_index:
+                return jsonify({"error": f"Story {data['story_id']} already exists"}), 409
+            _forward_model_write(("story", data))
+            return jsonify({"message": "Story transmise, servie par la prochaine génération de workers"}), 202
+        rec_system.add_story(data)
+        return jsonify({"message": "Story ajoutée"}), 201
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 # ======================================================
 # 🚀 Démarrage du serveur Flask
 # ======================================================
 
+# En production : python serve.py (workers pré-forkés, voir serve.py)
+
 if __name__ == "__main__":
+    start_background_tasks()
     app.run(debug=True, port=5001)
@@ -0,0 +1,44 @@
+# ann_recall.py
+"""
+Recall of the LSH neighbour search against the exact cosine search.
+
+Usage (from services/recommendaton_service):
+    python -m benchmarks.ann_recall --users 20000 --stories 2000 --tables 8 16 --band-sizes 1 2
+"""
+import argparse
+import time
+
+from ann_index import neighbor_recall
+from recommendation_system import StoryRecommendationSystem
+from benchmarks.synthetic import generate_dataset
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--stories', type=int, default=2000)
+    parser.add_argument('--events-per-user', type=int, default=10)
+    parser.add_argument('--neighbors', type=int, default=10)
+    parser.add_argument('--tables', type=int, nargs='+', default=[8, 16, 32])
+    parser.add_argument('--band-sizes', type=int, nargs='+', default=[1, 2])
+    args = parser.parse_args()
+
+    stories, users, history = generate_dataset(args.users, args.stories, args.events_per_user)
+
+    start = time.perf_counter()
+    exact = StoryRecommendationSystem(stories, users, history, n_neighbors=args.neighbors)
+    exact_time = time.perf_counter() - start
+    print(f"exact              build {exact_time:8.2f}s  recall 1.000")
+
+    for tables in args.tables:
+        for band_size in args.band_sizes:
+            start = time.perf_counter()
+            approx = StoryRecommendationSystem(stories, users, history, n_neighbors=args.neighbors,
+                                               neighbor_search='lsh', lsh_tables=tables, lsh_band_size=band_size)
+            build_time = time.perf_counter() - start
+            recall = neighbor_recall(exact.neighbor_ids, approx.neighbor_ids)
+            print(f"lsh {tables:3d} x {band_size} band  build {build_time:8.2f}s  recall {recall:.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+# candidate_recall.py
+"""
+Recall and latency of the two-stage recommend_stories (candidate
+generation + rerank) against the full scorer.
+
+Recall@n is the share of the full scorer's top-n stories that the
+two-stage mode also returns, averaged over the sampled users.
+
+Usage (from services/recommendaton_service):
+    python -m benchmarks.candidate_recall --users 20000 --stories 5000 --pools 100 200 500 1000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from recommendation_system import StoryRecommendationSystem
+from benchmarks.synthetic import generate_dataset
+
+
+def timed_recommendations(system, user_ids, n, candidate_pool):
+    """({user_id: top-n story ids}, latencies in seconds)"""
+    top, latencies = {}, []
+    for user_id in user_ids:
+        start = time.perf_counter()
+        recs = system.recommend_stories(user_id, n, candidate_pool=candidate_pool)
+        latencies.append(time.perf_counter() - start)
+        top[user_id] = recs['story_id'].tolist()
+    return top, np.array(latencies)
+
+
+def candidate_recall(exact, approx):
+    """Mean share of each user's exact top-n found in the approximate top-n"""
+    recalls = [len(set(exact[uid]) & set(approx[uid])) / len(exact[uid]) for uid in exact if exact[uid]]
+    return float(np.mean(recalls)) if recalls else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--stories', type=int, default=5000)
+    parser.add_argument('--events-per-user', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=300, help='Number of sampled users')
+    parser.add_argument('--n', type=int, default=10, help='Recommendations per user')
+    parser.add_argument('--pools', type=int, nargs='+', default=[100, 200, 500, 1000])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    stories, users, history = generate_dataset(args.users, args.stories, args.events_per_user, seed=args.seed)
+    system = StoryRecommendationSystem(stories, users, history)
+    rng = np.random.default_rng(args.seed)
+    user_ids = list(rng.choice(users['user_id'].to_numpy(), args.requests, replace=False))
+
+    exact, latencies = timed_recommendations(system, user_ids, args.n, 0)
+    print(f"{'pool':>8}{'recall@' + str(args.n):>12}{'p50 ms':>10}{'p95 ms':>10}")
+    print(f"{'full':>8}{1.0:12.3f}{np.percentile(latencies, 50) * 1000:10.2f}{np.percentile(latencies, 95) * 1000:10.2f}")
+    for pool in args.pools:
+        approx, latencies = timed_recommendations(system, user_ids, args.n, pool)
+        print(f"{pool:>8}{candidate_recall(exact, approx):12.3f}"
+              f"{np.percentile(latencies, 50) * 1000:10.2f}{np.percentile(latencies, 95) * 1000:10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# latency.py
+"""
+Build time, per-request latency, throughput and peak memory of the
+recommender and of each of its scoring components, on synthetic data.
+
+Usage (from services/recommendaton_service):
+    python -m benchmarks.latency --size 100k
+    python -m benchmarks.latency --users 5000 --stories 800 --requests 500 --components content recommend
+
+Latencies are wall-clock per call, over randomly drawn users/stories.
+Peak memory is the largest Python/numpy allocation during one call
+(tracemalloc), and the process peak RSS for the build.
+"""
+import argparse
+import resource
+import time
+import tracemalloc
+
+import numpy as np
+
+from recommendation_system import StoryRecommendationSystem
+from benchmarks.synthetic import generate_dataset
+
+# users, stories, events per user
+SIZES = {
+    '1k': (1000, 500, 10),
+    '100k': (100000, 5000, 10),
+    '1m': (1000000, 20000, 10),
+}
+
+
+def component_calls(system, user_ids, story_ids, batch_size):
+    """{component: function(i) performing the i-th request}"""
+    all_rows = np.arange(len(system.stories))
+    all_story_ids = system.stories['story_id'].tolist()
+    batches = [user_ids[i:i + batch_size] for i in range(0, len(user_ids), batch_size)]
+    return {
+        'content': lambda i: system._content_based_score(user_ids[i], all_rows),
+        'collaborative': lambda i: system._collaborative_score(user_ids[i], all_rows),
+        'behavioral': lambda i: system._behavioral_score(user_ids[i], all_rows),
+        'filter_read': lambda i: system._filter_already_read(user_ids[i], all_story_ids),
+        'recommend': lambda i: system.recommend_stories(user_ids[i], 10),
+        'recommend_batch': lambda i: system.recommend_stories_batch(batches[i % len(batches)], 10),
+        'similar': lambda i: system.recommend_similar_stories(story_ids[i], 10),
+    }
+
+
+def measure(call, n_requests, warmup=3):
+    """Latencies (seconds) of n_requests calls and the peak memory of one call"""
+    for i in range(min(warmup, n_requests)):
+        call(i)
+    latencies = np.empty(n_requests)
+    for i in range(n_requests):
+        start = time.perf_counter()
+        call(i)
+        latencies[i] = time.perf_counter() - start
+
+    tracemalloc.start()
+    call(0)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return latencies, peak
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', choices=sorted(SIZES), default='1k',
+                        help='Preset dataset size (overridden by --users/--stories/--events-per-user)')
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--stories', type=int)
+    parser.add_argument('--events-per-user', type=int)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per component')
+    parser.add_argument('--batch-size', type=int, default=100, help='Users per recommend_batch request')
+    parser.add_argument('--neighbor-search', choices=['exact', 'lsh'], default='exact')
+    parser.add_argument('--components', nargs='+', help='Subset of components to run (default: all)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    n_users, n_stories, events_per_user = SIZES[args.size]
+    n_users = args.users or n_users
+    n_stories = args.stories or n_stories
+    events_per_user = args.events_per_user or events_per_user
+
+    start = time.perf_counter()
+    stories, users, history = generate_dataset(n_users, n_stories, events_per_user, seed=args.seed)
+    print(f"dataset  {n_users} users, {n_stories} stories, {len(history)} events "
+          f"(generated in {time.perf_counter() - start:.1f}s)")
+
+    start = time.perf_counter()
+    system = StoryRecommendationSystem(stories, users, history, neighbor_search=args.neighbor_search)
+    print(f"build    {time.perf_counter() - start:8.2f}s  peak RSS {peak_rss_mb():.0f} MB")
+
+    rng = np.random.default_rng(args.seed)
+    user_ids = list(rng.choice(users['user_id'].to_numpy(), args.requests))
+    story_ids = list(rng.choice(stories['story_id'].to_numpy(), args.requests))
+    calls = component_calls(system, user_ids, story_ids, args.batch_size)
+    unknown = set(args.components or []) - set(calls)
+    if unknown:
+        parser.error(f"unknown components: {', '.join(sorted(unknown))} (choose from {', '.join(calls)})")
+
+    print(f"{'component':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'req/s':>10}{'peak MB':>10}")
+    for name, call in calls.items():
+        if args.components and name not in args.components:
+            continue
+        latencies, peak = measure(call, args.requests)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+        print(f"{name:<16}{p50:10.2f}{p95:10.2f}{p99:10.2f}{latencies.max() * 1000:10.2f}"
+              f"{len(latencies) / latencies.sum():10.0f}{peak / 1024 / 1024:10.2f}")
+
+
+if __name__ == '__main__':
+    main()
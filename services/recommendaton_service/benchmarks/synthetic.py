@@ -0,0 +1,84 @@
+# synthetic.py
+"""Synthetic Story / User / History frames matching the MongoDB schema"""
+import numpy as np
+import pandas as pd
+
+GENRES = ['fantasy', 'adventure', 'fairy tales', 'animals', 'educational',
+          'friendship', 'mystery', 'family', 'nature', 'science fiction']
+TAGS = ['classic', 'magic', 'adventure', 'journey', 'lesson', 'friendship', 'transformation',
+        'nature', 'imagination', 'princess', 'love', 'food', 'exploration', 'night', 'quest',
+        'garden', 'friends', 'discovery', 'dreams', 'mystery', 'dragon', 'forest', 'sea', 'hero']
+AGE_RANGES = ['3-5', '6-8', '9-12']
+
+
+def generate_stories(n_stories, rng):
+    genres = ['|'.join(rng.choice(GENRES, rng.integers(1, 3), replace=False)) for _ in range(n_stories)]
+    tags = [list(rng.choice(TAGS, rng.integers(2, 6), replace=False)) for _ in range(n_stories)]
+    minutes = rng.integers(1, 7, n_stories)
+    return pd.DataFrame({
+        'story_id': [str(i) for i in range(1, n_stories + 1)],
+        'title': [f"Story {i}" for i in range(1, n_stories + 1)],
+        'genre': genres,
+        'tags': tags,
+        'reading_time': [f"{m} min read" if m == 1 else f"{m} mins read" for m in minutes],
+        'age_range': rng.choice(AGE_RANGES, n_stories),
+        'views': rng.zipf(1.6, n_stories).clip(max=200000),
+        'likes': rng.zipf(2.0, n_stories).clip(max=5000),
+        'image_url': [f"https://example.com/{i}.jpg" for i in range(1, n_stories + 1)],
+        'url': [f"https://example.com/story/{i}" for i in range(1, n_stories + 1)],
+    })
+
+
+def generate_users(n_users, rng):
+    reading_time_min = rng.integers(1, 5, n_users)
+    return pd.DataFrame({
+        'user_id': [f"user_{i}" for i in range(n_users)],
+        'preferred_genres': ['|'.join(rng.choice(GENRES, rng.integers(1, 4), replace=False)) for _ in range(n_users)],
+        'preferred_characters': ['|'.join(rng.choice(TAGS, 2, replace=False)) for _ in range(n_users)],
+        'preferred_emotions': ['|'.join(rng.choice(TAGS, 2, replace=False)) for _ in range(n_users)],
+        'age_range': rng.choice(AGE_RANGES, n_users),
+        'reading_time_min': reading_time_min,
+        'reading_time_max': reading_time_min + rng.integers(0, 4, n_users),
+    })
+
+
+def generate_history(n_users, n_stories, events_per_user, rng, n_clusters=20):
+    """
+    Reading events where users of the same taste cluster favour the same
+    stories, so that user-user similarities have a realistic structure.
+    """
+    n_events = n_users * events_per_user
+    user_rows = np.repeat(np.arange(n_users), events_per_user)
+    clusters = rng.integers(0, n_clusters, n_users)[user_rows]
+    cluster_size = max(n_stories // n_clusters, 1)
+    in_cluster = rng.random(n_events) < 0.7
+    # Outside their cluster, users read popular stories more (Zipf-like)
+    popularity = 1.0 / np.arange(1, n_stories + 1)
+    story_rows = np.where(
+        in_cluster,
+        (clusters * cluster_size + rng.integers(0, cluster_size, n_events)) % n_stories,
+        rng.choice(n_stories, n_events, p=popularity / popularity.sum())
+    )
+    completed = rng.random(n_events) < 0.5
+    start = np.datetime64('2025-01-01T00:00:00')
+    return pd.DataFrame({
+        'history_id': [f"h_{i}" for i in range(n_events)],
+        'user_id': np.array([f"user_{i}" for i in range(n_users)], dtype=object)[user_rows],
+        'story_id': np.array([str(i) for i in range(1, n_stories + 1)], dtype=object)[story_rows],
+        'read_date': start + rng.integers(0, 365 * 24 * 3600, n_events).astype('timedelta64[s]'),
+        'reading_progress': np.where(completed, 100, rng.integers(0, 100, n_events)),
+        'completed': completed,
+        'liked': rng.random(n_events) < 0.4,
+        'rating': rng.integers(1, 6, n_events).astype(float),
+        'time_spent_minutes': rng.integers(1, 10, n_events),
+    })
+
+
+def generate_dataset(n_users, n_stories, events_per_user=10, seed=0):
+    """(stories, users, history) DataFrames of the requested size"""
+    rng = np.random.default_rng(seed)
+    return (
+        generate_stories(n_stories, rng),
+        generate_users(n_users, rng),
+        generate_history(n_users, n_stories, events_per_user, rng),
+    )
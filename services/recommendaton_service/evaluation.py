@@ -0,0 +1,196 @@
+# evaluation.py
+"""
+Offline evaluation of recommendation quality against serving cost.
+
+History is split in time: the model is built on the events before the
+split date and, for every user with events after it, the stories read
+after the split are the relevant items. recommend_stories (or
+cold_start_stories for users without training history, as served by
+/api/recommend) is run for all test users in parallel worker processes
+forked from the built model, and the command reports precision@k,
+recall@k, NDCG@k, catalogue coverage and per-request latency.
+Latencies are measured while the workers run concurrently; use
+--workers 1 for the latency of an otherwise idle process.
+
+Several blends of the scoring weights (content, collaborative,
+behavioral) can be compared on the same split and the same model:
+
+    python evaluation.py --k 10 --weights 0.45 0.30 0.25 --weights 0.6 0.2 0.2
+    python evaluation.py --synthetic 20000 2000 --workers 8 --candidate-pool 200
+"""
+import argparse
+import gc
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from recommendation_system import StoryRecommendationSystem
+
+# Model and settings of the running evaluation, inherited by the forked workers
+_evaluation = {}
+
+
+def time_split(history, test_fraction=0.2, split_date=None):
+    """
+    (train, test, split date): events read before the split date, and the
+    dated events from it on. By default the split date is the quantile that
+    leaves test_fraction of the dated events in the test set.
+    """
+    read_at = pd.to_datetime(history['read_date'], errors='coerce')
+    if split_date is None:
+        split_date = read_at.dropna().quantile(1 - test_fraction)
+    else:
+        split_date = pd.Timestamp(split_date)
+    is_test = (read_at >= split_date).to_numpy()
+    return history[~is_test].reset_index(drop=True), history[is_test].reset_index(drop=True), split_date
+
+
+def relevant_stories(train, test, story_ids):
+    """
+    {user_id: set of relevant story ids}: the catalogue stories each user
+    read in the test period and had not read in the training period
+    """
+    read = set(zip(train['user_id'], train['story_id']))
+    relevant = {}
+    for user_id, story_id in zip(test['user_id'], test['story_id']):
+        if story_id in story_ids and (user_id, story_id) not in read:
+            relevant.setdefault(user_id, set()).add(story_id)
+    return relevant
+
+
+def _recommend_chunk(user_ids):
+    """[(user_id, recommended story ids, latency in seconds)] of a chunk of test users"""
+    system, k = _evaluation['system'], _evaluation['k']
+    candidate_pool = _evaluation['candidate_pool']
+    results = []
+    for user_id in user_ids:
+        start = time.perf_counter()
+        if system.has_history(user_id):
+            recs = system.recommend_stories(user_id, k, candidate_pool=candidate_pool)['story_id'].tolist()
+        else:
+            recs = [record['story_id'] for record in system.cold_start_stories(user_id, k)]
+        results.append((user_id, recs, time.perf_counter() - start))
+    return results
+
+
+def _init_worker():
+    # One BLAS thread per worker: the workers already use every core
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(1)
+
+
+def run_recommendations(system, user_ids, k, candidate_pool=None, workers=1, chunk_size=200):
+    """
+    Recommendations of every test user, computed by `workers` processes
+    forked from the built model (copy-on-write, nothing is pickled but the
+    user ids and the results)
+    """
+    _evaluation.update(system=system, k=k, candidate_pool=candidate_pool)
+    chunks = [user_ids[i:i + chunk_size] for i in range(0, len(user_ids), chunk_size)]
+    if workers <= 1:
+        return [result for chunk in chunks for result in _recommend_chunk(chunk)]
+
+    # Objects of the model are not traversed by the workers' GC, which
+    # would otherwise copy their pages (see serve.py)
+    gc.freeze()
+    try:
+        with multiprocessing.get_context('fork').Pool(workers, initializer=_init_worker) as pool:
+            return [result for chunk in pool.imap_unordered(_recommend_chunk, chunks) for result in chunk]
+    finally:
+        gc.unfreeze()
+
+
+def ranking_metrics(recommended, relevant, k):
+    """precision@k, recall@k and NDCG@k (binary relevance) of one user"""
+    gains = np.array([story_id in relevant for story_id in recommended[:k]], dtype=float)
+    discounts = 1 / np.log2(np.arange(2, k + 2))
+    ideal = discounts[:min(len(relevant), k)].sum()
+    return gains.sum() / k, gains.sum() / len(relevant), (gains * discounts[:len(gains)]).sum() / ideal
+
+
+def evaluate(system, relevant, k, candidate_pool=None, workers=1):
+    """Quality and cost report of the model on the test users"""
+    start = time.perf_counter()
+    results = run_recommendations(system, list(relevant), k, candidate_pool, workers)
+    elapsed = time.perf_counter() - start
+
+    metrics = np.array([ranking_metrics(recs, relevant[user_id], k) for user_id, recs, _ in results])
+    latencies = np.array([latency for _, _, latency in results])
+    recommended = {story_id for _, recs, _ in results for story_id in recs}
+    cold_start = sum(not system.has_history(user_id) for user_id in relevant)
+    return {
+        'users': len(results),
+        'cold_start_users': cold_start,
+        f'precision@{k}': metrics[:, 0].mean(),
+        f'recall@{k}': metrics[:, 1].mean(),
+        f'ndcg@{k}': metrics[:, 2].mean(),
+        'coverage': len(recommended) / len(system.stories),
+        'p50_ms': np.percentile(latencies, 50) * 1000,
+        'p95_ms': np.percentile(latencies, 95) * 1000,
+        'p99_ms': np.percentile(latencies, 99) * 1000,
+        'wall_s': elapsed,
+        'req_per_s': len(results) / elapsed,
+    }
+
+
+def load_frames(args):
+    """(stories, users, history) from MongoDB, or synthetic frames"""
+    if args.synthetic:
+        from benchmarks.synthetic import generate_dataset
+        n_users, n_stories = args.synthetic
+        return generate_dataset(n_users, n_stories, seed=args.seed)
+    from model_loader import load_data_from_mongo
+    return load_data_from_mongo()
+
+
+def main():
+    from model_loader import model_options
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--k', type=int, default=10, help='Recommendations per user')
+    parser.add_argument('--test-fraction', type=float, default=0.2,
+                        help='Share of the dated History events in the test period')
+    parser.add_argument('--split-date', help='Start of the test period (overrides --test-fraction)')
+    parser.add_argument('--weights', type=float, nargs=3, action='append',
+                        metavar=('CONTENT', 'COLLABORATIVE', 'BEHAVIORAL'),
+                        help='Blend of the scoring weights to evaluate (repeatable; default: the model\'s)')
+    parser.add_argument('--candidate-pool', type=int, default=None,
+                        help='Candidates scored per request (0: whole catalogue; default: RECO_CANDIDATE_POOL)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--max-users', type=int, help='Evaluate a random sample of the test users')
+    parser.add_argument('--synthetic', type=int, nargs=2, metavar=('USERS', 'STORIES'),
+                        help='Evaluate on synthetic data instead of MongoDB')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    stories, users, history = load_frames(args)
+    train, test, split_date = time_split(history, args.test_fraction, args.split_date)
+    relevant = relevant_stories(train, test, set(stories['story_id']))
+    if args.max_users and len(relevant) > args.max_users:
+        rng = np.random.default_rng(args.seed)
+        sampled = rng.choice(len(relevant), args.max_users, replace=False)
+        user_ids = list(relevant)
+        relevant = {user_ids[i]: relevant[user_ids[i]] for i in sorted(sampled)}
+    print(f"split    {split_date}: {len(train)} train / {len(test)} test events, {len(relevant)} test users")
+
+    start = time.perf_counter()
+    system = StoryRecommendationSystem(stories, users, train, **model_options())
+    print(f"build    {time.perf_counter() - start:.1f}s")
+
+    blends = args.weights or [(system.content_weight, system.collaborative_weight, system.behavioral_weight)]
+    header = None
+    for blend in blends:
+        system.content_weight, system.collaborative_weight, system.behavioral_weight = blend
+        report = evaluate(system, relevant, args.k, args.candidate_pool, args.workers)
+        if header is None:
+            header = ['weights'] + list(report)
+            print(''.join(f"{name:>18}" for name in header))
+        print(f"{'/'.join(f'{w:g}' for w in blend):>18}" +
+              ''.join(f"{value:>18}" if isinstance(value, int) else f"{value:18.4f}" for value in report.values()))
+
+
+if __name__ == '__main__':
+    main()
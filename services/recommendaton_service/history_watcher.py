@@ -0,0 +1,62 @@
+import threading
+import time
+from db import stories_collection, histories_collection
+from model_loader import STORY_FIELDS, HISTORY_FIELDS
+
+# ======================================================
+# 🔄 Mise à jour incrémentale via les change streams MongoDB
+# (nécessite un replica set)
+# ======================================================
+
+RETRY_DELAY_SECONDS = 5
+
+
+def watch_inserts(collection, handler):
+    """Appelle handler(document) pour chaque document inséré dans la collection"""
+    def run():
+        resume_token = None
+        while True:
+            try:
+                pipeline = [{"$match": {"operationType": "insert"}}]
+                with collection.watch(pipeline, resume_after=resume_token) as stream:
+                    for change in stream:
+                        resume_token = stream.resume_token
+                        try:
+                            handler(change["fullDocument"])
+                        except Exception as e:
+                            print(f"❌ Erreur de mise à jour ({collection.name}) :", e)
+            except Exception as e:
+                print(f"❌ Change stream {collection.name} interrompu :", e)
+                time.sleep(RETRY_DELAY_SECONDS)
+
+    thread = threading.Thread(target=run, name=f"watch-{collection.name}", daemon=True)
+    thread.start()
+    return thread
+
+
+def _project(doc, fields):
+    """Ne garde que les champs chargés au démarrage (voir model_loader)"""
+    return {field: value for field, value in doc.items() if field in fields}
+
+
+def start_watchers(current_system, on_update=None):
+    """
+    Alimente le système de recommandation servi (current_system() : il peut
+    être remplacé par un rechargement) avec les nouvelles stories et
+    historiques ; on_update() est appelé après chaque mise à jour appliquée
+    """
+    def handler(update):
+        def handle(doc):
+            system = current_system()
+            if system is None:
+                return
+            update(system, doc)
+            if on_update is not None:
+                on_update()
+        return handle
+
+    watch_inserts(stories_collection, handler(
+        lambda system, doc: system.add_story(_project(doc, STORY_FIELDS))))
+    watch_inserts(histories_collection, handler(
+        lambda system, doc: system.update_interaction(**_project(doc, HISTORY_FIELDS))))
+    print("🔄 Change streams Story/History démarrés.")
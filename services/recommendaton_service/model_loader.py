@@ -0,0 +1,164 @@
+import os
+import resource
+import time
+import numpy as np
+import pandas as pd
+from db import stories_collection, users_collection, histories_collection
+from recommendation_system import StoryRecommendationSystem
+
+# ======================================================
+# 🧠 Construction du système de recommandation depuis MongoDB
+# ======================================================
+
+LOAD_BATCH_SIZE = int(os.getenv("RECO_LOAD_BATCH_SIZE", "10000"))
+
+# Seuls les champs utilisés par le recommandeur sont chargés (projection) :
+# le texte, la transcription et les questions des stories restent dans Mongo.
+# Types : "object", "category", "float32", "float64", "boolean", "datetime"
+STORY_FIELDS = {
+    "story_id": "object",
+    "title": "object",
+    "genre": "object",
+    "tags": "object",
+    "reading_time": "object",
+    "age_range": "object",
+    "views": "float64",
+    "likes": "float64",
+    "image_url": "object",
+    "url": "object",
+}
+
+USER_FIELDS = {
+    "user_id": "object",
+    "age_range": "category",
+    "preferred_genres": "object",
+    "preferred_characters": "object",
+    "preferred_emotions": "object",
+    "reading_time_min": "float32",
+    "reading_time_max": "float32",
+}
+
+HISTORY_FIELDS = {
+    "user_id": "category",
+    "story_id": "category",
+    "reading_progress": "float32",
+    "liked": "boolean",
+    "rating": "float32",
+    "completed": "boolean",
+    "read_date": "datetime",
+}
+
+
+def _batches(cursor, size):
+    """Regroupe les documents d'un curseur par lots de `size`"""
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _typed_values(values, kind):
+    """Convertit les valeurs d'un lot dans le type de colonne demandé"""
+    if kind in ("float32", "float64"):
+        return pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype=kind)
+    if kind == "boolean":
+        # -1 : valeur manquante
+        return np.fromiter((-1 if v is None else bool(v) for v in values), dtype=np.int8, count=len(values))
+    if kind == "datetime":
+        return pd.to_datetime(pd.Series(values, dtype=object), errors="coerce").to_numpy()
+    return values
+
+
+def load_collection(collection, fields, batch_size=LOAD_BATCH_SIZE):
+    """
+    Charge une collection en DataFrame typé en ne lisant que `fields`, lot
+    par lot. Les colonnes "category" sont encodées au fil de l'eau (codes
+    int32 + dictionnaire des valeurs), sans matérialiser de chaînes.
+    Les champs absents de tous les documents ne donnent pas de colonne.
+    """
+    projection = {field: 1 for field in fields}
+    projection["_id"] = 0
+    chunks = {field: [] for field in fields}
+    categories = {field: {} for field, kind in fields.items() if kind == "category"}
+    seen = set()
+
+    for batch in _batches(collection.find({}, projection, batch_size=batch_size), batch_size):
+        for doc in batch:
+            seen.update(doc)
+        for field, kind in fields.items():
+            values = [doc.get(field) for doc in batch]
+            if kind == "category":
+                codes = categories[field]
+                chunks[field].append(np.fromiter(
+                    (-1 if v is None else codes.setdefault(v, len(codes)) for v in values),
+                    dtype=np.int32, count=len(values)
+                ))
+            elif kind == "object":
+                chunks[field].extend(values)
+            else:
+                chunks[field].append(_typed_values(values, kind))
+
+    columns = {}
+    for field, kind in fields.items():
+        if field not in seen:
+            continue
+        parts = chunks[field]
+        if kind == "category":
+            columns[field] = pd.Categorical.from_codes(np.concatenate(parts), categories=list(categories[field]))
+        elif kind == "object":
+            columns[field] = pd.Series(parts, dtype=object)
+        elif kind == "boolean":
+            values = np.concatenate(parts)
+            columns[field] = pd.arrays.BooleanArray(values == 1, values < 0)
+        else:
+            columns[field] = np.concatenate(parts)
+    return pd.DataFrame(columns)
+
+
+def _megabytes(n_bytes):
+    return n_bytes / (1024 * 1024)
+
+
+def load_data_from_mongo():
+    """Charge les collections MongoDB en DataFrames pandas (projetés et typés)"""
+    frames = []
+    for collection, fields in ((stories_collection, STORY_FIELDS),
+                               (users_collection, USER_FIELDS),
+                               (histories_collection, HISTORY_FIELDS)):
+        start = time.perf_counter()
+        frame = load_collection(collection, fields)
+        print(f"📦 {collection.name} : {len(frame)} documents, "
+              f"{_megabytes(frame.memory_usage(deep=True).sum()):.1f} Mo, "
+              f"{time.perf_counter() - start:.2f} s")
+        frames.append(frame)
+    return tuple(frames)
+
+
+def model_options():
+    """Paramètres du modèle lus depuis les variables d'environnement"""
+    return {
+        "n_neighbors": int(os.getenv("RECO_N_NEIGHBORS", "10")),
+        "n_similar": int(os.getenv("RECO_N_SIMILAR", "50")),
+        "neighbor_search": os.getenv("RECO_NEIGHBOR_SEARCH", "exact"),
+        "lsh_tables": int(os.getenv("RECO_LSH_TABLES", "16")),
+        "lsh_band_size": int(os.getenv("RECO_LSH_BAND_SIZE", "1")),
+        # 0 : toutes les stories sont scorées pour chaque recommandation
+        "candidate_pool": int(os.getenv("RECO_CANDIDATE_POOL", "0")) or None,
+        # "lifetime" (compteurs views/likes) ou "trending" (historique récent)
+        "popularity": os.getenv("RECO_POPULARITY", "lifetime"),
+    }
+
+
+def build_model():
+    """Reconstruit complètement le système à partir des collections MongoDB"""
+    start = time.perf_counter()
+    stories, users, history = load_data_from_mongo()
+    system = StoryRecommendationSystem(stories, users, history, **model_options())
+    # ru_maxrss est en Ko sous Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"🧠 Modèle construit en {time.perf_counter() - start:.2f} s (pic mémoire du processus : {peak:.0f} Mo)")
+    return system
@@ -0,0 +1,227 @@
+# model_snapshot.py
+"""
+Versioned on-disk snapshots of a built StoryRecommendationSystem.
+
+A snapshot is a directory holding one .npy file per large array (loaded
+memory-mapped, copy-on-write, so that every worker of the machine shares
+the same pages), a pickle with the small state, and a metadata.json.
+The history, by far the largest frame, is stored column by column (only
+the columns the model reads, ids as category codes) together with its
+per-user index, so that loading it maps files instead of unpickling every
+event. The story and user frames are pickled: their load time grows with
+the catalogue and the number of users. Snapshots are published under a root directory as
+<root>/<version>/ and <root>/CURRENT names the latest one.
+
+Background rebuild job (from services/recommendaton_service):
+    python model_snapshot.py --root /data/reco-snapshots --interval 3600
+"""
+import argparse
+import json
+import os
+import pickle
+import shutil
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+from recommendation_system import StoryRecommendationSystem, UserHistoryIndex
+
+SNAPSHOT_FORMAT = 3
+CURRENT_POINTER = 'CURRENT'
+
+# Large arrays, stored as .npy and memory-mapped on load
+DENSE_ARRAYS = ['story_features', 'user_norms', 'neighbor_ids', 'neighbor_weights',
+                'similar_ids', 'similar_scores']
+SPARSE_MATRICES = ['user_preferences', 'user_item_matrix']
+# Arrays of the per-user history index (see UserHistoryIndex), memory-mapped
+HISTORY_INDEX_ARRAYS = ['offsets', 'positions']
+# Everything else needed to serve and update the model, pickled
+STATE = ['n_neighbors', 'n_similar', 'neighbor_search', 'candidate_pool', 'popularity', 'neighbor_index',
+         'stories', 'users', 'story_index', 'user_index', 'interaction_index',
+         'feature_index', 'feature_slices', 'n_time_buckets', 'popularity_column',
+         'bias_column', 'story_set_sizes', '_trending_views', '_trending_likes', '_trending_time',
+         '_trending_position', 'trending_rows', '_segments', '_user_segments']
+
+
+def _save_history(history, directory):
+    """
+    Write the history columns used by the model as history.<i>.npy (ids as
+    category codes); returns the layout [(column, kind, categories or
+    values)] kept in the state
+    """
+    layout = []
+    columns = history.columns.intersection(StoryRecommendationSystem.history_columns, sort=False)
+    for i, column in enumerate(columns):
+        values = history[column]
+        kind, extra = 'array', None
+        if values.dtype == object:
+            try:
+                codes, categories = pd.factorize(values)
+                values = pd.Series(pd.Categorical.from_codes(codes, categories))
+            except TypeError:
+                pass  # Unhashable values (lists, documents): pickled below
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            kind, extra = 'category', values.cat.categories
+            array = values.cat.codes.to_numpy()
+        elif isinstance(values.dtype, pd.BooleanDtype) and not values.isna().any():
+            array = values.to_numpy(dtype=bool)
+        elif isinstance(values.dtype, np.dtype) and values.dtype != object:
+            array = values.to_numpy()
+        else:
+            # Nullable columns with missing values, other extension types
+            layout.append((column, 'pickled', values.array))
+            continue
+        np.save(os.path.join(directory, f"history.{i}.npy"), array)
+        layout.append((column, kind, extra))
+    return layout
+
+
+def _load_history(directory, layout, mmap_mode):
+    """History frame whose columns map the files written by _save_history"""
+    columns = {}
+    for i, (column, kind, value) in enumerate(layout):
+        if kind == 'pickled':
+            columns[column] = value
+            continue
+        array = np.load(os.path.join(directory, f"history.{i}.npy"), mmap_mode=mmap_mode)
+        columns[column] = pd.Categorical.from_codes(array, value) if kind == 'category' else array
+    return pd.DataFrame(columns, copy=False)
+
+
+def save_snapshot(system, directory):
+    """Write the state of a built model to a new directory"""
+    os.makedirs(directory)
+    with system._lock:
+        for name in DENSE_ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(system, name))
+
+        shapes = {}
+        for name in SPARSE_MATRICES:
+            matrix = getattr(system, name).tocsr()
+            shapes[name] = matrix.shape
+            for part in ('data', 'indices', 'indptr'):
+                np.save(os.path.join(directory, f"{name}.{part}.npy"), getattr(matrix, part))
+
+        index = system.user_history
+        for name in HISTORY_INDEX_ARRAYS:
+            np.save(os.path.join(directory, f"user_history.{name}.npy"), getattr(index, name))
+
+        state = {name: getattr(system, name) for name in STATE}
+        state['sparse_shapes'] = shapes
+        state['history_layout'] = _save_history(system.history, directory)
+        state['user_history_rows'] = index.rows
+        state['user_history_appended'] = index.appended
+        with open(os.path.join(directory, 'state.pkl'), 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        metadata = {
+            'format': SNAPSHOT_FORMAT,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'stories': len(system.stories),
+            'users': len(system.users),
+            'interactions': int(system.user_item_matrix.nnz),
+        }
+    with open(os.path.join(directory, 'metadata.json'), 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+
+def load_snapshot(directory, mmap_mode='c'):
+    """
+    Load a model saved by save_snapshot. With the default copy-on-write
+    mmap_mode, arrays are only copied (page by page) by the process that
+    updates them.
+    """
+    with open(os.path.join(directory, 'metadata.json')) as f:
+        metadata = json.load(f)
+    if metadata.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError(f"Unsupported snapshot format {metadata.get('format')} in {directory}")
+
+    with open(os.path.join(directory, 'state.pkl'), 'rb') as f:
+        state = pickle.load(f)
+
+    system = StoryRecommendationSystem.__new__(StoryRecommendationSystem)
+    system._init_runtime_state()
+    shapes = state.pop('sparse_shapes')
+    history_layout = state.pop('history_layout')
+    index = UserHistoryIndex(state.pop('user_history_rows'), *(
+        np.load(os.path.join(directory, f"user_history.{name}.npy"), mmap_mode=mmap_mode)
+        for name in HISTORY_INDEX_ARRAYS
+    ))
+    index.appended = state.pop('user_history_appended')
+    system.user_history = index
+    system.history = _load_history(directory, history_layout, mmap_mode)
+    for name, value in state.items():
+        setattr(system, name, value)
+    for name in DENSE_ARRAYS:
+        setattr(system, name, np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode))
+    for name in SPARSE_MATRICES:
+        parts = [np.load(os.path.join(directory, f"{name}.{part}.npy"), mmap_mode=mmap_mode)
+                 for part in ('data', 'indices', 'indptr')]
+        setattr(system, name, csr_matrix(tuple(parts), shape=shapes[name], copy=False))
+    system.snapshot_metadata = metadata
+    return system
+
+
+def publish_snapshot(system, root, keep=3):
+    """Save a new snapshot version under root, point CURRENT to it and prune old versions"""
+    os.makedirs(root, exist_ok=True)
+    version = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+    staging = os.path.join(root, f".{version}.tmp")
+    save_snapshot(system, staging)
+    os.rename(staging, os.path.join(root, version))
+
+    pointer = os.path.join(root, CURRENT_POINTER)
+    with open(f"{pointer}.tmp", 'w') as f:
+        f.write(version)
+    os.replace(f"{pointer}.tmp", pointer)  # Atomic switch for new workers
+
+    # Processes still mapping a removed version keep their (unlinked) pages
+    versions = sorted(name for name in os.listdir(root) if not name.startswith('.') and name != CURRENT_POINTER)
+    for old in versions[:-keep]:
+        shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+    return version
+
+
+def current_version(root):
+    """Version named by <root>/CURRENT, or None"""
+    try:
+        with open(os.path.join(root, CURRENT_POINTER)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def load_latest_snapshot(root, mmap_mode='c'):
+    """Load the snapshot named by <root>/CURRENT, or return None if there is none"""
+    version = current_version(root)
+    if version is None:
+        return None
+    system = load_snapshot(os.path.join(root, version), mmap_mode=mmap_mode)
+    system.snapshot_version = version
+    return system
+
+
+def main():
+    from model_loader import build_model
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--root', default=os.getenv('RECO_SNAPSHOT_DIR', 'snapshots'))
+    parser.add_argument('--interval', type=float, default=0,
+                        help='Rebuild every INTERVAL seconds (0: build once)')
+    parser.add_argument('--keep', type=int, default=3, help='Number of versions kept on disk')
+    args = parser.parse_args()
+
+    while True:
+        start = time.perf_counter()
+        version = publish_snapshot(build_model(), args.root, keep=args.keep)
+        print(f"✅ Snapshot {version} published in {time.perf_counter() - start:.1f}s")
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
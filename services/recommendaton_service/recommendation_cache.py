@@ -0,0 +1,73 @@
+import threading
+import time
+from collections import OrderedDict
+
+# ======================================================
+# ⚡ Cache LRU + TTL des recommandations par utilisateur
+# ======================================================
+
+
+class RecommendationCache:
+    """
+    Cache LRU avec expiration (TTL) des réponses de recommandation.
+
+    Chaque entrée est stockée avec la version du modèle qui l'a produite
+    (voir StoryRecommendationSystem.cache_version) : une entrée dont la
+    version ne correspond plus (historique de l'utilisateur modifié, story
+    ajoutée, modèle reconstruit) est invalidée à la lecture.
+    """
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get(self, key, version):
+        """Retourne la valeur en cache, ou None si absente, expirée ou invalidée"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            entry_version, expires_at, value = entry
+            if entry_version != version or expires_at <= time.monotonic():
+                del self._entries[key]
+                self.invalidations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, version, value):
+        with self._lock:
+            self._entries[key] = (version, time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions
+            }
@@ -1,19 +1,208 @@
 # recommendation_system.py
 import pandas as pd
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import MinMaxScaler
+import functools
+import itertools
+import re
+import threading
+import time
+from collections import defaultdict
+from scipy.sparse import csr_matrix
+from ann_index import MinHashLSH
+from sklearn.preprocessing import MinMaxScaler, normalize
+from serialization import dumps, number
 import warnings
 warnings.filterwarnings('ignore')
 
+
+# Distinct version for every built model, so that cached results never outlive it
+_model_versions = itertools.count(1)
+
+
+def _split_field(value, sep):
+    """Split a separated string field (or a list field) into its raw items"""
+    if isinstance(value, str):
+        return value.split(sep)
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [str(item) for item in value]
+    return []
+
+
+def _as_float(value):
+    """Numeric value of a profile field, NaN when missing"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _tokens(value, sep):
+    """Normalized (stripped, lower-cased) non-empty items of a field"""
+    return [item.strip().lower() for item in _split_field(value, sep) if item.strip()]
+
+
+def _reading_time_minutes(value):
+    """Minutes of a reading time such as "3 mins read" (or a plain number)"""
+    if isinstance(value, str):
+        match = re.search(r'\d+', value)
+        return float(match.group()) if match else np.nan
+    return _as_float(value)
+
+
+def _prepare_history(history):
+    """Fill missing history values and add the implicit feedback score (0 to 1)"""
+    # Fields missing from a document (or from all of them) get their default value
+    for column, default in (('liked', False), ('completed', False), ('rating', 3), ('reading_progress', 0)):
+        history[column] = history[column].fillna(default) if column in history else default
+    history['interaction_score'] = (
+        (history['reading_progress'] / 100) * 0.3 +
+        history['liked'].astype(float) * 0.3 +
+        (history['rating'] / 5) * 0.2 +
+        history['completed'].astype(float) * 0.2
+    )
+    return history
+
+
+def _is_true(flags):
+    """Boolean mask of the True values of a flag column (missing values are False)"""
+    return flags.eq(True).fillna(False).astype(bool)
+
+
+def _synchronized(method):
+    """Run a method while holding the model lock"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _top_k(ids, weights, k):
+    """The k highest weighted ids, sorted by decreasing weight"""
+    if len(weights) > k:
+        top = np.argpartition(-weights, k - 1)[:k]
+        ids, weights = ids[top], weights[top]
+    order = np.argsort(-weights, kind='stable')
+    return ids[order], weights[order]
+
+
+class UserHistoryIndex:
+    """
+    Positions of each user's events in the history, laid out as one array
+    of positions grouped by user and an array of offsets (user `row` owns
+    positions[offsets[row]:offsets[row + 1]]), so that it is stored and
+    memory-mapped as two arrays. Events appended after the build are kept
+    in a small per-user dict.
+    """
+
+    def __init__(self, rows, offsets, positions):
+        self.rows = rows  # user id -> row of offsets
+        self.offsets = offsets
+        self.positions = positions
+        self.appended = {}  # user id -> positions appended since the build
+
+    @classmethod
+    def build(cls, user_ids):
+        """Index of a history user_id column (events without user are not indexed)"""
+        codes, users = pd.factorize(user_ids)
+        events = np.flatnonzero(codes >= 0)
+        positions = events[np.argsort(codes[events], kind='stable')].astype(np.int64)
+        offsets = np.zeros(len(users) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(codes[events], minlength=len(users)), out=offsets[1:])
+        return cls({user_id: row for row, user_id in enumerate(users)}, offsets, positions)
+
+    def __contains__(self, user_id):
+        return user_id in self.rows or user_id in self.appended
+
+    def __getitem__(self, user_id):
+        row = self.rows.get(user_id)
+        positions = (self.positions[self.offsets[row]:self.offsets[row + 1]] if row is not None
+                     else np.empty(0, dtype=np.int64))
+        appended = self.appended.get(user_id)
+        if appended is None:
+            if row is None:
+                raise KeyError(user_id)
+            return positions
+        return np.concatenate([positions, appended])
+
+    def append(self, user_id, position):
+        self.appended.setdefault(user_id, []).append(position)
+
+
 class StoryRecommendationSystem:
-    def __init__(self, stories_df, users_df, history_df):
+    # Number of users whose similarities are computed in one sparse product
+    similarity_block_size = 1024
+    # Number of LSH candidate pairs whose cosine is computed at once
+    lsh_pair_block_size = 1 << 20
+    # Seconds during which the popularity ordering of candidates is reused
+    candidate_index_max_age = 60
+    # Stories read from each preferred feature bucket, per candidate
+    candidate_bucket_depth = 4
+
+    # Half-life of the History events in the trending scores
+    trending_half_life_days = 7.0
+    # Number of trending stories kept ready to serve
+    trending_size = 100
+    # Number of stories kept ready to serve per cold-start segment
+    segment_size = 100
+
+    # MMR reranks the mmr_pool_factor * n most relevant candidates
+    mmr_pool_factor = 5
+
+    # Blend of the three scoring approaches
+    content_weight = 0.45
+    collaborative_weight = 0.30
+    behavioral_weight = 0.25
+
+    story_detail_columns = ['story_id', 'title', 'genre', 'tags', 'reading_time', 'age_range',
+                            'views', 'likes', 'image_url', 'url']
+    # History columns read once the model is built (scoring, updates, trending)
+    history_columns = ['user_id', 'story_id', 'read_date', 'reading_progress', 'liked', 'completed',
+                       'interaction_score']
+
+    def __init__(self, stories_df, users_df, history_df, n_neighbors=10, n_similar=50,
+                 neighbor_search='exact', lsh_tables=16, lsh_band_size=1, candidate_pool=None,
+                 popularity='lifetime'):
+        """
+        Args:
+            n_neighbors: Number of similar users kept per user
+            n_similar: Number of similar stories kept per story
+            neighbor_search: 'exact' (cosine with every co-reader) or 'lsh'
+                (cosine with MinHash LSH candidates only, sub-linear in users)
+            lsh_tables, lsh_band_size: LSH index shape when neighbor_search='lsh'
+            candidate_pool: Default number of candidates scored by
+                recommend_stories (None: score the whole catalogue)
+            popularity: Popularity boost of the content score, 'lifetime'
+                (views/likes counters) or 'trending' (time-decayed History
+                events, see refresh_trending)
+        """
+        if neighbor_search not in ('exact', 'lsh'):
+            raise ValueError(f"Unknown neighbor_search {neighbor_search!r}")
+        if popularity not in ('lifetime', 'trending'):
+            raise ValueError(f"Unknown popularity {popularity!r}")
+        self.n_neighbors = n_neighbors
+        self.n_similar = n_similar
+        self.neighbor_search = neighbor_search
+        self.candidate_pool = candidate_pool
+        self.popularity = popularity
+        self.neighbor_index = MinHashLSH(lsh_tables, lsh_band_size) if neighbor_search == 'lsh' else None
+        self._init_runtime_state()
         self.stories = stories_df.copy()
         self.users = users_df.copy()
         self.history = history_df.copy()
         self._preprocess_data()
         self._build_user_item_matrix()
         self._calculate_user_similarity()
+        self._build_similarity_index()
+        self._build_segments()
+
+    def _init_runtime_state(self):
+        """Per-process state that is never persisted (see model_snapshot)"""
+        self._lock = threading.RLock()
+        self.model_version = next(_model_versions)
+        self._user_versions = defaultdict(int)
+        self._candidate_index = None
+        self._fragments = None
 
     def _preprocess_data(self):
         if 'reading_time' in self.stories.columns and self.stories['reading_time'].dtype == 'object':
@@ -21,312 +210,1155 @@ class StoryRecommendationSystem:
         else:
             self.stories['reading_time_minutes'] = self.stories.get('reading_time', pd.Series(0))
 
+        self._compute_popularity()
+
+        # Row position of every story, shared by all the precomputed matrices
+        self.stories = self.stories.reset_index(drop=True)
+        self.story_index = {}
+        for row, story_id in enumerate(self.stories['story_id']):
+            self.story_index.setdefault(story_id, row)
+
+        self._init_trending()
+        self._build_story_features()
+        self._build_user_profiles()
+
+    def _compute_popularity(self):
         scaler = MinMaxScaler()
         self.stories['views_normalized'] = scaler.fit_transform(self.stories[['views']].fillna(0))
         self.stories['likes_normalized'] = scaler.fit_transform(self.stories[['likes']].fillna(0))
         self.stories['popularity_score'] = (self.stories['views_normalized'] * 0.4 +
                                             self.stories['likes_normalized'] * 0.6)
 
-    def _build_user_item_matrix(self):
-        self.history['liked'] = self.history['liked'].fillna(False)
-        self.history['rating'] = self.history['rating'].fillna(3)
-        self.history['reading_progress'] = self.history['reading_progress'].fillna(0)
-
-        self.history['interaction_score'] = (
-            (self.history['reading_progress'] / 100) * 0.3 +
-            self.history['liked'].astype(float) * 0.3 +
-            (self.history['rating'] / 5) * 0.2 +
-            self.history['completed'].astype(float) * 0.2
+    def _popularity_boost(self):
+        """Popularity feature of every story row (0 to 1)"""
+        column = 'trending_score' if self.popularity == 'trending' else 'popularity_score'
+        return self.stories[column].fillna(0).to_numpy()
+
+    def _build_story_features(self):
+        """
+        Build the story feature matrix used by content-based scoring.
+
+        Columns are multi-hot genre and tag indicators, a one-hot age range,
+        a one-hot reading time bucket (one per minute), the popularity score
+        and a constant bias column.
+        """
+        attributes = [self._story_attributes(story) for story in self.stories.to_dict('records')]
+        genres, tags, ages, minutes = zip(*attributes) if attributes else ([], [], [], [])
+
+        known_minutes = [m for m in minutes if not np.isnan(m) and m >= 0]
+        self.n_time_buckets = int(max(known_minutes)) + 1 if known_minutes else 0
+
+        vocabularies = [
+            ('genre', sorted(set().union(*genres))),
+            ('tag', sorted(set().union(*tags))),
+            ('age', list(dict.fromkeys(a for a in ages if pd.notna(a)))),
+            ('time', range(self.n_time_buckets)),
+        ]
+        self.feature_index = {}
+        self.feature_slices = {}
+        for kind, vocabulary in vocabularies:
+            start = len(self.feature_index)
+            for value in vocabulary:
+                self.feature_index[(kind, value)] = len(self.feature_index)
+            self.feature_slices[kind] = slice(start, len(self.feature_index))
+        self.popularity_column = len(self.feature_index)
+        self.bias_column = self.popularity_column + 1
+
+        features = np.zeros((len(self.stories), self.bias_column + 1), dtype=np.float32)
+        for row, story_attributes in enumerate(attributes):
+            features[row] = self._story_feature_row(*story_attributes)
+        features[:, self.popularity_column] = self._popularity_boost()
+        self.story_features = features
+        self._count_story_sets()
+
+    def _count_story_sets(self):
+        """Number of genres and tags of every story"""
+        self.story_set_sizes = {
+            kind: self.story_features[:, self.feature_slices[kind]].sum(axis=1)
+            for kind in ('genre', 'tag')
+        }
+
+    @staticmethod
+    def _story_attributes(story):
+        """(genres, tags, age range, reading minutes) of a story record"""
+        return (
+            set(_tokens(story.get('genre'), '|')),
+            set(_tokens(story.get('tags'), ',')),
+            story.get('age_range'),
+            _as_float(story.get('reading_time_minutes')),
         )
 
-        self.user_item_matrix = self.history.pivot_table(
-            index='user_id', columns='story_id', values='interaction_score', fill_value=0
+    def _is_in_vocabulary(self, genres, tags, age, minute):
+        """Whether a story can be encoded without adding feature columns"""
+        return (
+            all(('genre', genre) in self.feature_index for genre in genres) and
+            all(('tag', tag) in self.feature_index for tag in tags) and
+            (pd.isna(age) or ('age', age) in self.feature_index) and
+            (np.isnan(minute) or minute < 0 or minute < self.n_time_buckets)
+        )
+
+    def _story_feature_row(self, genres, tags, age, minute):
+        """Feature row of a story, without its popularity score"""
+        row = np.zeros(self.bias_column + 1, dtype=np.float32)
+        for genre in genres:
+            row[self.feature_index[('genre', genre)]] = 1
+        for tag in tags:
+            row[self.feature_index[('tag', tag)]] = 1
+        if pd.notna(age):
+            row[self.feature_index[('age', age)]] = 1
+        if not np.isnan(minute) and minute >= 0:
+            row[self.feature_index[('time', int(minute))]] = 1
+        row[self.bias_column] = 1
+        return row
+
+    def _build_user_profiles(self):
+        """Precompute one sparse preference vector per user over the story features"""
+        self.user_index = {}
+        rows, cols, values = [], [], []
+        for row, user in enumerate(self.users.to_dict('records')):
+            self.user_index.setdefault(user['user_id'], row)
+            for col, weight in self._user_preference_weights(user).items():
+                rows.append(row)
+                cols.append(col)
+                values.append(weight)
+
+        self.user_preferences = csr_matrix(
+            (values, (rows, cols)),
+            shape=(len(self.users), self.story_features.shape[1]),
+            dtype=np.float32
         )
 
+    def _user_preference_weights(self, user):
+        """
+        Map a user profile to {feature column: weight} so that the dot product
+        with a story feature row reproduces the content score:
+        genre 0.25, characters 0.20, emotions 0.20, age 0.20 (0.10 when it
+        differs), reading time 0.10 (0.05 when close) and popularity 0.05.
+        """
+        weights = defaultdict(float)
+
+        def add_matches(kind, preferred, sep, weight):
+            preferred = _split_field(preferred, sep)
+            for value in preferred:
+                col = self.feature_index.get((kind, value.strip().lower()))
+                if col is not None:
+                    weights[col] += weight / len(preferred)
+
+        add_matches('genre', user.get('preferred_genres'), '|', 0.25)
+        add_matches('tag', user.get('preferred_characters'), '|', 0.20)
+        add_matches('tag', user.get('preferred_emotions'), '|', 0.20)
+
+        age_col = self.feature_index.get(('age', user.get('age_range')))
+        if age_col is not None:
+            weights[age_col] += 0.10
+        weights[self.bias_column] += 0.10
+
+        if self.n_time_buckets:
+            minutes = np.arange(self.n_time_buckets, dtype=float)
+            time_min = _as_float(user.get('reading_time_min'))
+            time_max = _as_float(user.get('reading_time_max'))
+            in_range = (time_min <= minutes) & (minutes <= time_max)
+            close = (np.abs(minutes - time_min) <= 2) | (np.abs(minutes - time_max) <= 2)
+            time_weights = np.where(in_range, 0.10, np.where(close, 0.05, 0.0))
+            for minute in np.flatnonzero(time_weights):
+                weights[self.feature_index[('time', int(minute))]] += time_weights[minute]
+
+        weights[self.popularity_column] += 0.05
+        return weights
+
+    def _build_user_item_matrix(self):
+        self.history = _prepare_history(self.history)
+        self._index_history()
+
+        # Sparse users x stories matrix; columns follow the story rows.
+        # Repeated (user, story) events are averaged, interactions with
+        # stories missing from the catalogue are ignored.
+        known = self.history['story_id'].isin(list(self.story_index))
+        scores = self.history[known].groupby(['user_id', 'story_id'], sort=False,
+                                             observed=True)['interaction_score'].mean()
+        user_codes, user_ids = pd.factorize(scores.index.get_level_values('user_id'))
+        story_rows = scores.index.get_level_values('story_id').map(self.story_index)
+
+        self.interaction_index = {user_id: row for row, user_id in enumerate(user_ids)}
+        self.user_item_matrix = csr_matrix(
+            (scores.to_numpy(dtype=np.float32), (user_codes, np.asarray(story_rows, dtype=int))),
+            shape=(len(user_ids), len(self.stories))
+        )
+
+    def _index_history(self):
+        """
+        Positions of each user's events in self.history, so that per-user
+        lookups cost O(user's history) instead of a scan of the collection.
+        The history is only ever appended to, positions stay valid.
+        """
+        self.user_history = UserHistoryIndex.build(self.history['user_id'])
+
+    def _history_of(self, user_ids):
+        """History events of the given users, grouped by user in event order"""
+        positions = [self.user_history[uid] for uid in user_ids if uid in self.user_history]
+        if not positions:
+            return self.history.iloc[:0]
+        return self.history.iloc[np.concatenate(positions)]
+
     def _calculate_user_similarity(self):
-        if len(self.user_item_matrix) > 1:
-            sim = cosine_similarity(self.user_item_matrix)
-            self.user_similarity_df = pd.DataFrame(sim, index=self.user_item_matrix.index, columns=self.user_item_matrix.index)
-        else:
-            self.user_similarity_df = pd.DataFrame()
-
-    
-
-    def _content_based_score(self, user_id, story_ids):
-        """Calculate content-based recommendation scores"""
-        user = self.users[self.users['user_id'] == user_id].iloc[0]
-
-        # Get user preferences
-        preferred_genres = user['preferred_genres'].split('|')
-        preferred_characters = user['preferred_characters'].split('|')
-        preferred_emotions = user['preferred_emotions'].split('|')
-        age_range = user['age_range']
-        reading_time_min = user['reading_time_min']
-        reading_time_max = user['reading_time_max']
-
-        scores = []
-        for story_id in story_ids:
-            story = self.stories[self.stories['story_id'] == story_id].iloc[0]
-            score = 0
-
-            # 1. Genre match (weight: 0.25)
-            story_genres = story['genre'].split('|') if isinstance(story['genre'], str) else []
-            genre_matches = sum(1 for genre in preferred_genres if any(g.strip().lower() in genre.lower() for g in story_genres))
-            genre_score = min(genre_matches / len(preferred_genres), 1.0) * 0.25
-            score += genre_score
-
-            # 2. Character match (weight: 0.20)
-            story_tags = story['tags'].lower() if isinstance(story['tags'], str) else ''
-            character_matches = sum(1 for char in preferred_characters if char.lower() in story_tags)
-            character_score = min(character_matches / len(preferred_characters), 1.0) * 0.20
-            score += character_score
-
-            # 3. Emotion/Theme match (weight: 0.20)
-            emotion_matches = sum(1 for emotion in preferred_emotions if emotion.lower() in story_tags)
-            emotion_score = min(emotion_matches / len(preferred_emotions), 1.0) * 0.20
-            score += emotion_score
-
-            # 4. Age appropriateness (weight: 0.20)
-            age_match = story['age_range'] == age_range
-            if age_match:
-                score += 0.20
-            else:
-                # Partial match for adjacent age ranges
-                score += 0.10
+        """
+        Keep only the top-k most similar users (cosine) of every user.
 
-            # 5. Reading time match (weight: 0.10)
-            reading_time = story['reading_time_minutes']
-            if reading_time_min <= reading_time <= reading_time_max:
-                score += 0.10
-            elif abs(reading_time - reading_time_min) <= 2 or abs(reading_time - reading_time_max) <= 2:
-                score += 0.05
+        Similarities are computed one block of users at a time as a sparse
+        product, so memory and time follow the co-interactions instead of
+        users squared. With neighbor_search='lsh' only the candidates
+        returned by the LSH index are compared.
+        """
+        n_users = self.user_item_matrix.shape[0]
+        self.neighbor_ids = np.full((n_users, self.n_neighbors), -1, dtype=np.int32)
+        self.neighbor_weights = np.zeros((n_users, self.n_neighbors), dtype=np.float32)
 
-            # 6. Popularity boost (weight: 0.05)
-            score += story['popularity_score'] * 0.05
+        squares = self.user_item_matrix.multiply(self.user_item_matrix)
+        self.user_norms = np.sqrt(np.asarray(squares.sum(axis=1)).ravel())
 
-            scores.append(score)
+        normalized = normalize(self.user_item_matrix)
+        if self.neighbor_index is not None:
+            self._calculate_lsh_neighbors(normalized)
+            return
 
-        return np.array(scores)
+        transposed = normalized.T.tocsr()
+        for start in range(0, n_users, self.similarity_block_size):
+            block = (normalized[start:start + self.similarity_block_size] @ transposed).tocsr()
+            for offset in range(block.shape[0]):
+                lo, hi = block.indptr[offset], block.indptr[offset + 1]
+                self._set_neighbors(start + offset, block.indices[lo:hi], block.data[lo:hi])
 
-    def _collaborative_score(self, user_id, story_ids):
-        """Calculate collaborative filtering scores"""
-        if user_id not in self.user_similarity_df.index:
-            return np.zeros(len(story_ids))
+    def _calculate_lsh_neighbors(self, normalized):
+        """
+        Approximate top-k: exact cosine, but only over the LSH candidate
+        pairs, merged into the neighbour lists one LSH table at a time.
+        """
+        self.neighbor_index.fit(self.user_item_matrix)
+        n_users = normalized.shape[0]
+        for rows, candidates in self.neighbor_index.candidate_pairs():
+            weights = np.empty(len(rows), dtype=np.float32)
+            for start in range(0, len(rows), self.lsh_pair_block_size):
+                chunk = slice(start, start + self.lsh_pair_block_size)
+                products = normalized[rows[chunk]].multiply(normalized[candidates[chunk]])
+                weights[chunk] = np.asarray(products.sum(axis=1)).ravel()
 
-        # Find similar users
-        similar_users = self.user_similarity_df[user_id].sort_values(ascending=False)[1:11]  # Top 10 similar users
+            # Merge with the current lists, dropping pairs already found by another table
+            listed_rows, slots = np.nonzero(self.neighbor_ids >= 0)
+            rows = np.concatenate([listed_rows, rows])
+            candidates = np.concatenate([self.neighbor_ids[listed_rows, slots], candidates])
+            weights = np.concatenate([self.neighbor_weights[listed_rows, slots], weights])
+            _, unique = np.unique(rows.astype(np.int64) * n_users + candidates, return_index=True)
+            rows, candidates, weights = rows[unique], candidates[unique], weights[unique]
 
-        if len(similar_users) == 0:
-            return np.zeros(len(story_ids))
+            # Rank the candidates of every user by decreasing similarity
+            # (rows are sorted; weights are cosines in [0, 1])
+            order = np.argsort(rows + (1 - weights.astype(np.float64)) * 0.5, kind='stable')
+            rows, candidates, weights = rows[order], candidates[order], weights[order]
+            rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+            keep = (rank < self.n_neighbors) & (weights > 0)
+            self.neighbor_ids[rows[keep], rank[keep]] = candidates[keep]
+            self.neighbor_weights[rows[keep], rank[keep]] = weights[keep]
 
-        scores = []
-        for story_id in story_ids:
-            # Average interaction score from similar users
-            if story_id in self.user_item_matrix.columns:
-                similar_user_scores = self.user_item_matrix.loc[similar_users.index, story_id]
-                weighted_score = (similar_user_scores * similar_users.values).sum() / similar_users.sum()
-                scores.append(weighted_score)
-            else:
-                scores.append(0)
+    def _set_neighbors(self, row, candidate_ids, candidate_weights):
+        """Store the top-k candidates (excluding the user itself) as the neighbours of a user"""
+        keep = (candidate_ids != row) & (candidate_weights > 0)
+        ids, weights = _top_k(candidate_ids[keep], candidate_weights[keep], self.n_neighbors)
+        self.neighbor_ids[row] = -1
+        self.neighbor_weights[row] = 0
+        self.neighbor_ids[row, :len(ids)] = ids
+        self.neighbor_weights[row, :len(ids)] = weights
 
-        return np.array(scores)
+    def _preference_vector(self, user_id, profile=None):
+        """
+        Sparse (1 x features) preference vector of a user, from the model or,
+        for users unknown to the model, from the given profile document
+        """
+        if user_id in self.user_index:
+            return self.user_preferences[self.user_index[user_id]]
+        if profile is None:
+            raise KeyError(f"User {user_id} not found")
+        return self._profile_vector(profile)
 
-    def _behavioral_score(self, user_id, story_ids):
-        """Calculate scores based on user behavior patterns"""
-        user_history = self.history[self.history['user_id'] == user_id]
+    def _profile_vector(self, profile):
+        weights = self._user_preference_weights(profile)
+        return csr_matrix(
+            (list(weights.values()), ([0] * len(weights), list(weights.keys()))),
+            shape=(1, self.story_features.shape[1]),
+            dtype=np.float32
+        )
 
-        if len(user_history) == 0:
-            return np.zeros(len(story_ids))
+    def _content_based_score(self, user_id, story_rows, profile=None):
+        """Calculate content-based recommendation scores for the given story rows"""
+        preferences = self._preference_vector(user_id, profile).toarray().ravel()
+        return self.story_features[story_rows] @ preferences
 
-        # Analyze user's reading patterns
-        avg_completion_rate = user_history['reading_progress'].mean() / 100
-        like_rate = user_history['liked'].mean()
-        # Get stories user has engaged with
-        highly_engaged_stories = user_history[
-            (user_history['completed'] == True) &
-            (user_history['liked'] == True)
-        ]['story_id'].tolist()
+    def _collaborative_score(self, user_id, story_rows):
+        """Calculate collaborative filtering scores from the user's top-k neighbours"""
+        row = self.interaction_index.get(user_id)
+        if row is None:
+            return np.zeros(len(story_rows))
 
-        scores = []
-        for story_id in story_ids:
-            score = 0
+        valid = self.neighbor_ids[row] >= 0
+        neighbors = self.neighbor_ids[row][valid]
+        weights = self.neighbor_weights[row][valid]
+        if len(neighbors) == 0:
+            return np.zeros(len(story_rows))
 
-            # Similar to previously liked stories (genre/tag similarity)
-            if len(highly_engaged_stories) > 0:
-                story = self.stories[self.stories['story_id'] == story_id].iloc[0]
-                story_genres = set(story['genre'].split('|')) if isinstance(story['genre'], str) else set()
-                story_tags = set(story['tags'].lower().split(',')) if isinstance(story['tags'], str) else set()
+        # Weighted average of the neighbours' interaction scores
+        scores = self.user_item_matrix[neighbors].T @ weights / weights.sum()
+        return scores[story_rows]
 
-                for engaged_story_id in highly_engaged_stories[:5]:  # Check top 5
-                    if engaged_story_id in self.stories['story_id'].values:
-                        engaged_story = self.stories[self.stories['story_id'] == engaged_story_id].iloc[0]
-                        engaged_genres = set(engaged_story['genre'].split('|')) if isinstance(engaged_story['genre'], str) else set()
-                        engaged_tags = set(engaged_story['tags'].lower().split(',')) if isinstance(engaged_story['tags'], str) else set()
+    def _behavioral_score(self, user_id, story_rows):
+        """Calculate scores based on user behavior patterns"""
+        return self._behavioral_scores_batch([user_id], story_rows)[0]
 
-                        # Genre overlap
-                        genre_overlap = len(story_genres.intersection(engaged_genres)) / max(len(story_genres), 1)
-                        score += genre_overlap * 0.15
+    def _behavioral_scores_batch(self, user_ids, story_rows=slice(None)):
+        """
+        Behavioral scores of several users as a users x stories matrix
+        (restricted to the columns of story_rows).
 
-                        # Tag overlap
-                        tag_overlap = len(story_tags.intersection(engaged_tags)) / max(len(story_tags), 1)
-                        score += tag_overlap * 0.10
+        Each user's (up to) five first completed-and-liked stories form an
+        engagement profile whose genre and tag overlap with every story is
+        computed at once from the story feature matrix (weights 0.15 and
+        0.10), plus the user's completion rate and like rate (0.10 each).
+        """
+        batch_index = {uid: i for i, uid in enumerate(user_ids)}
+        n_columns = len(self.story_set_sizes['genre'][story_rows])
+        scores = np.zeros((len(user_ids), n_columns))
+        history = self._history_of(batch_index)
+        if len(history) == 0:
+            return scores
 
-            # Boost based on user's engagement level
-            score += avg_completion_rate * 0.10
-            score += like_rate * 0.10
+        # Engagement level
+        rates = pd.DataFrame({
+            'user_id': history['user_id'],
+            'completion': history['reading_progress'].astype(float) / 100,
+            'liked': history['liked'].astype(float)
+        }).groupby('user_id', observed=True).mean()
+        rows = rates.index.map(batch_index).to_numpy(dtype=int)
+        scores[rows] += (rates['completion'] * 0.10 + rates['liked'] * 0.10).to_numpy()[:, None]
 
-            scores.append(min(score, 1.0))  # Cap at 1.0
+        # Similarity to previously liked stories (genre/tag overlap)
+        engaged = history[_is_true(history['completed']) & _is_true(history['liked'])]
+        engaged = engaged.groupby('user_id', sort=False).head(5)  # Check top 5
+        engaged_rows = np.array([self.story_index.get(sid, -1) for sid in engaged['story_id']], dtype=int)
+        known = engaged_rows >= 0
+        if known.any():
+            engaged_users = np.array([batch_index[uid] for uid in engaged['user_id']], dtype=int)
+            engaged_rows = engaged_rows[known]
+            # users x engaged events, so that only the engaged story rows are read
+            profiles = csr_matrix(
+                (np.ones(len(engaged_rows)), (engaged_users[known], np.arange(len(engaged_rows)))),
+                shape=(len(user_ids), len(engaged_rows))
+            )
+            for kind, weight in (('genre', 0.15), ('tag', 0.10)):
+                block = self.story_features[:, self.feature_slices[kind]]
+                overlap = (profiles @ block[engaged_rows]) @ block[story_rows].T
+                scores += overlap / np.maximum(self.story_set_sizes[kind][story_rows], 1) * weight
 
-        return np.array(scores)
+        return np.minimum(scores, 1.0)  # Cap at 1.0
 
     def _filter_already_read(self, user_id, story_ids):
         """Remove stories user has already completed"""
-        user_history = self.history[
-            (self.history['user_id'] == user_id) &
-            (self.history['completed'] == True)
-        ]
-        completed_stories = set(user_history['story_id'].tolist())
+        user_history = self._history_of([user_id])
+        completed_stories = set(user_history.loc[_is_true(user_history['completed']), 'story_id'].tolist())
 
         return [sid for sid in story_ids if sid not in completed_stories]
 
-    def recommend_stories(self, user_id, n_recommendations=10, exclude_read=True):
+    @_synchronized
+    def recommend_stories(self, user_id, n_recommendations=10, exclude_read=True, candidate_pool=None,
+                          profile=None, mmr_lambda=None):
         """
         Generate personalized story recommendations
 
+        With a candidate pool, only the stories returned by a cheap candidate
+        generation step (see _candidate_rows) are scored, so that the cost of
+        a request does not grow with the catalogue.
+
         Args:
             user_id: User ID
             n_recommendations: Number of recommendations to return
             exclude_read: Whether to exclude already read stories
+            candidate_pool: Number of candidates to score (default: the
+                model's candidate_pool; None or 0 scores every story)
+            profile: User document used when the user is not part of the
+                model (e.g. signed up after it was built)
+            mmr_lambda: When set (0 to 1), rerank for diversity with Maximal
+                Marginal Relevance: 1 keeps the relevance order, lower values
+                penalize stories similar to those already selected
 
         Returns:
             DataFrame with recommended stories and scores
         """
-        # Get all available stories
-        all_story_ids = self.stories['story_id'].tolist()
+        rows, scores = self._recommend(user_id, n_recommendations, exclude_read, candidate_pool, profile, mmr_lambda)
+        recommendations = pd.DataFrame(scores)
 
-        # Filter out already read stories if requested
-        if exclude_read:
-            candidate_stories = self._filter_already_read(user_id, all_story_ids)
+        # Add the story details of the selected rows
+        details = self.stories.iloc[rows][self.story_detail_columns]
+        recommendations.insert(0, 'story_id', details['story_id'].to_numpy())
+        for column in self.story_detail_columns[1:]:
+            recommendations[column] = details[column].to_numpy()
+        return recommendations
+
+    @_synchronized
+    def recommend_stories_json(self, user_id, n_recommendations=10, exclude_read=True, candidate_pool=None,
+                               profile=None, mmr_lambda=None, fields=None):
+        """
+        Same recommendations as recommend_stories, serialized as a JSON array
+        (bytes) from the cached story fragments. `fields` restricts the keys
+        of each recommendation (e.g. ['story_id', 'recommendation_score']).
+        """
+        rows, scores = self._recommend(user_id, n_recommendations, exclude_read, candidate_pool, profile, mmr_lambda)
+        return self._json_records(rows, scores, fields)
+
+    def _recommend(self, user_id, n_recommendations, exclude_read, candidate_pool, profile, mmr_lambda):
+        """Story rows of the recommendations and their score columns, best first"""
+        if candidate_pool is None:
+            candidate_pool = self.candidate_pool
+
+        preferences = self._preference_vector(user_id, profile)
+        if candidate_pool:
+            read_rows = self._completed_rows(user_id) if exclude_read else np.empty(0, dtype=int)
+            candidate_rows = self._candidate_rows(user_id, preferences, candidate_pool, read_rows)
+            if len(candidate_rows) == 0:
+                print(f"User {user_id} has read all available stories!")
+                candidate_rows = self._candidate_rows(user_id, preferences, candidate_pool)
         else:
-            candidate_stories = all_story_ids
+            # Get all available stories
+            all_story_ids = self.stories['story_id'].tolist()
+
+            # Filter out already read stories if requested
+            if exclude_read:
+                candidate_stories = self._filter_already_read(user_id, all_story_ids)
+            else:
+                candidate_stories = all_story_ids
+
+            if len(candidate_stories) == 0:
+                print(f"User {user_id} has read all available stories!")
+                candidate_stories = all_story_ids  # Fall back to all stories
 
-        if len(candidate_stories) == 0:
-            print(f"User {user_id} has read all available stories!")
-            candidate_stories = all_story_ids  # Fall back to all stories
+            candidate_rows = np.array([self.story_index[sid] for sid in candidate_stories], dtype=int)
 
         # Calculate scores from different approaches
-        content_scores = self._content_based_score(user_id, candidate_stories)
-        collab_scores = self._collaborative_score(user_id, candidate_stories)
-        behavioral_scores = self._behavioral_score(user_id, candidate_stories)
+        content_scores = self._content_based_score(user_id, candidate_rows, profile)
+        collab_scores = self._collaborative_score(user_id, candidate_rows)
+        behavioral_scores = self._behavioral_score(user_id, candidate_rows)
 
         # Combine scores with weights
         # Content: 45%, Collaborative: 30%, Behavioral: 25%
         final_scores = (
-            content_scores * 0.45 +
-            collab_scores * 0.30 +
-            behavioral_scores * 0.25
+            content_scores * self.content_weight +
+            collab_scores * self.collaborative_weight +
+            behavioral_scores * self.behavioral_weight
         )
-        # Create recommendations dataframe
+        if mmr_lambda is None:
+            # Sort by recommendation score
+            selected = pd.Series(final_scores).sort_values(ascending=False).index[:n_recommendations].to_numpy()
+        else:
+            selected = self._mmr_rerank(candidate_rows, final_scores, n_recommendations, mmr_lambda)
+
+        return candidate_rows[selected], {
+            'recommendation_score': final_scores[selected],
+            'content_score': content_scores[selected],
+            'collaborative_score': collab_scores[selected],
+            'behavioral_score': behavioral_scores[selected]
+        }
+
+    def _mmr_rerank(self, story_rows, relevance, n, mmr_lambda):
+        """
+        Positions of n stories chosen greedily by Maximal Marginal Relevance,
+        mmr_lambda * relevance - (1 - mmr_lambda) * (max similarity to the
+        stories already chosen), among the mmr_pool_factor * n most relevant.
+        The similarities between the pool stories are computed at once and
+        the max similarity is updated incrementally: O(n * pool).
+        """
+        pool, _ = _top_k(np.arange(len(relevance)), np.asarray(relevance), n * self.mmr_pool_factor)
+        similarity = self._story_similarity(story_rows[pool], story_rows[pool])['similarity_score']
+        relevance = np.asarray(relevance)[pool]
+
+        selected = []
+        max_similarity = np.zeros(len(pool))
+        available = np.ones(len(pool), dtype=bool)
+        for _ in range(min(n, len(pool))):
+            marginal = np.where(available, mmr_lambda * relevance - (1 - mmr_lambda) * max_similarity, -np.inf)
+            best = int(np.argmax(marginal))
+            selected.append(best)
+            available[best] = False
+            np.maximum(max_similarity, similarity[best], out=max_similarity)
+        return pool[selected]
+
+    def _completed_rows(self, user_id):
+        """Story rows the user has completed"""
+        user_history = self._history_of([user_id])
+        completed = user_history.loc[_is_true(user_history['completed']), 'story_id']
+        return np.array([self.story_index[sid] for sid in completed if sid in self.story_index], dtype=int)
+
+    def _candidate_rows(self, user_id, preferences, pool, exclude_rows=()):
+        """
+        Cheap candidate generation for the two-stage recommend_stories.
+
+        Candidates come, in this order, from the stories read by the user's
+        neighbours (best collaborative score first, up to half of the pool),
+        the stories matching the user's preferred genres, tags, age range
+        and reading times (summing the preference weights over the most
+        popular stories of each of these feature buckets, i.e. a truncated
+        content score) and the most popular stories overall. The first
+        `pool` distinct rows not in exclude_rows are kept.
+        """
+        index = self._get_candidate_index()
+        parts = []
+
+        row = self.interaction_index.get(user_id)
+        if row is not None:
+            valid = self.neighbor_ids[row] >= 0
+            neighbors, weights = self.neighbor_ids[row][valid], self.neighbor_weights[row][valid]
+            if len(neighbors):
+                read = csr_matrix(weights[None, :]) @ self.user_item_matrix[neighbors]
+                parts.append(_top_k(read.indices, read.data, pool // 2)[0])
+
+        depth = pool * self.candidate_bucket_depth
+        buckets = [(index['buckets'][col][:depth], weight)
+                   for col, weight in zip(preferences.indices, preferences.data) if col in index['buckets']]
+        if buckets:
+            rows = np.concatenate([rows for rows, _ in buckets])
+            weights = np.concatenate([np.full(len(rows), weight) for rows, weight in buckets])
+            rows, inverse = np.unique(rows, return_inverse=True)
+            matched = np.bincount(inverse, weights=weights)
+            # Popularity (already the bucket order) breaks the ties
+            matched += self.story_features[rows, self.popularity_column] * 0.05
+            parts.append(_top_k(rows, matched, pool + len(exclude_rows))[0])
+
+        parts.append(index['popular'][:pool + len(exclude_rows)])
+        rows = pd.unique(np.concatenate(parts))
+        rows = rows[~np.isin(rows, exclude_rows)]
+        return rows[:pool]
+
+    def _get_candidate_index(self):
+        """
+        Story rows ordered by popularity, overall and per genre, tag, age
+        and reading time feature column. Built lazily, dropped when a story
+        is added and refreshed at most every candidate_index_max_age seconds
+        as popularity changes.
+        """
+        index = self._candidate_index
+        if index is None or time.monotonic() - index['built_at'] > self.candidate_index_max_age:
+            popularity = self.story_features[:, self.popularity_column]
+            popular = np.argsort(-popularity, kind='stable')
+            buckets = {}
+            for col in range(self.popularity_column):
+                buckets[col] = popular[self.story_features[popular, col] > 0]
+            self._candidate_index = {'popular': popular, 'buckets': buckets, 'built_at': time.monotonic()}
+        return self._candidate_index
+
+    @_synchronized
+    def recommend_stories_batch(self, user_ids, n_recommendations=10, exclude_read=True):
+        """
+        Generate personalized recommendations for many users at once.
+
+        All requested users are scored together as a users x stories score
+        matrix and the top stories of every row are selected with
+        argpartition. Users without a profile are left out.
+
+        Args:
+            user_ids: List of user IDs
+            n_recommendations: Number of recommendations per user
+            exclude_read: Whether to exclude already read stories
+
+        Returns:
+            DataFrame with one row per (user_id, recommended story), ordered by
+            user then decreasing recommendation score
+        """
+        user_ids = list(dict.fromkeys(uid for uid in user_ids if uid in self.user_index))
+        n_stories = len(self.stories)
+        n = min(n_recommendations, n_stories)
+        if not user_ids or n <= 0:
+            return pd.DataFrame(columns=['user_id'] + self._recommendation_columns())
+
+        content_scores = self.user_preferences[[self.user_index[uid] for uid in user_ids]] @ self.story_features.T
+        collab_scores = self._collaborative_scores_batch(user_ids)
+        behavioral_scores = self._behavioral_scores_batch(user_ids)
+
+        final_scores = (
+            content_scores * self.content_weight +
+            collab_scores * self.collaborative_weight +
+            behavioral_scores * self.behavioral_weight
+        )
+
+        ranked = final_scores
+        if exclude_read:
+            read = self._completed_mask(user_ids)
+            read[read.all(axis=1)] = False  # Fall back to all stories
+            ranked = np.where(read, -np.inf, final_scores)
+
+        # Top n per row, then sorted by decreasing score
+        top = np.argpartition(-ranked, n - 1, axis=1)[:, :n]
+        order = np.argsort(-np.take_along_axis(ranked, top, axis=1), axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        batch_rows = np.repeat(np.arange(len(user_ids)), n)
+        story_rows = top.ravel()
+
         recommendations = pd.DataFrame({
-            'story_id': candidate_stories,
-            'recommendation_score': final_scores,
-            'content_score': content_scores,
-            'collaborative_score': collab_scores,
-            'behavioral_score': behavioral_scores
+            'user_id': np.repeat(np.array(user_ids, dtype=object), n),
+            'story_id': self.stories['story_id'].to_numpy()[story_rows],
+            'recommendation_score': final_scores[batch_rows, story_rows],
+            'content_score': content_scores[batch_rows, story_rows],
+            'collaborative_score': collab_scores[batch_rows, story_rows],
+            'behavioral_score': behavioral_scores[batch_rows, story_rows]
         })
+        details = self.stories[self.story_detail_columns[1:]].iloc[story_rows].reset_index(drop=True)
+        return pd.concat([recommendations, details], axis=1)
+
+    def _recommendation_columns(self):
+        return (['story_id', 'recommendation_score', 'content_score', 'collaborative_score',
+                 'behavioral_score'] + self.story_detail_columns[1:])
+
+    def _collaborative_scores_batch(self, user_ids):
+        """Collaborative scores of several users as a users x stories matrix"""
+        rows, cols, values = [], [], []
+        for batch_row, user_id in enumerate(user_ids):
+            row = self.interaction_index.get(user_id)
+            if row is None:
+                continue
+            valid = self.neighbor_ids[row] >= 0
+            weights = self.neighbor_weights[row][valid]
+            if len(weights) == 0:
+                continue
+            rows.extend([batch_row] * len(weights))
+            cols.extend(self.neighbor_ids[row][valid])
+            values.extend(weights / weights.sum())
 
-        # Merge with story details
-        recommendations = recommendations.merge(
-            self.stories[['story_id', 'title', 'genre', 'tags', 'reading_time', 'age_range',
-                         'views', 'likes', 'image_url', 'url']],
-            on='story_id',
-            how='left'
+        neighbor_weights = csr_matrix(
+            (values, (rows, cols)),
+            shape=(len(user_ids), self.user_item_matrix.shape[0])
         )
+        return (neighbor_weights @ self.user_item_matrix).toarray()
 
-        # Sort by recommendation score
-        recommendations = recommendations.sort_values('recommendation_score', ascending=False).head(n_recommendations)
-        return recommendations
-    
+    def _completed_mask(self, user_ids):
+        """Boolean users x stories matrix of the stories each user has completed"""
+        batch_index = {uid: i for i, uid in enumerate(user_ids)}
+        completed = self._history_of(batch_index)
+        completed = completed[
+            _is_true(completed['completed']) &
+            completed['story_id'].isin(list(self.story_index))
+        ]
+        mask = np.zeros((len(user_ids), len(self.stories)), dtype=bool)
+        mask[completed['user_id'].map(batch_index).to_numpy(dtype=int),
+             completed['story_id'].map(self.story_index).to_numpy(dtype=int)] = True
+        return mask
+
+    @_synchronized
     def recommend_similar_stories(self, story_id, n_recommendations=10):
         """
         Recommend stories similar to a given story
         Based on: genre, tags, age range, reading time
-        
+
+        Served from the precomputed top-N similarity index; only requests for
+        more than N stories are computed on the fly.
+
         Args:
             story_id: The story ID to find similar stories for
             n_recommendations: Number of similar stories to return
-            
+
         Returns:
             DataFrame with similar stories and similarity scores
         """
-        # Get the reference story
-        if story_id not in self.stories['story_id'].values:
+        row = self.story_index.get(story_id)
+        if row is None:
             print(f"❌ Story {story_id} not found!")
             return pd.DataFrame()
-        
-        reference_story = self.stories[self.stories['story_id'] == story_id].iloc[0]
-        
-        # Extract reference story features
-        ref_genres = set(reference_story['genre'].split('|')) if isinstance(reference_story['genre'], str) else set()
-        ref_tags = set(reference_story['tags'].lower().split(',')) if isinstance(reference_story['tags'], str) else set()
-        ref_age_range = reference_story['age_range']
-        ref_reading_time = reference_story['reading_time_minutes']
-        
-        # Calculate similarity for all other stories
-        similarity_scores = []
-        
-        for _, story in self.stories.iterrows():
-            if story['story_id'] == story_id:
-                continue  # Skip the reference story itself
-            
-            similarity = 0
-            details = {}
-            
-            # 1. Genre similarity (weight: 0.35)
-            story_genres = set(story['genre'].split('|')) if isinstance(story['genre'], str) else set()
-            genre_overlap = len(ref_genres.intersection(story_genres))
-            genre_similarity = genre_overlap / max(len(ref_genres), len(story_genres)) if ref_genres or story_genres else 0
-            similarity += genre_similarity * 0.35
-            details['genre_similarity'] = genre_similarity
-            
-            # 2. Tags/themes similarity (weight: 0.30)
-            story_tags = set(story['tags'].lower().split(',')) if isinstance(story['tags'], str) else set()
-            tag_overlap = len(ref_tags.intersection(story_tags))
-            tag_similarity = tag_overlap / max(len(ref_tags), len(story_tags)) if ref_tags or story_tags else 0
-            similarity += tag_similarity * 0.30
-            details['tag_similarity'] = tag_similarity
-            
-            # 3. Age range match (weight: 0.20)
-            age_match = 1.0 if story['age_range'] == ref_age_range else 0.5
-            similarity += age_match * 0.20
-            details['age_match'] = age_match
-            
-            # 4. Reading time similarity (weight: 0.15)
-            time_diff = abs(story['reading_time_minutes'] - ref_reading_time)
-            time_similarity = max(0, 1 - (time_diff / 10))  # Penalize differences > 10 mins
-            similarity += time_similarity * 0.15
-            details['time_similarity'] = time_similarity
-            
-            similarity_scores.append({
-                'story_id': story['story_id'],
-                'title': story['title'],
-                'genre': story['genre'],
-                'tags': story['tags'],
-                'age_range': story['age_range'],
-                'reading_time': story['reading_time'],
-                'views': story['views'],
-                'likes': story['likes'],
-                'image_url': story['image_url'],
-                'url': story['url'],
-                'similarity_score': similarity,
-                'genre_similarity': details['genre_similarity'],
-                'tag_similarity': details['tag_similarity'],
-                'age_match': details['age_match'],
-                'time_similarity': details['time_similarity']
-            })
-        
-        # Create DataFrame and sort by similarity
-        similar_stories = pd.DataFrame(similarity_scores)
-        similar_stories = similar_stories.sort_values('similarity_score', ascending=False)
-        
-        return similar_stories.head(n_recommendations)
\ No newline at end of file
+
+        if n_recommendations <= self.n_similar:
+            similar_rows = self.similar_ids[row]
+            similar_rows = similar_rows[similar_rows >= 0][:n_recommendations]
+        else:
+            scores = self._story_similarity(np.array([row]))['similarity_score'][0]
+            others = np.flatnonzero(np.arange(len(self.stories)) != row)
+            similar_rows, _ = _top_k(others, scores[others], n_recommendations)
+
+        similar_stories = self.stories.iloc[similar_rows][
+            ['story_id', 'title', 'genre', 'tags', 'age_range', 'reading_time',
+             'views', 'likes', 'image_url', 'url']
+        ].reset_index(drop=True)
+        for name, values in self._story_similarity(np.array([row]), similar_rows).items():
+            similar_stories[name] = values[0]
+
+        return similar_stories
+
+    def _story_similarity(self, rows, candidates=slice(None)):
+        """
+        Similarity of the stories at `rows` with the `candidates` stories, as
+        (rows x candidates) matrices: the weighted similarity_score and its
+        genre (0.35), tag (0.30), age (0.20) and reading time (0.15) components.
+        """
+        features = self.story_features
+
+        def overlap(kind):
+            block = self.feature_slices[kind]
+            reference, other = features[rows, block], features[candidates, block]
+            sizes = self.story_set_sizes[kind]
+            largest = np.maximum(sizes[rows][:, None], sizes[candidates][None, :])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return np.where(largest > 0, (reference @ other.T) / largest, 0.0)
+
+        age_block = self.feature_slices['age']
+        same_age = features[rows, age_block] @ features[candidates, age_block].T
+        minutes = self.stories['reading_time_minutes'].to_numpy(dtype=float)
+        time_diff = np.abs(minutes[candidates][None, :] - minutes[rows][:, None])
+
+        components = {
+            'genre_similarity': overlap('genre'),
+            'tag_similarity': overlap('tag'),
+            'age_match': np.where(same_age > 0, 1.0, 0.5),
+            'time_similarity': np.nan_to_num(np.maximum(0, 1 - time_diff / 10)),  # Penalize differences > 10 mins
+        }
+        similarity_score = (
+            components['genre_similarity'] * 0.35 +
+            components['tag_similarity'] * 0.30 +
+            components['age_match'] * 0.20 +
+            components['time_similarity'] * 0.15
+        )
+        return {'similarity_score': similarity_score, **components}
+
+    def _build_similarity_index(self):
+        """Precompute the top-N most similar stories of every story"""
+        n_stories = len(self.stories)
+        self.similar_ids = np.full((n_stories, self.n_similar), -1, dtype=np.int32)
+        self.similar_scores = np.zeros((n_stories, self.n_similar), dtype=np.float32)
+        for start in range(0, n_stories, self.similarity_block_size):
+            rows = np.arange(start, min(start + self.similarity_block_size, n_stories))
+            self._set_similar(rows, self._story_similarity(rows)['similarity_score'])
+
+    def _set_similar(self, rows, scores):
+        """Store the top-N of each (rows x stories) score row, excluding the story itself"""
+        k = min(self.n_similar, scores.shape[1] - 1)
+        if k <= 0:
+            return
+        scores = scores.copy()
+        scores[np.arange(len(rows)), rows] = -np.inf
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        self.similar_ids[rows, :k] = np.take_along_axis(top, order, axis=1)
+        self.similar_scores[rows, :k] = np.take_along_axis(top_scores, order, axis=1)
+
+    def _add_to_similarity_index(self, row):
+        """Index a newly added story and insert it in the lists it enters"""
+        self.similar_ids = np.vstack([self.similar_ids, np.full((1, self.n_similar), -1, dtype=np.int32)])
+        self.similar_scores = np.vstack([self.similar_scores, np.zeros((1, self.n_similar), dtype=np.float32)])
+        scores = self._story_similarity(np.array([row]))['similarity_score']
+        self._set_similar(np.array([row]), scores)
+
+        scores = scores[0]
+        not_full = self.similar_ids[:, -1] < 0
+        for other in np.flatnonzero(not_full | (scores > self.similar_scores[:, -1])):
+            if other == row:
+                continue
+            valid = self.similar_ids[other] >= 0
+            ids, weights = _top_k(
+                np.append(self.similar_ids[other][valid], row),
+                np.append(self.similar_scores[other][valid], scores[other]),
+                self.n_similar
+            )
+            self.similar_ids[other] = -1
+            self.similar_scores[other] = 0
+            self.similar_ids[other, :len(ids)] = ids
+            self.similar_scores[other, :len(ids)] = weights
+
+    # ======================================================
+    # Trending (time-decayed popularity)
+    # ======================================================
+
+    def _init_trending(self):
+        """Empty decayed counters, then aggregate the whole history"""
+        self._trending_views = np.zeros(len(self.stories))
+        self._trending_likes = np.zeros(len(self.stories))
+        self._trending_time = pd.Timestamp.now(tz='UTC').tz_localize(None)
+        self._trending_position = 0
+        self._update_trending(self._trending_time)
+
+    def _update_trending(self, now):
+        """
+        Decay the per-story view and like counters to `now` and add the
+        History events appended since the last update, each weighted by
+        0.5 ** (age / half-life). Trending scores are the min-max normalized
+        counters blended like the lifetime popularity (views 0.4, likes 0.6).
+        """
+        half_life = pd.Timedelta(days=self.trending_half_life_days)
+        missing = len(self.stories) - len(self._trending_views)
+        if missing > 0:  # Stories added since the last update
+            self._trending_views = np.concatenate([self._trending_views, np.zeros(missing)])
+            self._trending_likes = np.concatenate([self._trending_likes, np.zeros(missing)])
+        decay = 0.5 ** (max(now - self._trending_time, pd.Timedelta(0)) / half_life)
+        self._trending_views *= decay
+        self._trending_likes *= decay
+
+        events = self.history.iloc[self._trending_position:]
+        rows = np.array([self.story_index.get(sid, -1) for sid in events['story_id']], dtype=int)
+        known = rows >= 0
+        if known.any():
+            if 'read_date' in events.columns:
+                read_at = pd.to_datetime(events['read_date'], errors='coerce', utc=True).dt.tz_localize(None)
+                ages = (now - read_at.fillna(now)).to_numpy() / half_life.to_timedelta64()
+            else:
+                ages = np.zeros(len(events))
+            weights = 0.5 ** np.maximum(ages, 0)
+            liked = events['liked'].fillna(False).to_numpy(dtype=bool)
+            np.add.at(self._trending_views, rows[known], weights[known])
+            np.add.at(self._trending_likes, rows[known], (weights * liked)[known])
+        self._trending_position = len(self.history)
+        self._trending_time = now
+
+        def normalized(values):
+            spread = values.max() - values.min() if len(values) else 0
+            return (values - values.min()) / spread if spread > 0 else np.zeros(len(values))
+
+        trending = normalized(self._trending_views) * 0.4 + normalized(self._trending_likes) * 0.6
+        self.stories['trending_score'] = trending
+        self.trending_rows = np.argsort(-trending, kind='stable')
+
+    def _trending_ranking(self, n):
+        rows = self.trending_rows[:n]
+        return rows, self.stories['trending_score'].to_numpy()[rows]
+
+    def _story_records(self, rows, scores):
+        """Serializable recommendations for the given story rows, best first"""
+        records = self.stories.iloc[rows][self.story_detail_columns].to_dict('records')
+        return [{'story_id': record['story_id'], 'recommendation_score': float(score), **record}
+                for record, score in zip(records, scores)]
+
+    @_synchronized
+    def refresh_trending(self, now=None):
+        """
+        Bring the trending scores up to date (meant to be called on a
+        schedule): O(stories + new events), no model rebuild. With
+        popularity='trending' the popularity boost of the content score is
+        refreshed as well.
+        """
+        if now is None:
+            now = pd.Timestamp.now(tz='UTC').tz_localize(None)
+        self._update_trending(now)
+        if self.popularity == 'trending':
+            self.story_features[:, self.popularity_column] = self._popularity_boost()
+            self.model_version = next(_model_versions)
+        self._build_segments()
+
+    def has_history(self, user_id):
+        """Whether the user has any reading history event"""
+        return user_id in self.user_history
+
+    def trending_stories(self, n_recommendations=10):
+        """
+        Cold-start recommendations: the current trending ranking, served from
+        the precomputed order (no scoring).
+
+        Returns:
+            List of dicts (story_id, recommendation_score and story details)
+        """
+        return self._story_records(*self._trending_ranking(n_recommendations))
+
+    # ======================================================
+    # Cold start (users without history)
+    # ======================================================
+
+    def has_profile(self, user_id):
+        """Whether the user's profile is part of the model"""
+        return user_id in self.user_index
+
+    def _segment_key(self, profile):
+        """Cold-start segment of a profile: (age range, preferred genres)"""
+        age = profile.get('age_range')
+        genres = {genre for genre in _tokens(profile.get('preferred_genres'), '|')
+                  if ('genre', genre) in self.feature_index}
+        return (age if ('age', age) in self.feature_index else None, tuple(sorted(genres)))
+
+    def _build_segments(self):
+        """
+        Precompute the ranking of every (age range, single preferred genre)
+        segment, with and without age or genre; segments with several
+        genres are ranked on first use.
+        """
+        self._segments = {}
+        self._user_segments = {}
+        ages = [None] + [value for kind, value in self.feature_index if kind == 'age']
+        genres = [()] + [(value,) for kind, value in self.feature_index if kind == 'genre']
+        for age in ages:
+            for genre in genres:
+                self._segment_ranking((age, genre), self.segment_size)
+
+    def _segment_ranking(self, key, n):
+        """
+        Top-n story rows and scores of a segment, scored like a user without
+        history whose profile only has the segment's age range and genres
+        (the content score, the collaborative and behavioral scores being zero)
+        """
+        ranking = self._segments.get(key)
+        if ranking is None or n > len(ranking[0]):
+            age, genres = key
+            preferences = self._profile_vector({'age_range': age, 'preferred_genres': '|'.join(genres)})
+            scores = self.story_features @ preferences.toarray().ravel() * self.content_weight
+            ranking = _top_k(np.arange(len(scores)), scores, max(n, self.segment_size))
+            self._segments[key] = ranking
+        rows, scores = ranking
+        return rows[:n], scores[:n]
+
+    @_synchronized
+    def cold_start_stories(self, user_id, n_recommendations=10, profile=None):
+        """
+        Recommendations for a user without history, served from precomputed
+        rankings: the ranking of the user's segment (age range, preferred
+        genres) when a profile is known (in the model or given), the
+        trending ranking otherwise.
+
+        Returns:
+            List of dicts (story_id, recommendation_score and story details)
+        """
+        return self._story_records(*self._cold_start_ranking(user_id, n_recommendations, profile))
+
+    @_synchronized
+    def cold_start_stories_json(self, user_id, n_recommendations=10, profile=None, fields=None):
+        """Same as cold_start_stories, serialized like recommend_stories_json"""
+        rows, scores = self._cold_start_ranking(user_id, n_recommendations, profile)
+        return self._json_records(rows, {'recommendation_score': scores}, fields)
+
+    def _cold_start_ranking(self, user_id, n, profile):
+        key = self._user_segments.get(user_id)
+        if key is None:
+            if user_id in self.user_index:
+                profile = self.users.iloc[self.user_index[user_id]].to_dict()
+                key = self._user_segments[user_id] = self._segment_key(profile)
+            elif profile is not None:
+                key = self._segment_key(profile)
+            else:
+                return self._trending_ranking(n)
+        return self._segment_ranking(key, n)
+
+    # ======================================================
+    # JSON serialization
+    # ======================================================
+
+    def _get_fragments(self):
+        """
+        Pre-encoded '"column":value' JSON fragments of every story detail
+        column, per story row. Built on first use and patched by
+        update_interaction / add_story, so that responses are assembled by
+        concatenation instead of encoding every story on every request.
+        """
+        if self._fragments is None:
+            self._fragments = {
+                column: [self._fragment(column, value) for value in self.stories[column].tolist()]
+                for column in self.story_detail_columns
+            }
+        return self._fragments
+
+    @staticmethod
+    def _fragment(column, value):
+        return dumps(column) + b':' + dumps(value)
+
+    def _refresh_fragments(self, row):
+        """Re-encode (or append) the fragments of a story row"""
+        if self._fragments is None:
+            return
+        for column, fragments in self._fragments.items():
+            fragment = self._fragment(column, self.stories.at[row, column])
+            if row < len(fragments):
+                fragments[row] = fragment
+            else:
+                fragments.append(fragment)
+
+    def _json_records(self, rows, scores, fields=None):
+        """
+        JSON array (bytes) of recommendation objects: story_id, the score
+        columns, then the story details, restricted to `fields` if given.
+        """
+        fragments = self._get_fragments()
+        details = self.story_detail_columns[1:]
+        if fields is not None:
+            details = [column for column in details if column in fields]
+            scores = {name: values for name, values in scores.items() if name in fields}
+        with_id = fields is None or 'story_id' in fields
+        story_ids = fragments['story_id']
+        encoded_scores = [[dumps(name) + b':' + number(value) for value in values]
+                          for name, values in scores.items()]
+        encoded_details = [fragments[column] for column in details]
+
+        objects = []
+        for i, row in enumerate(rows):
+            parts = [story_ids[row]] if with_id else []
+            parts += [values[i] for values in encoded_scores]
+            parts += [values[row] for values in encoded_details]
+            objects.append(b'{' + b','.join(parts) + b'}')
+        return b'[' + b','.join(objects) + b']'
+
+    # ======================================================
+    # Incremental updates
+    # ======================================================
+
+    def cache_version(self, user_id):
+        """Version of the model state a user's recommendations depend on"""
+        return self.model_version, self._user_versions.get(user_id, 0)
+
+    @_synchronized
+    def update_interaction(self, user_id, story_id, reading_progress=0, liked=False,
+                           rating=3, completed=False, **fields):
+        """
+        Record a new reading history event without rebuilding the model.
+
+        Patches the history, the story's views/likes and popularity
+        normalization, the user's row of the interaction matrix and the
+        neighbour lists affected by that row.
+
+        Args:
+            user_id: User ID
+            story_id: Story ID
+            reading_progress, liked, rating, completed: History event values
+            **fields: Any other History document fields, kept in the history
+        """
+        event = _prepare_history(pd.DataFrame([dict(
+            fields,
+            user_id=user_id,
+            story_id=story_id,
+            reading_progress=reading_progress,
+            liked=liked,
+            rating=rating,
+            completed=completed
+        )]))
+        self._append_history(event)
+        self.user_history.append(user_id, len(self.history) - 1)
+        self._user_versions[user_id] += 1
+
+        story_row = self.story_index.get(story_id)
+        if story_row is None:
+            return
+
+        views = self.stories.at[story_row, 'views']
+        self.stories.at[story_row, 'views'] = (0 if pd.isna(views) else views) + 1
+        if bool(event.at[0, 'liked']):
+            likes = self.stories.at[story_row, 'likes']
+            self.stories.at[story_row, 'likes'] = (0 if pd.isna(likes) else likes) + 1
+        self._refresh_popularity()
+        self._refresh_fragments(story_row)
+
+        user_history = self._history_of([user_id])
+        same_story = user_history[user_history['story_id'] == story_id]
+        row = self.interaction_index.get(user_id)
+        if row is None:
+            row = self._add_interaction_user(user_id)
+        self.user_item_matrix[row, story_row] = same_story['interaction_score'].mean()
+        self._update_neighbors(row)
+
+    def _append_history(self, event):
+        """
+        Append prepared events, casting them to the history column types so
+        that compact (categorical, float32, ...) columns are not upcast.
+        """
+        for column in event.columns.intersection(self.history.columns):
+            dtype = self.history[column].dtype
+            if isinstance(dtype, pd.CategoricalDtype):
+                new = pd.Index(event[column].dropna().unique()).difference(dtype.categories)
+                if len(new):
+                    self.history[column] = self.history[column].cat.add_categories(new)
+                    dtype = self.history[column].dtype
+            if event[column].dtype != dtype:
+                try:
+                    event[column] = event[column].astype(dtype)
+                except (TypeError, ValueError):
+                    pass
+        self.history = pd.concat([self.history, event], ignore_index=True)
+
+    @_synchronized
+    def add_story(self, story):
+        """
+        Add a story to the catalogue without rebuilding the model.
+
+        Args:
+            story: Story document (story_id, title, genre, tags, reading_time, ...)
+        """
+        story = dict(story)
+        story_id = story['story_id']
+        if story_id in self.story_index:
+            raise ValueError(f"Story {story_id} already exists")
+
+        story['reading_time_minutes'] = _reading_time_minutes(story.get('reading_time'))
+        row = len(self.stories)
+        self.model_version = next(_model_versions)
+        self._candidate_index = None
+        self._segments = {}
+        self._user_segments = {}
+        self.stories = pd.concat([self.stories, pd.DataFrame([story])], ignore_index=True)
+        self.story_index[story_id] = row
+        self._compute_popularity()
+        self._refresh_fragments(row)
+
+        attributes = self._story_attributes(story)
+        if self._is_in_vocabulary(*attributes):
+            self.story_features = np.vstack([self.story_features, self._story_feature_row(*attributes)])
+            self.story_features[:, self.popularity_column] = self._popularity_boost()
+            self._count_story_sets()
+        else:
+            # New genre, tag, age range or reading time: re-encode everything
+            self._build_story_features()
+            self._build_user_profiles()
+
+        self.user_item_matrix.resize((self.user_item_matrix.shape[0], row + 1))
+        if self.neighbor_index is not None:
+            self.neighbor_index.resize_features(row + 1)
+        self._add_to_similarity_index(row)
+
+    def _refresh_popularity(self):
+        self._compute_popularity()
+        self.story_features[:, self.popularity_column] = self._popularity_boost()
+
+    def _add_interaction_user(self, user_id):
+        """Append an empty interaction row (and neighbour list) for a new user"""
+        row = self.user_item_matrix.shape[0]
+        self.interaction_index[user_id] = row
+        self.user_item_matrix.resize((row + 1, self.user_item_matrix.shape[1]))
+        self.user_norms = np.append(self.user_norms, 0)
+        self.neighbor_ids = np.vstack([self.neighbor_ids, np.full((1, self.n_neighbors), -1, dtype=np.int32)])
+        self.neighbor_weights = np.vstack([self.neighbor_weights, np.zeros((1, self.n_neighbors), dtype=np.float32)])
+        return row
+
+    def _update_neighbors(self, row):
+        """Recompute the neighbours of one user and patch the lists it enters or leaves"""
+        vector = self.user_item_matrix[row]
+        self.user_norms[row] = np.sqrt(vector.multiply(vector).sum())
+        if self.neighbor_index is not None:
+            self.neighbor_index.update(row, vector)
+        candidates, weights = self._similar_users(row)
+        self._set_neighbors(row, candidates, weights)
+
+        similarity = dict(zip(candidates, weights))
+        listed = self.neighbor_ids == row
+        for other in np.union1d(np.flatnonzero(listed.any(axis=1)), candidates):
+            if other == row:
+                continue
+            weight = similarity.get(other, 0.0)
+            if weight < self.neighbor_weights[other][listed[other]].max(initial=0):
+                # The user got less similar: a better neighbour may now exist
+                self._set_neighbors(other, *self._similar_users(other))
+            else:
+                self._patch_neighbor(other, row, weight)
+
+    def _similar_users(self, row):
+        """Ids and cosine similarities of the candidate neighbours of a user"""
+        if self.neighbor_index is not None:
+            candidates = self.neighbor_index.query(row)
+            dots = (self.user_item_matrix[candidates] @ self.user_item_matrix[row].T).toarray().ravel()
+        else:
+            # Every user sharing at least one story
+            product = (self.user_item_matrix @ self.user_item_matrix[row].T).tocsc()
+            candidates, dots = product.indices, product.data
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weights = np.nan_to_num(dots / (self.user_norms[candidates] * self.user_norms[row]))
+        return candidates, weights
+
+    def _patch_neighbor(self, row, neighbor, weight):
+        """Replace (or drop) one neighbour in the list of a user"""
+        ids = self.neighbor_ids[row]
+        weights = self.neighbor_weights[row]
+        keep = (ids >= 0) & (ids != neighbor)
+        ids, weights = ids[keep], weights[keep]
+        if weight > 0:
+            ids = np.append(ids, neighbor)
+            weights = np.append(weights, weight)
+        self._set_neighbors(row, ids, weights)
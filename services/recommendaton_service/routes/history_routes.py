@@ -1,11 +1,15 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint
 from db import histories_collection
+from routes.pagination import keyset_page, ndjson_export
 
 history_bp = Blueprint("history_bp", __name__)
 
 @history_bp.route("/", methods=["GET"])
 def get_histories():
-    histories = list(histories_collection.find())
-    for h in histories:
-        h["_id"] = str(h["_id"])
-    return jsonify(histories)
+    """Retourne les historiques page par page (?limit=&after=&fields=)"""
+    return keyset_page(histories_collection, "histories")
+
+@history_bp.route("/export", methods=["GET"])
+def export_histories():
+    """Exporte tous les historiques en NDJSON (?fields=)"""
+    return ndjson_export(histories_collection)
@@ -0,0 +1,68 @@
+import json
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask import Response, jsonify, request, stream_with_context
+
+# ======================================================
+# 📄 Pagination par curseur (_id) et export NDJSON
+# ======================================================
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+EXPORT_BATCH_SIZE = 1000
+
+
+def serialize(value):
+    """Conversion ObjectId -> string, y compris dans les sous-documents et listes (ex. kids[]._id)"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, dict):
+        return {key: serialize(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [serialize(item) for item in value]
+    return value
+
+
+def parse_projection():
+    """?fields=a,b,c -> projection MongoDB (None : tous les champs)"""
+    fields = [f.strip() for f in request.args.get("fields", "").split(",") if f.strip()]
+    return {field: 1 for field in fields} or None
+
+
+def keyset_page(collection, key):
+    """
+    Page de documents triés par _id : ?limit=100&after=<_id>&fields=a,b
+    Réponse : {key: [...], "nextCursor": _id du dernier document ou None, "limit"}
+    La page suivante se demande avec after=nextCursor, sans skip.
+    """
+    try:
+        limit = min(max(int(request.args.get("limit", DEFAULT_LIMIT)), 1), MAX_LIMIT)
+    except ValueError:
+        return jsonify({"error": f"Limite invalide : {request.args.get('limit')}"}), 400
+    query = {}
+    after = request.args.get("after")
+    if after:
+        try:
+            query["_id"] = {"$gt": ObjectId(after)}
+        except InvalidId:
+            return jsonify({"error": f"Curseur invalide : {after}"}), 400
+
+    documents = list(collection.find(query, parse_projection()).sort("_id", 1).limit(limit))
+    next_cursor = str(documents[-1]["_id"]) if len(documents) == limit else None
+    return jsonify({
+        key: [serialize(d) for d in documents],
+        "nextCursor": next_cursor,
+        "limit": limit
+    })
+
+
+def ndjson_export(collection):
+    """Exporte toute la collection en NDJSON (un document par ligne), lu par lots"""
+    projection = parse_projection()
+
+    def generate():
+        cursor = collection.find({}, projection, batch_size=EXPORT_BATCH_SIZE).sort("_id", 1)
+        for document in cursor:
+            yield json.dumps(serialize(document), default=str) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
@@ -5,12 +5,19 @@ story_bp = Blueprint("story_bp", __name__)
 
 @story_bp.route("/", methods=["GET"])
 def get_stories():
-    """Retourne toutes les stories avec pagination"""
+    """
+    Retourne toutes les stories avec pagination.
+    ?count=estimated utilise le nombre estimé (métadonnées de la collection)
+    au lieu de compter tous les documents à chaque page.
+    """
     page = int(request.args.get("page", 1))
     limit = int(request.args.get("limit", 5))
     skip = (page - 1) * limit
 
-    total = stories_collection.count_documents({})
+    if request.args.get("count", "exact") == "estimated":
+        total = stories_collection.estimated_document_count()
+    else:
+        total = stories_collection.count_documents({})
     stories = list(stories_collection.find().skip(skip).limit(limit))
 
     # Conversion ObjectId -> string
@@ -1,11 +1,15 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint
 from db import users_collection
+from routes.pagination import keyset_page, ndjson_export
 
 user_bp = Blueprint("user_bp", __name__)
 
 @user_bp.route("/", methods=["GET"])
 def get_users():
-    users = list(users_collection.find())
-    for u in users:
-        u["_id"] = str(u["_id"])
-    return jsonify(users)
+    """Retourne les utilisateurs page par page (?limit=&after=&fields=)"""
+    return keyset_page(users_collection, "users")
+
+@user_bp.route("/export", methods=["GET"])
+def export_users():
+    """Exporte tous les utilisateurs en NDJSON (?fields=)"""
+    return ndjson_export(users_collection)
@@ -0,0 +1,34 @@
+# serialization.py
+"""JSON encoding of API payloads, with orjson when it is installed"""
+import json
+import math
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # Optional: pip install orjson
+    orjson = None
+
+
+def _native(value):
+    """Plain Python value, with NaN as null"""
+    if isinstance(value, (np.generic, np.ndarray)):
+        value = value.tolist()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def dumps(value):
+    """JSON bytes of a value"""
+    value = _native(value)
+    if orjson is not None:
+        return orjson.dumps(value, default=str)
+    return json.dumps(value, default=str, ensure_ascii=False, allow_nan=False).encode()
+
+
+def number(value):
+    """JSON bytes of a score (null when not finite)"""
+    value = float(value)
+    return repr(value).encode() if math.isfinite(value) else b'null'
@@ -0,0 +1,214 @@
+import argparse
+import gc
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+from werkzeug.serving import make_server
+
+# ======================================================
+# 🚀 Serveur de production pré-forké
+# ======================================================
+#
+# Le processus maître charge le modèle une seule fois puis forke les
+# workers : les matrices numpy/scipy sont partagées en copy-on-write
+# (et via le page cache quand le modèle vient d'un snapshot mmap).
+# Chaque worker sert une requête à la fois sur le socket commun, le
+# scoring pandas/numpy n'étant pas limité par le GIL d'un seul processus.
+#
+#   python serve.py --workers 4 --port 5001
+#   kill -HUP <pid du maître>   # recharge le modèle (snapshot ou MongoDB)
+#
+# Au rechargement, le maître charge le nouveau modèle, démarre une
+# nouvelle génération de workers, puis arrête les anciens une fois leur
+# requête en cours terminée : chaque requête est servie entièrement par
+# l'ancien ou par le nouveau modèle.
+#
+# Tâches de fond (change streams Story/History, tendances ; voir
+# app.start_background_tasks), selon --background-tasks :
+#   master  (défaut) : lancées une seule fois, dans le maître, qui met à
+#           jour son modèle. Les workers servent le modèle tel qu'il était
+#           à leur fork : après des mises à jour, le maître forke une
+#           nouvelle génération de workers (au plus une toutes les
+#           --generation-refresh secondes), comme au rechargement.
+#   workers : lancées dans chaque worker, qui met à jour sa propre copie.
+#           Coût ×N : N change streams ouverts sur MongoDB, chaque
+#           évènement et chaque recalcul des tendances appliqués N fois, et
+#           les pages du modèle partagées en copy-on-write sont recopiées
+#           dans chaque worker au fil des écritures. Une nouvelle génération
+#           repart du modèle du maître, sans ces mises à jour.
+#   none    : pas de tâches de fond.
+#
+# Les écritures (POST /api/recommend/interactions et /api/recommend/stories)
+# reçues par un worker sont transmises au maître par une file partagée :
+# il les applique à son modèle et les compte comme les mises à jour des
+# tâches de fond. Elles sont donc servies par tous les workers à la
+# génération suivante (réponse 202), jamais par un seul d'entre eux.
+
+POLL_INTERVAL_SECONDS = 0.5
+SHUTDOWN_TIMEOUT_SECONDS = 30
+
+
+def run_worker(app_module, listener, background_tasks):
+    """Boucle d'un worker : sert les requêtes jusqu'à SIGTERM"""
+    server = make_server(listener.getsockname()[0], listener.getsockname()[1],
+                         app_module.app, fd=listener.fileno())
+
+    def stop(signum, frame):
+        # shutdown() attend la fin de serve_forever : depuis un autre thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    if background_tasks:
+        app_module.start_background_tasks()
+    server.serve_forever(poll_interval=POLL_INTERVAL_SECONDS)
+
+
+def spawn_worker(app_module, listener, background_tasks, lock=None):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            if lock is not None:
+                lock.release()  # Verrou du modèle tenu par le maître pendant le fork
+            run_worker(app_module, listener, background_tasks)
+        except Exception as e:
+            print(f"❌ Worker {os.getpid()} arrêté :", e)
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def spawn_workers(app_module, listener, args, count):
+    """
+    (pids, mises à jour du modèle incluses) de `count` nouveaux workers.
+    Le verrou du modèle est tenu pendant les forks : aucune mise à jour
+    des tâches de fond du maître n'est à moitié appliquée dans les workers.
+    """
+    background_tasks = args.background_tasks == "workers"
+    lock = app_module.model_lock()
+    if lock is None:
+        return {spawn_worker(app_module, listener, background_tasks) for _ in range(count)}, 0
+    with lock:
+        pids = {spawn_worker(app_module, listener, background_tasks, lock) for _ in range(count)}
+        return pids, app_module.model_updates()
+
+
+def apply_forwarded_writes(app_module, writes):
+    """Thread du maître : applique à son modèle les écritures transmises par les workers"""
+    while True:
+        kind, data = writes.get()
+        try:
+            app_module.apply_model_write(kind, data)
+        except Exception as e:
+            print(f"❌ Écriture transmise ({kind}) non appliquée :", e)
+
+
+def stop_workers(pids):
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serveur pré-forké du service de recommandation")
+    parser.add_argument("--host", default=os.getenv("RECO_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("RECO_PORT", "5001")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("RECO_WORKERS", os.cpu_count() or 1)))
+    parser.add_argument("--backlog", type=int, default=1024)
+    parser.add_argument("--background-tasks", choices=("master", "workers", "none"),
+                        default=os.getenv("RECO_BACKGROUND_TASKS", "master"),
+                        help="Processus qui exécutent les change streams et le rafraîchissement des tendances")
+    parser.add_argument("--generation-refresh", type=float,
+                        default=float(os.getenv("RECO_GENERATION_REFRESH", "300")),
+                        help="Délai minimal (s) entre deux générations de workers forkées après des mises à jour")
+    args = parser.parse_args()
+
+    import app as app_module  # Charge le modèle dans le maître
+
+    # Les objets du modèle ne seront plus parcourus par le GC des workers,
+    # ce qui évite de dupliquer leurs pages en écrivant leurs en-têtes.
+    gc.freeze()
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((args.host, args.port))
+    listener.listen(args.backlog)
+    listener.set_inheritable(True)
+
+    state = {"reload": False, "stop": False}
+    signal.signal(signal.SIGHUP, lambda signum, frame: state.update(reload=True))
+    signal.signal(signal.SIGTERM, lambda signum, frame: state.update(stop=True))
+    signal.signal(signal.SIGINT, lambda signum, frame: state.update(stop=True))
+
+    writes = multiprocessing.SimpleQueue()
+    app_module.forward_model_writes(writes.put)
+    threading.Thread(target=apply_forwarded_writes, args=(app_module, writes),
+                     name="forwarded-writes", daemon=True).start()
+    if args.background_tasks == "master":
+        app_module.start_background_tasks()
+    workers, generation_updates = spawn_workers(app_module, listener, args, args.workers)
+    generation_time = time.monotonic()
+    print(f"🚀 {args.workers} workers sur {args.host}:{args.port} (maître {os.getpid()})")
+
+    while not state["stop"]:
+        if state["reload"]:
+            state["reload"] = False
+            print("🔄 Rechargement du modèle...")
+            gc.unfreeze()
+            if app_module.reload_model():
+                gc.collect()
+                gc.freeze()
+                old_workers = workers
+                workers, generation_updates = spawn_workers(app_module, listener, args, args.workers)
+                generation_time = time.monotonic()
+                stop_workers(old_workers)
+                print("✅ Nouveau modèle servi par une nouvelle génération de workers.")
+            else:
+                gc.freeze()
+                print("❌ Rechargement échoué, l'ancien modèle reste servi.")
+
+        # Modèle du maître mis à jour (tâches de fond, écritures transmises) : nouvelle génération
+        if (app_module.model_updates() != generation_updates
+                and time.monotonic() - generation_time >= args.generation_refresh):
+            gc.freeze()
+            old_workers = workers
+            workers, generation_updates = spawn_workers(app_module, listener, args, args.workers)
+            generation_time = time.monotonic()
+            stop_workers(old_workers)
+            print("🔄 Mises à jour du modèle servies par une nouvelle génération de workers.")
+
+        # Récupère les workers terminés et remplace ceux de la génération courante
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            if pid in workers:
+                workers.discard(pid)
+                print(f"⚠️ Worker {pid} terminé ({status}), redémarrage.")
+                workers |= spawn_workers(app_module, listener, args, 1)[0]
+        time.sleep(POLL_INTERVAL_SECONDS)
+
+    stop_workers(workers)
+    deadline = time.monotonic() + SHUTDOWN_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        try:
+            if os.waitpid(-1, os.WNOHANG)[0] == 0:
+                time.sleep(0.1)
+        except ChildProcessError:
+            break
+    listener.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Tests of the recommendation routes of app.py, with a model built from
+synthetic data and loaded as a snapshot (MongoDB is not used).
+
+    python -m pytest test_app.py      (from services/recommendaton_service)
+"""
+import importlib
+import json
+import os
+import sys
+
+import pytest
+
+from benchmarks.synthetic import generate_dataset
+from model_snapshot import publish_snapshot
+from recommendation_system import StoryRecommendationSystem
+
+NEW_STORY = {'story_id': 'new-story', 'title': 'New', 'genre': 'fantasy', 'tags': 'magic',
+             'reading_time': '3 mins read', 'age_range': '6-8', 'views': 0, 'likes': 0,
+             'image_url': '', 'url': ''}
+
+
+@pytest.fixture(scope='module')
+def app_module(tmp_path_factory):
+    """app.py serving a snapshot of a synthetic model"""
+    snapshot_dir = tmp_path_factory.mktemp('snapshots')
+    publish_snapshot(StoryRecommendationSystem(*generate_dataset(100, 40, events_per_user=6)), snapshot_dir)
+    os.environ['RECO_SNAPSHOT_DIR'] = str(snapshot_dir)
+    # The chatbot service also has an app module
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.modules.pop('app', None)
+    module = importlib.import_module('app')
+    assert module.rec_system is not None
+    yield module
+    del os.environ['RECO_SNAPSHOT_DIR']
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def forwarded(app_module):
+    """Writes forwarded by the routes, as in the workers of serve.py"""
+    writes = []
+    app_module.forward_model_writes(writes.append)
+    yield writes
+    app_module.forward_model_writes(None)
+
+
+def test_forwarded_writes_leave_the_worker_model_unchanged(app_module, client, forwarded):
+    system = app_module.rec_system
+    stories, history = len(system.stories), len(system.history)
+
+    response = client.post('/api/recommend/stories', json=NEW_STORY)
+    assert response.status_code == 202
+    event = {'user_id': 'user_1', 'story_id': '2', 'reading_progress': 100, 'completed': True}
+    response = client.post('/api/recommend/interactions', json=event)
+    assert response.status_code == 202
+
+    assert forwarded == [('story', NEW_STORY), ('interaction', event)]
+    assert (len(system.stories), len(system.history)) == (stories, history)
+
+
+def test_forwarded_story_that_exists_is_rejected(client, forwarded):
+    response = client.post('/api/recommend/stories', json={'story_id': '1'})
+    assert response.status_code == 409
+    assert forwarded == []
+
+
+def test_applied_writes_are_counted(app_module):
+    updates = app_module.model_updates()
+    app_module.apply_model_write('story', dict(NEW_STORY, story_id='applied-story'))
+    app_module.apply_model_write('interaction', {'user_id': 'user_1', 'story_id': 'applied-story'})
+
+    assert app_module.model_updates() == updates + 2
+    assert 'applied-story' in app_module.rec_system.story_index
+    assert app_module.rec_system.has_history('user_1')
+
+
+def test_writes_without_serve_are_applied(app_module, client):
+    response = client.post('/api/recommend/stories', json=dict(NEW_STORY, story_id='direct-story'))
+    assert response.status_code == 201
+    assert 'direct-story' in app_module.rec_system.story_index
+
+
+def batch_lines(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+@pytest.mark.parametrize('n', [3, '3'])
+def test_batch_n(client, n):
+    response = client.post('/api/recommend/batch', json={'user_ids': ['user_1', 'unknown-user'], 'n': n})
+    assert response.status_code == 200
+    known, unknown = batch_lines(response)
+    assert known['user_id'] == 'user_1' and len(known['recommendations']) == 3
+    assert 'error' in unknown
+
+
+@pytest.mark.parametrize('n', [0, -1, 'abc', '', 2.5, True, None, [3]])
+def test_batch_invalid_n_is_a_json_400(client, n):
+    response = client.post('/api/recommend/batch', json={'user_ids': ['user_1'], 'n': n})
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_batch_n_is_capped(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module, 'BATCH_MAX_RECOMMENDATIONS', 4)
+    response = client.post('/api/recommend/batch', json={'user_ids': ['user_1'], 'n': 1000})
+    assert response.status_code == 200
+    assert len(batch_lines(response)[0]['recommendations']) == 4
@@ -0,0 +1,118 @@
+"""
+Tests of the incremental model updates (update_interaction, add_story):
+a model built on part of the data and updated with the rest matches a
+model rebuilt on all of it.
+
+    python -m pytest test_incremental_updates.py      (from services/recommendaton_service)
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import generate_dataset
+from recommendation_system import StoryRecommendationSystem
+
+NEW_STORIES = 5
+
+
+def split_dataset(seed):
+    """
+    (stories, users, initial history, replayed history, new stories): the
+    replayed events come after the initial ones and include every event
+    of the new stories
+    """
+    stories, users, history = generate_dataset(150, 50, events_per_user=8, seed=seed)
+    new_stories = stories.iloc[-NEW_STORIES:]
+    late = np.arange(len(history)) >= len(history) * 3 // 4
+    replayed = late | history['story_id'].isin(new_stories['story_id'])
+    return stories, users, history[~replayed], history[replayed], new_stories
+
+
+def updated_and_rebuilt(seed, **options):
+    stories, users, initial, replayed, new_stories = split_dataset(seed)
+    updated = StoryRecommendationSystem(stories.iloc[:-NEW_STORIES], users, initial, **options)
+    for story in new_stories.to_dict('records'):
+        updated.add_story(story)
+    for event in replayed.to_dict('records'):
+        updated.update_interaction(**event)
+
+    # Each replayed event counts a view (and a like) of its story
+    counts = replayed.groupby('story_id').agg(views=('liked', 'size'), likes=('liked', 'sum'))
+    stories = stories.set_index('story_id')
+    stories[['views', 'likes']] += counts.reindex(stories.index, fill_value=0)
+    rebuilt = StoryRecommendationSystem(stories.reset_index(), users, pd.concat([initial, replayed]), **options)
+    return updated, rebuilt
+
+
+@pytest.fixture(scope='module', params=[0, 1])
+def models(request):
+    return updated_and_rebuilt(request.param)
+
+
+def neighbours(system, user_id):
+    """{neighbour id: weight} of a user"""
+    users = {row: uid for uid, row in system.interaction_index.items()}
+    row = system.interaction_index[user_id]
+    return {users[n]: float(w)
+            for n, w in zip(system.neighbor_ids[row], system.neighbor_weights[row]) if n >= 0}
+
+
+def test_interaction_rows_match(models):
+    updated, rebuilt = models
+    assert set(updated.interaction_index) == set(rebuilt.interaction_index)
+    columns = [updated.story_index[sid] for sid in rebuilt.stories['story_id']]
+    for user_id, row in rebuilt.interaction_index.items():
+        np.testing.assert_allclose(
+            updated.user_item_matrix[updated.interaction_index[user_id]].toarray()[0, columns],
+            rebuilt.user_item_matrix[row].toarray()[0], atol=1e-6, err_msg=user_id
+        )
+
+
+def test_neighbours_match(models):
+    updated, rebuilt = models
+    for user_id in rebuilt.interaction_index:
+        expected = neighbours(rebuilt, user_id)
+        found = neighbours(updated, user_id)
+        # Ties at the last kept weight may be broken differently
+        cut = min(expected.values(), default=0) + 1e-5
+        kept = {u for u, w in expected.items() if w > cut}
+        assert kept == {u for u, w in found.items() if w > cut}, user_id
+        assert all(abs(found[u] - expected[u]) < 1e-5 for u in kept), user_id
+
+
+def test_scores_match(models):
+    updated, rebuilt = models
+    updated_rows = [updated.story_index[sid] for sid in rebuilt.stories['story_id']]
+    rebuilt_rows = np.arange(len(rebuilt.stories))
+    for user_id in rebuilt.users['user_id']:
+        for score in ('_content_based_score', '_collaborative_score', '_behavioral_score'):
+            np.testing.assert_allclose(getattr(updated, score)(user_id, updated_rows),
+                                       getattr(rebuilt, score)(user_id, rebuilt_rows),
+                                       atol=1e-5, err_msg=f"{score} {user_id}")
+
+
+def test_recommendations_match(models):
+    updated, rebuilt = models
+    for user_id in ['user_0', 'user_7', 'user_33', 'user_149']:
+        assert (updated.recommend_stories(user_id, 10)['story_id'].tolist() ==
+                rebuilt.recommend_stories(user_id, 10)['story_id'].tolist()), user_id
+    batch = ['user_1', 'user_2', 'user_3']
+    pd.testing.assert_frame_equal(updated.recommend_stories_batch(batch, 5).reset_index(drop=True),
+                                  rebuilt.recommend_stories_batch(batch, 5).reset_index(drop=True),
+                                  check_dtype=False)
+
+
+def test_new_stories_are_recommended_and_similar(models):
+    updated, rebuilt = models
+    new_ids = rebuilt.stories['story_id'].iloc[-NEW_STORIES:]
+    for story_id in new_ids:
+        assert (set(updated.recommend_similar_stories(story_id, 5)['story_id']) ==
+                set(rebuilt.recommend_similar_stories(story_id, 5)['story_id'])), story_id
+    everything = updated.recommend_stories('user_0', len(updated.stories), exclude_read=False)
+    assert set(new_ids) <= set(everything['story_id'])
+
+
+def test_existing_story_is_refused(models):
+    updated, _ = models
+    with pytest.raises(ValueError):
+        updated.add_story({'story_id': '1'})
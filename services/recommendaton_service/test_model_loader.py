@@ -0,0 +1,82 @@
+"""
+Tests of the typed MongoDB loading (model_loader.py): documents with
+missing fields load and build a working model.
+
+    python -m pytest test_model_loader.py      (from services/recommendaton_service)
+"""
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import generate_dataset
+from model_loader import load_collection, HISTORY_FIELDS
+from recommendation_system import StoryRecommendationSystem
+
+
+class FakeCollection:
+    """The find() of a pymongo collection, projection included"""
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def find(self, query, projection, batch_size=None):
+        return ({field: value for field, value in document.items() if projection.get(field)}
+                for document in self.documents)
+
+
+def history_without(fields, every=3, seed=0):
+    """(stories, users, typed history) where every `every`th History document lacks `fields`"""
+    stories, users, history = generate_dataset(60, 40, events_per_user=6, seed=seed)
+    documents = history.to_dict('records')
+    for document in documents[::every]:
+        for field in fields:
+            document.pop(field)
+    return stories, users, load_collection(FakeCollection(documents), HISTORY_FIELDS, batch_size=50)
+
+
+def test_typed_columns():
+    _, _, history = history_without(['completed', 'liked'])
+    assert history['user_id'].dtype == 'category'
+    assert history['completed'].dtype == 'boolean'
+    assert history['completed'].isna().sum() == len(history[::3])
+    assert history['reading_progress'].dtype == np.float32
+
+
+def test_history_without_completed_builds_the_model():
+    stories, users, history = history_without(['completed', 'liked', 'rating', 'reading_progress'])
+    system = StoryRecommendationSystem(stories, users, history)
+
+    assert np.isfinite(system.user_item_matrix.data).all()
+    assert not system.history['completed'].isna().any()
+    recommendations = system.recommend_stories('user_0', 5)
+    assert len(recommendations) == 5
+    batch = system.recommend_stories_batch(['user_0', 'user_1'], 5)
+    assert len(batch) == 10
+    assert len(system.recommend_stories_json('user_2', 5))
+
+
+def test_missing_completed_counts_as_not_completed():
+    stories, users, history = history_without(['completed'], every=1)
+    system = StoryRecommendationSystem(stories, users, history)
+    read = system.history.loc[system.history['user_id'] == 'user_0', 'story_id']
+
+    # Nothing is completed, so read stories can still be recommended
+    assert len(system._completed_rows('user_0')) == 0
+    assert not system._completed_mask(['user_0']).any()
+    recommended = system.recommend_stories('user_0', len(stories))['story_id']
+    assert set(read) <= set(recommended)
+
+
+def test_missing_fields_match_the_default_values():
+    stories, users, history = generate_dataset(60, 40, events_per_user=6, seed=1)
+    defaults = history.assign(completed=False, liked=False)
+    documents = history.drop(columns=['completed', 'liked']).to_dict('records')
+    # A single document keeps the fields, so that the columns exist
+    documents[0].update(completed=False, liked=False)
+    typed = load_collection(FakeCollection(documents), HISTORY_FIELDS)
+
+    expected = StoryRecommendationSystem(stories, users, defaults)
+    system = StoryRecommendationSystem(stories, users, typed)
+    pd.testing.assert_series_equal(
+        system.recommend_stories('user_3', 10)['story_id'].reset_index(drop=True),
+        expected.recommend_stories('user_3', 10)['story_id'].reset_index(drop=True)
+    )
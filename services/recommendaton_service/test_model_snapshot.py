@@ -0,0 +1,135 @@
+"""
+Tests of the model snapshots (model_snapshot.py): a loaded snapshot
+serves and updates like the model it was saved from, and maps its arrays
+instead of rebuilding or unpickling them.
+
+    python -m pytest test_model_snapshot.py      (from services/recommendaton_service)
+"""
+import json
+import time
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import generate_dataset
+from model_snapshot import (save_snapshot, load_snapshot, publish_snapshot, load_latest_snapshot,
+                            DENSE_ARRAYS, SNAPSHOT_FORMAT)
+from recommendation_system import StoryRecommendationSystem
+
+USERS = ['user_0', 'user_5', 'user_42', 'user_199']
+NEW_STORY = {'story_id': 'new-story', 'title': 'New', 'genre': 'fantasy', 'tags': 'magic',
+             'reading_time': '3 mins read', 'age_range': '6-8', 'views': 0, 'likes': 0,
+             'image_url': '', 'url': ''}
+
+
+def build(seed=0):
+    return StoryRecommendationSystem(*generate_dataset(200, 60, events_per_user=8, seed=seed))
+
+
+def is_mapped(array):
+    """Whether an array is (a view of) a memory-mapped file"""
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = getattr(array, 'base', None)
+    return False
+
+
+def recommended_ids(system, user_id):
+    return system.recommend_stories(user_id, 10, profile={})['story_id'].tolist()
+
+
+@pytest.fixture(scope='module')
+def saved(tmp_path_factory):
+    """(built model, its snapshot directory)"""
+    system = build()
+    directory = tmp_path_factory.mktemp('snapshot') / 'model'
+    save_snapshot(system, directory)
+    return system, directory
+
+
+def test_round_trip_serves_the_same_recommendations(saved):
+    system, directory = saved
+    loaded = load_snapshot(directory)
+
+    for user_id in USERS:
+        assert recommended_ids(loaded, user_id) == recommended_ids(system, user_id)
+        assert loaded.recommend_stories_json(user_id, 5) == system.recommend_stories_json(user_id, 5)
+    assert (loaded.recommend_similar_stories('3', 5)['story_id'].tolist() ==
+            system.recommend_similar_stories('3', 5)['story_id'].tolist())
+    batch = loaded.recommend_stories_batch(USERS, 5)
+    assert batch.equals(system.recommend_stories_batch(USERS, 5))
+
+
+def test_history_and_arrays_are_memory_mapped(saved):
+    _, directory = saved
+    loaded = load_snapshot(directory)
+
+    for name in DENSE_ARRAYS:
+        assert is_mapped(getattr(loaded, name)), name
+    assert is_mapped(loaded.user_history.positions)
+    for column in ('reading_progress', 'completed', 'interaction_score'):
+        assert is_mapped(loaded.history[column].to_numpy()), column
+    for column in ('user_id', 'story_id'):
+        assert is_mapped(loaded.history[column].array.codes), column
+    # Columns the model never reads are not stored
+    assert 'history_id' not in loaded.history
+
+
+def test_updates_after_load_match_the_built_model(tmp_path):
+    system = build(seed=1)
+    save_snapshot(system, tmp_path / 'model')
+    loaded = load_snapshot(tmp_path / 'model')
+
+    for model in (system, loaded):
+        model.add_story(NEW_STORY)
+        model.update_interaction('user_3', 'new-story', reading_progress=100, liked=True, completed=True)
+        model.update_interaction('brand-new-user', '7', reading_progress=40)
+    for user_id in ['user_3', 'brand-new-user'] + USERS:
+        assert recommended_ids(loaded, user_id) == recommended_ids(system, user_id)
+    assert len(loaded.user_history['user_3']) == len(system.user_history['user_3'])
+    # Copy-on-write: the snapshot files are left unchanged
+    assert recommended_ids(load_snapshot(tmp_path / 'model'), 'user_3') != recommended_ids(loaded, 'user_3')
+
+
+def test_updated_model_round_trip(tmp_path):
+    system = build(seed=2)
+    system.update_interaction('brand-new-user', '7', reading_progress=100, completed=True)
+    save_snapshot(system, tmp_path / 'model')
+    loaded = load_snapshot(tmp_path / 'model')
+
+    assert loaded.has_history('brand-new-user')
+    assert recommended_ids(loaded, 'brand-new-user') == recommended_ids(system, 'brand-new-user')
+
+
+def test_load_is_faster_than_a_rebuild(tmp_path):
+    dataset = generate_dataset(2000, 300, events_per_user=20)
+    start = time.perf_counter()
+    system = StoryRecommendationSystem(*dataset)
+    rebuild = time.perf_counter() - start
+    save_snapshot(system, tmp_path / 'model')
+
+    start = time.perf_counter()
+    load_snapshot(tmp_path / 'model')
+    load = time.perf_counter() - start
+    assert load * 10 < rebuild, (load, rebuild)
+
+
+def test_publish_and_load_latest(tmp_path):
+    assert load_latest_snapshot(tmp_path) is None
+    system = build()
+    versions = [publish_snapshot(system, tmp_path, keep=2) for _ in range(3)]
+
+    loaded = load_latest_snapshot(tmp_path)
+    assert loaded.snapshot_version == versions[-1]
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(['CURRENT'] + versions[1:])
+
+
+def test_other_formats_are_refused(saved, tmp_path):
+    system, _ = saved
+    save_snapshot(system, tmp_path / 'model')
+    metadata_path = tmp_path / 'model' / 'metadata.json'
+    metadata = json.loads(metadata_path.read_text())
+    metadata_path.write_text(json.dumps(dict(metadata, format=SNAPSHOT_FORMAT - 1)))
+    with pytest.raises(ValueError):
+        load_snapshot(tmp_path / 'model')
@@ -0,0 +1,32 @@
+from model_loader import USER_FIELDS
+from recommendation_cache import RecommendationCache
+
+# ======================================================
+# 👤 Profils des utilisateurs inscrits après la construction du modèle
+# ======================================================
+
+
+class UserProfileLoader:
+    """
+    Charge à la demande, depuis MongoDB, le profil des utilisateurs absents
+    du modèle. Les profils (et les utilisateurs introuvables) sont gardés
+    dans un petit cache LRU + TTL pour ne pas interroger Mongo à chaque
+    requête.
+    """
+
+    def __init__(self, collection, max_size=1000, ttl=600):
+        self.collection = collection
+        self.projection = {field: 1 for field in USER_FIELDS}
+        self.projection["_id"] = 0
+        self.cache = RecommendationCache(max_size=max_size, ttl=ttl)
+
+    def get(self, user_id):
+        """Profil de l'utilisateur, ou None s'il n'existe pas"""
+        entry = self.cache.get(user_id, 0)
+        if entry is None:
+            entry = (self.collection.find_one({"user_id": user_id}, self.projection),)
+            self.cache.set(user_id, 0, entry)
+        return entry[0]
+
+    def stats(self):
+        return self.cache.stats()